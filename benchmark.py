@@ -0,0 +1,95 @@
+"""
+
+Benchmarks of the bot's CPU-heavy parts.
+Usage:
+    python benchmark.py output <picture>...
+    python benchmark.py parallel [<megapixels> [<millions of symbols>]]
+
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import numpy as np  # noqa: E402
+from loguru import logger  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from misc.crypto_img import HEADER_FORMAT, decrypt_pixels, encrypt  # noqa: E402
+from misc.output import OutputPolicy, compare_outputs  # noqa: E402
+
+
+logger.remove()
+
+
+def benchmark_output(paths: list[str]) -> None:
+    """
+    Prints the size and the time of encoding with each choice of the output.
+    :param paths: Pictures.
+    """
+    for path in paths:
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+        print(f"{path} {img.size[0]}x{img.size[1]}")
+        print(f"  auto: {OutputPolicy().choose(img.size)}")
+        for encoded in compare_outputs(img):
+            params = ", ".join(f"{k}={v}" for k, v in encoded.params.items())
+            print(
+                f"  {encoded.format:<5} {params:<40} "
+                f"{len(encoded.data) / 1024:>10.1f} KB {encoded.seconds:>7.3f} s"
+            )
+
+
+def benchmark_parallel(args: list[str]) -> None:
+    """
+    Prints the time of encryption and decryption of one long text
+    by the number of threads, checking that the results are identical.
+    :param args: Megapixels of the picture and millions of symbols of the text.
+    """
+    megapixels = float(args[0]) if args else 24
+    symbols = int(float(args[1]) * 1_000_000) if len(args) > 1 else 8_000_000
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), np.uint8)
+    image = BytesIO()
+    Image.fromarray(pixels).save(image, "PNG", compress_level=0)
+    # The format without compression, so the length of the text is kept
+    text = "".join(map(chr, np.random.default_rng(1).integers(32, 127, symbols)))
+    print(f"{width}x{height}, {symbols} symbols, {os.cpu_count()} cores")
+
+    threads = 1
+    while threads <= (os.cpu_count() or 1) * 2:
+        started_at = time.perf_counter()
+        encrypted = encrypt(
+            text, "key", BytesIO(image.getvalue()), HEADER_FORMAT, threads=threads
+        )
+        encrypted_at = time.perf_counter()
+        encrypted = np.array(encrypted)
+        decrypted_at = time.perf_counter()
+        decrypted = decrypt_pixels("key", encrypted, threads=threads)
+        times = (encrypted_at - started_at, time.perf_counter() - decrypted_at)
+        assert decrypted == text, "The text is damaged"
+        if threads == 1:
+            single, first = times, encrypted
+        assert (encrypted == first).all(), "The result depends on threads"
+        print(
+            f"  threads {threads:>2}: encrypt {times[0]:>6.2f} s "
+            f"(x{single[0] / times[0]:.2f}), "
+            f"decrypt {times[1]:>6.2f} s (x{single[1] / times[1]:.2f})"
+        )
+        threads *= 2
+
+
+BENCHMARKS = {"output": benchmark_output, "parallel": benchmark_parallel}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(__doc__.strip())
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](sys.argv[2:])
@@ -1,8 +1,21 @@
-from flask import Flask
+from __future__ import annotations
+
+import typing as ty
 
 from config import load_config
 from logger import init_logger
 
 config = load_config()
 init_logger(config)
-app = Flask(__name__)
+
+
+def __getattr__(name: str) -> ty.Any:
+    # The Flask application of the sync runtime is created on first use,
+    # so the async runtime does not import Flask
+    global app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from flask import Flask
+
+    app = Flask(__name__)
+    return app
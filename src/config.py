@@ -82,6 +82,28 @@ class TgBot(ConfigSection):
     token: str
     webhook: TgBotWebhook
     admins: list[int]
+    workers: int = 4
+    updates_queue_size: int = 100
+    runtime: str = "sync"  # sync | async
+    states_storage: str = "memory"  # memory | sqlite | redis
+    states_url: str = ""  # database file for sqlite, server url for redis
+    states_ttl: int = 3600  # seconds without activity (memory and sqlite)
+    # Limits of the memory storage
+    states_max_entries: int = 10000
+    states_max_bytes: int = 64 * 1024 * 1024
+    # Limits of commands
+    rate_limit_storage: str = "memory"  # memory | redis
+    rate_limit_url: str = ""  # server url for redis
+    rate_limit_max_entries: int = 100000  # memory only
+    # Edits of messages with progress of jobs
+    progress_interval: float = 3  # min seconds between edits of a message
+    progress_max_edits: int = 20  # per second in total
+    # Seconds without new pictures after which an album is processed.
+    # Pictures are collected in the memory of the process, so albums are
+    # processed as one batch only if all updates reach one process
+    batch_delay: float = 1
+    # Longer decrypted texts are sent as a .txt document instead of messages
+    text_document_length: int = 16384
 
     required_fields = ["token"]
 
@@ -90,6 +112,11 @@ class TgBot(ConfigSection):
 class TgBotWebhook(ConfigSection):
     host: str
     secret_key: str
+    max_connections: int = 40
+    fast_ack: bool = True
+    # Address of the webhook server of the async runtime
+    listen: str = "0.0.0.0"
+    port: int = 8080
 
     if int(os.getenv("RUN_IN_HOST", "0")):
         required_fields = ["host"]
@@ -100,11 +127,54 @@ class TgBotWebhook(ConfigSection):
         super(TgBotWebhook, self).__post_init__()
 
 
+@dataclass
+class Jobs(ConfigSection):
+    workers: int = 2
+    max_jobs: int = 16
+    timeout: int = 300
+    user_budget: float = 300  # megapixel-seconds per minute, 0 - unlimited
+    pixels_cache_size: int = 128 * 1024 * 1024  # bytes per worker, 0 - disabled
+    # Bytes per job, bigger pictures are processed in strips, 0 - unlimited
+    memory_budget: int = 256 * 1024 * 1024
+    # Threads of one job for long texts, e.g. cores / workers
+    threads_per_job: int = 1
+
+
+@dataclass
+class Images(ConfigSection):
+    max_file_size: int = 20 * 1024 * 1024  # bytes
+    max_pixels: int = 50_000_000
+    # Cache of downloaded files
+    cache_size: int = 64 * 1024 * 1024  # bytes in memory, 0 - disabled
+    cache_dir: str = ""  # directory of the disk tier, empty - disabled
+    cache_dir_size: int = 512 * 1024 * 1024  # bytes on disk
+    # Format of hidden text: 3 - one symbol per pixel, 4 - compressed UTF-8,
+    # 5 - compressed UTF-8 in `bits_per_channel` last bits of every channel
+    text_format: int = 4
+    bits_per_channel: int = 2  # 1-4
+    # Encoding of pictures with hidden text
+    output_format: str = "png"  # png | webp | auto (webp if small, else fast png)
+    png_compress_level: int = 6  # 1 - fastest, 9 - smallest
+    webp_method: int = 4  # 0 - fastest, 6 - smallest
+    large_pixels: int = 4_000_000  # auto: bigger pictures are encoded fast
+    batch_size: int = 10  # max pictures processed as one batch
+
+    def __post_init__(self):
+        # Formats 1 and 2 are only read: their pictures keep no length of the text
+        if self.text_format not in {3, 4, 5}:
+            raise ValueError(f"{self.env_name('text_format')} must be 3, 4 or 5")
+        if self.bits_per_channel not in range(1, 5):
+            raise ValueError(f"{self.env_name('bits_per_channel')} must be 1-4")
+        super(Images, self).__post_init__()
+
+
 @dataclass
 class Config(ConfigSection):
     base: Base
     logger: Logging
     tg_bot: TgBot
+    jobs: Jobs
+    images: Images
 
 
 def load_config() -> Config:
@@ -1,14 +1,20 @@
 from app import app, config  # noqa
-import tg  # noqa
 from loguru import logger  # noqa
 
 logger.info("app started")
 
 
-if config.base.run_in_host:
-    tg.setup_webhook()
-    if __name__ == "__main__":
-        app.run(debug=True)
+if config.tg_bot.runtime == "async":
+    import tg.aio  # noqa
+
+    tg.aio.run()
 else:
-    with app.app_context():
-        tg.run_pooling()
+    import tg.sync  # noqa
+
+    if config.base.run_in_host:
+        tg.sync.setup_webhook()
+        if __name__ == "__main__":
+            app.run(debug=True)
+    else:
+        with app.app_context():
+            tg.sync.run_pooling()
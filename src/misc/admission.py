@@ -0,0 +1,131 @@
+"""
+
+Checks of pictures before they are downloaded and decoded.
+The file is rejected by its metadata first, then by the size of the picture
+from the header, so only the beginning of an unsuitable file is downloaded
+and no picture is decoded just to be refused.
+
+"""
+
+from __future__ import annotations
+
+from io import SEEK_END, BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+from .crypto_header import HEADER_PIXELS
+
+Image.init()
+# Types of pictures Pillow can read
+MIME_TYPES = frozenset(
+    mime for mime in Image.MIME.values() if mime.startswith("image/")
+)
+# Bytes received before the size is looked for the first time,
+# then it is looked for each time the received part doubles
+MIN_HEADER_SIZE = 64
+# Bytes read in search of the size before the file is considered broken
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+class ImageAdmission:
+    def __init__(self, max_file_size: int, max_pixels: int):
+        """
+        :param max_file_size: Max size of a file in bytes.
+        :param max_pixels: Max number of pixels of a picture.
+        """
+        self.max_file_size = max_file_size
+        self.max_pixels = max_pixels
+
+    def check_file(self, file_size: int | None, mime_type: str | None) -> None:
+        """
+        :param file_size: Size of the file, if known.
+        :param mime_type: Type of the file, if known.
+        :raises: RuntimeError.
+        """
+        if mime_type is not None and mime_type not in MIME_TYPES:
+            raise RuntimeError("It's not a picture")
+        if file_size is not None and file_size > self.max_file_size:
+            raise RuntimeError(
+                f"The file is too big, max {self.max_file_size // 1024 // 1024} MB"
+            )
+
+    def check_size(self, size: tuple[int, int], text_length: int = 0) -> None:
+        """
+        :param size: Size of the picture.
+        :param text_length: Length of the text to hide, 0 for decryption.
+        :raises: RuntimeError.
+        """
+        pixels = size[0] * size[1]
+        if pixels > self.max_pixels:
+            raise RuntimeError(
+                f"The picture is too big, max {self.max_pixels / 1_000_000:g} MP"
+            )
+        if text_length and text_length + HEADER_PIXELS > pixels:
+            raise RuntimeError("The picture is too small")
+
+    def reader(self, text_length: int = 0) -> HeaderReader:
+        """
+        :param text_length: Length of the text to hide, 0 for decryption.
+        :returns: Reader of a downloaded file.
+        """
+        return HeaderReader(self, text_length)
+
+
+class HeaderReader:
+    """
+    Collects a file while it is downloaded.
+    The size of the picture is checked as soon as the header is received.
+    The header is parsed each time the received part doubles, so the work
+    is linear in the size of the file, and not after the size is known.
+    """
+
+    def __init__(self, admission: ImageAdmission, text_length: int):
+        self.admission = admission
+        self.text_length = text_length
+        self.size: tuple[int, int] | None = None
+        self._data = BytesIO()
+        self._next_attempt = MIN_HEADER_SIZE  # Bytes to look for the size at
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        :param chunk: Next part of the file.
+        :raises: RuntimeError.
+        """
+        self._data.write(chunk)
+        received = self._data.tell()
+        if received > self.admission.max_file_size:
+            self.admission.check_file(received, None)
+        if self.size is None and received >= self._next_attempt:
+            self._next_attempt = min(received * 2, MAX_HEADER_SIZE + 1)
+            self._read_size()
+
+    def _read_size(self) -> None:
+        """
+        Checks the size of the picture if its header is received.
+        :raises: RuntimeError.
+        """
+        received = self._data.tell()
+        self._data.seek(0)
+        try:
+            with Image.open(self._data) as img:
+                self.size = img.size
+        except Image.DecompressionBombError:
+            raise RuntimeError("The picture is too big")
+        except (UnidentifiedImageError, OSError):
+            if received > MAX_HEADER_SIZE:
+                raise RuntimeError("It's not a picture")
+            return
+        finally:
+            self._data.seek(0, SEEK_END)
+        self.admission.check_size(self.size, self.text_length)
+
+    def getvalue(self) -> bytes:
+        """
+        :returns: Downloaded file.
+        :raises: RuntimeError if the file is not a picture.
+        """
+        if self.size is None:
+            self._read_size()
+        if self.size is None:
+            raise RuntimeError("It's not a picture")
+        return self._data.getvalue()
@@ -0,0 +1,152 @@
+"""
+
+Caches with a budget of bytes.
+Least recently used values are evicted when the budget is exceeded.
+
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import typing as ty
+from collections import OrderedDict
+from hashlib import sha256
+
+import numpy as np
+
+
+def get_size(value: ty.Any) -> int:
+    """
+    :param value: Bytes, numpy array or a tuple of them.
+    :returns: Size of the value in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(map(get_size, value))
+    return len(value)
+
+
+class DiskCache:
+    """
+    Bytes in files of a directory.
+    Files are written atomically, so several processes may share the directory.
+    Each process evicts files by the order of its own use,
+    files removed by other processes are treated as misses.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        :param path: Directory.
+        :param max_bytes: Max size of files.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        # {<file name>: <size>}, least recently used first
+        self._files: OrderedDict[str, int] = OrderedDict()
+        with os.scandir(path) as entries:
+            files = [
+                entry
+                for entry in entries
+                if entry.is_file() and not entry.name.endswith(".tmp")
+            ]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self._files[entry.name] = entry.stat().st_size
+        self._bytes = sum(self._files.values())
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        name = self._name(key)
+        try:
+            with open(os.path.join(self.path, name), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, os.path.join(self.path, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._bytes += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            while self._bytes > self.max_bytes:
+                old_name, size = self._files.popitem(last=False)
+                self._bytes -= size
+                try:
+                    os.unlink(os.path.join(self.path, old_name))
+                except FileNotFoundError:
+                    pass
+
+
+class LRUCache:
+    """
+    Thread-safe cache in memory with an optional disk tier for bytes.
+    Values are written through to the disk and read from it on memory misses.
+    """
+
+    def __init__(self, max_bytes: int, disk: DiskCache | None = None):
+        """
+        :param max_bytes: Max size of values in memory (see `get_size`).
+        :param disk: Disk tier.
+        """
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._lock = threading.Lock()
+        # {<key>: (<value>, <size>)}, least recently used first
+        self._values: OrderedDict[ty.Hashable, tuple[ty.Any, int]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: ty.Hashable) -> ty.Any | None:
+        """
+        :param key: Key.
+        :returns: Value or None if there is no value.
+        """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key][0]
+        if self.disk is None or (value := self.disk.get(key)) is None:
+            return None
+        self._put(key, value)
+        return value
+
+    def put(self, key: ty.Hashable, value: ty.Any) -> None:
+        """
+        :param key: Key.
+        :param value: Bytes, numpy array or a tuple of them.
+        """
+        self._put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _put(self, key: ty.Hashable, value: ty.Any) -> None:
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._values:
+                self._bytes -= self._values.pop(key)[1]
+            self._values[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._values.popitem(last=False)[1][1]
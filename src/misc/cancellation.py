@@ -0,0 +1,55 @@
+"""
+
+Cooperative cancellation of long operations.
+Operations check the token between chunks of work and stop as soon as
+it is cancelled. The flag of a token may live in shared memory,
+so a job in another process is cancelled without killing the process.
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+
+
+class Cancelled(RuntimeError):
+    def __init__(self):
+        super().__init__("The operation was cancelled")
+
+    def __reduce__(self):
+        # Raised in worker processes, so it is pickled without arguments
+        return type(self), ()
+
+
+class CancelToken:
+    def __init__(self, flags: ty.MutableSequence[int] | None = None, index: int = 0):
+        """
+        :param flags: Array of flags, e.g. a shared `multiprocessing.RawArray`.
+            A private flag is created if not passed.
+        :param index: Index of the flag of the token.
+        """
+        self._flags = flags if flags is not None else bytearray(1)
+        self._index = index
+
+    @property
+    def cancelled(self) -> bool:
+        return bool(self._flags[self._index])
+
+    def cancel(self) -> None:
+        self._flags[self._index] = 1
+
+    def check(self) -> None:
+        """
+        :raises: Cancelled if the token is cancelled.
+        """
+        if self._flags[self._index]:
+            raise Cancelled()
+
+
+def check(cancel: CancelToken | None) -> None:
+    """
+    :param cancel: Token or None if the operation can not be cancelled.
+    :raises: Cancelled if the token is cancelled.
+    """
+    if cancel is not None:
+        cancel.check()
@@ -0,0 +1,162 @@
+"""
+
+Vectorized engine for hiding symbols in pictures.
+The picture is loaded into a numpy array once, after which symbols
+are written to / read from whole arrays of pixels at a time.
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+if ty.TYPE_CHECKING:
+    from io import BytesIO
+
+
+def open_image(image: BytesIO) -> Image.Image:
+    """
+    Opens the picture without decoding it, only the header is read.
+    :param image: Initial picture.
+    :returns: Picture.
+    :raises: RuntimeError.
+    """
+    try:
+        return Image.open(image)
+    except UnidentifiedImageError:
+        raise RuntimeError("It's not a picture")
+
+
+def load_image(image: BytesIO | Image.Image) -> tuple[Image.Image, np.ndarray]:
+    """
+    Loads the picture.
+    :param image: Initial picture or the picture from `open_image`.
+    :returns: RGB picture and a writable copy of its pixels (height, width, 3).
+    :raises: RuntimeError.
+    """
+    if not isinstance(image, Image.Image):
+        image = open_image(image)
+    img = image.convert("RGB")
+    return img, np.array(img)
+
+
+def to_image(pixels: np.ndarray, origin: Image.Image) -> Image.Image:
+    """
+    Builds a picture from pixels.
+    :param pixels: Pixels (height, width, 3).
+    :param origin: Picture the pixels were loaded from. Its info is kept.
+    :returns: RGB picture.
+    """
+    img = Image.fromarray(pixels, "RGB")
+    img.info = origin.info.copy()
+    return img
+
+
+def text_to_codes(text: str) -> np.ndarray:
+    """
+    Converts text to the symbol codes that are hidden in pixels.
+    Crutch for Russian letters (their unicode value is too much):
+    codes greater than 1000 are shifted by 890.
+    Only the low 8 bits of the code are stored.
+    :param text: Text.
+    :returns: Codes (uint8).
+    """
+    codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype="<u4")
+    codes = np.where(codes > 1000, codes - 890, codes)
+    return (codes & 0xFF).astype(np.uint8)
+
+
+def codes_to_text(codes: np.ndarray) -> str:
+    """
+    The operation opposite to `text_to_codes`.
+    :param codes: Codes (uint8).
+    :returns: Text.
+    """
+    codes = codes.astype("<u4")
+    codes[codes > 130] += 890  # Return Russian letters
+    return codes.tobytes().decode("utf-32-le")
+
+
+def embed(pixels: np.ndarray, xs: np.ndarray, ys: np.ndarray, codes: np.ndarray):
+    """
+    Puts codes in the last bits of the pixels (in place).
+    Red channel gets bits 5-7 of the code, green - bits 3-4, blue - bits 0-2.
+    :param pixels: Pixels (height, width, 3).
+    :param xs: X coordinates of pixels.
+    :param ys: Y coordinates of pixels.
+    :param codes: Codes (uint8), one per pixel.
+    """
+    target = pixels[ys, xs]
+    target[:, 0] = (target[:, 0] & 0xF8) | (codes >> 5)
+    target[:, 1] = (target[:, 1] & 0xFC) | ((codes >> 3) & 0x3)
+    target[:, 2] = (target[:, 2] & 0xF8) | (codes & 0x7)
+    pixels[ys, xs] = target
+
+
+def extract(pixels: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    The operation opposite to `embed`.
+    :param pixels: Pixels (height, width, 3).
+    :param xs: X coordinates of pixels.
+    :param ys: Y coordinates of pixels.
+    :returns: Codes (uint8), one per pixel.
+    """
+    source = pixels[ys, xs]
+    return (
+        ((source[:, 0] & 0x7) << 5) | ((source[:, 1] & 0x3) << 3) | (source[:, 2] & 0x7)
+    )
+
+
+def bytes_to_values(data: bytes, bits: int) -> np.ndarray:
+    """
+    Splits bytes into values of the last bits of channels.
+    The bit stream is padded with zeros to whole pixels.
+    :param data: Bytes.
+    :param bits: Bits per channel (1-4).
+    :returns: Values (uint8), (pixels, 3).
+    """
+    stream = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    stream = np.pad(stream, (0, -len(stream) % (3 * bits)))
+    return (np.packbits(stream.reshape(-1, bits), axis=1) >> (8 - bits)).reshape(-1, 3)
+
+
+def values_to_bytes(values: np.ndarray, bits: int) -> bytes:
+    """
+    The operation opposite to `bytes_to_values`.
+    :param values: Values (uint8), (pixels, 3).
+    :param bits: Bits per channel (1-4).
+    :returns: Bytes with the padding of the last pixel (whole bytes of it).
+    """
+    stream = np.unpackbits(values.reshape(-1, 1), axis=1)[:, 8 - bits :].ravel()
+    return np.packbits(stream[: len(stream) - len(stream) % 8]).tobytes()
+
+
+def embed_bits(
+    pixels: np.ndarray, xs: np.ndarray, ys: np.ndarray, values: np.ndarray, bits: int
+):
+    """
+    Puts values in the last bits of every channel of the pixels (in place).
+    :param pixels: Pixels (height, width, 3).
+    :param xs: X coordinates of pixels.
+    :param ys: Y coordinates of pixels.
+    :param values: Values (uint8), (pixels, 3).
+    :param bits: Bits per channel (1-4).
+    """
+    pixels[ys, xs] = (pixels[ys, xs] & (0xFF ^ ((1 << bits) - 1))) | values
+
+
+def extract_bits(
+    pixels: np.ndarray, xs: np.ndarray, ys: np.ndarray, bits: int
+) -> np.ndarray:
+    """
+    The operation opposite to `embed_bits`.
+    :param pixels: Pixels (height, width, 3).
+    :param xs: X coordinates of pixels.
+    :param ys: Y coordinates of pixels.
+    :param bits: Bits per channel (1-4).
+    :returns: Values (uint8), (pixels, 3).
+    """
+    return pixels[ys, xs] & ((1 << bits) - 1)
@@ -0,0 +1,102 @@
+"""
+
+Header of hidden text.
+Stored in the first pixels of the picture (row by row), one byte per pixel.
+The magic value does not depend on the key, so pictures with a header are
+recognized before anything else is read, and the key-derived MAC rejects
+a wrong key right away.
+
+"""
+
+from __future__ import annotations
+
+import hmac
+import struct
+from dataclasses import dataclass
+from hashlib import sha256
+
+import numpy as np
+
+from .crypto_engine import embed, extract
+
+MAGIC = b"EkMk"
+# magic, format version, flags, payload length
+HEADER_STRUCT = struct.Struct(">4sBBI")
+MAC_SIZE = 4
+HEADER_PIXELS = HEADER_STRUCT.size + MAC_SIZE
+
+
+@dataclass
+class Header:
+    version: int
+    length: int
+    flags: int = 0
+
+    def pack(self, key: str) -> bytes:
+        """
+        :param key: Secret key.
+        :returns: Header bytes signed with the key.
+        """
+        data = HEADER_STRUCT.pack(MAGIC, self.version, self.flags, self.length)
+        return data + get_mac(key, data)
+
+    @classmethod
+    def unpack(cls, data: bytes, key: str) -> Header | None:
+        """
+        :param data: Header bytes.
+        :param key: Secret key.
+        :returns: Header or None if there is no header.
+        :raises: RuntimeError if the key is wrong.
+        """
+        magic, version, flags, length = HEADER_STRUCT.unpack(
+            data[: HEADER_STRUCT.size]
+        )
+        if magic != MAGIC:
+            return None
+        if not hmac.compare_digest(
+            data[HEADER_STRUCT.size :], get_mac(key, data[: HEADER_STRUCT.size])
+        ):
+            raise RuntimeError("Wrong key")
+        return cls(version, length, flags)
+
+
+def get_mac(key: str, data: bytes) -> bytes:
+    """
+    :param key: Secret key.
+    :param data: Signed data.
+    :returns: Short key-derived MAC of data.
+    """
+    return hmac.new(key.encode(), data, sha256).digest()[:MAC_SIZE]
+
+
+def header_pixels(width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param width: Picture width.
+    :returns: X and Y coordinates of header pixels.
+    """
+    ys, xs = np.divmod(np.arange(HEADER_PIXELS), width)
+    return xs, ys
+
+
+def write_header(pixels: np.ndarray, header: Header, key: str) -> None:
+    """
+    Puts the header in the pixels (in place).
+    :param pixels: Pixels (height, width, 3).
+    :param header: Header.
+    :param key: Secret key.
+    """
+    xs, ys = header_pixels(pixels.shape[1])
+    embed(pixels, xs, ys, np.frombuffer(header.pack(key), dtype=np.uint8))
+
+
+def read_header(pixels: np.ndarray, key: str) -> Header | None:
+    """
+    :param pixels: Pixels (height, width, 3).
+    :param key: Secret key.
+    :returns: Header or None if the picture has no header.
+    :raises: RuntimeError if the key is wrong.
+    """
+    if pixels.shape[0] * pixels.shape[1] < HEADER_PIXELS:
+        return None
+    xs, ys = header_pixels(pixels.shape[1])
+    return Header.unpack(extract(pixels, xs, ys).tobytes(), key)
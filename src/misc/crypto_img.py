@@ -1,75 +1,240 @@
 """
 
 Functions of encryption and decryption of text in pictures.
+Every call owns its generator state, so calls may run in parallel threads.
+Symbols are processed in chunks, the cancellation token is checked
+and the progress is reported between them. Chunks of formats with a keyed
+permutation may be processed by several threads, numpy releases the GIL.
 Copyright (c) 2022 Alex Filiov <https://github.com/AlexDev505>
 
 https://github.com/AlexDev505/CryptoImg
 
 """
 
-import random
-from hashlib import sha256
+import typing as ty
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from io import BytesIO
 
-from PIL import Image, UnidentifiedImageError
-
-
-def get_seed(key: str) -> str:
+import numpy as np
+from PIL import Image
+
+from .cancellation import CancelToken, check
+from .crypto_engine import (
+    bytes_to_values,
+    codes_to_text,
+    embed,
+    embed_bits,
+    extract,
+    extract_bits,
+    load_image,
+    open_image,
+    text_to_codes,
+    to_image,
+    values_to_bytes,
+)
+from .crypto_header import HEADER_PIXELS, Header, read_header, write_header
+from .payload import pack_text, unpack_text
+from .pixel_order import (
+    KeyedPermutation,
+    LegacyOrder,
+    PixelOrder,
+)
+
+
+# Formats of hidden text.
+# The pixel sequence from `random.randrange` with a `\0` at the end of the text.
+LEGACY_FORMAT = 1
+# Keyed permutation of pixels with a `\0` at the end of the text.
+PERMUTATION_FORMAT = 2
+# Header with the text length (see `crypto_header`),
+# keyed permutation of the rest of the pixels.
+HEADER_FORMAT = 3
+# The same with the compressed UTF-8 text (see `payload`),
+# one byte per pixel, the codec is in the flags of the header.
+COMPRESSED_FORMAT = 4
+# The same as a bit stream in the last 1-4 bits of every channel.
+# The codec is in the low 4 bits of the flags, the bits per channel - in the high.
+DENSE_FORMAT = 5
+BITS_PER_CHANNEL = range(1, 5)
+
+CHUNK_SIZE = 65536  # Symbols processed between checks of cancellation
+# Chunks are smaller with several threads, so the work is spread evenly,
+# but not smaller than this, so the overhead of a chunk stays negligible
+MIN_CHUNK_SIZE = 4096
+CHUNKS_PER_THREAD = 4
+Progress = ty.Callable[[float], ty.Any]  # Called with the done part of work
+# Work of stages of processing compared to decoding one pixel,
+# the progress of a job is weighted by them
+SYMBOL_COST = 8  # Hiding or finding one symbol
+ENCODE_COST = 3  # Encoding one pixel
+
+PIXEL_ORDERS: dict[int, ty.Callable[..., PixelOrder]] = {
+    LEGACY_FORMAT: LegacyOrder,
+    PERMUTATION_FORMAT: KeyedPermutation,
+    HEADER_FORMAT: partial(KeyedPermutation, offset=HEADER_PIXELS),
+    COMPRESSED_FORMAT: partial(KeyedPermutation, offset=HEADER_PIXELS),
+    DENSE_FORMAT: partial(KeyedPermutation, offset=HEADER_PIXELS),
+}
+
+
+def get_pixel_order(key: str, size: tuple[int, int], version: int) -> PixelOrder:
     """
-    Gets hash of key.
-    Used as seed in further generation of random numbers to get random pixels.
     :param key: Secret key.
-    :returns: seed for random numbers.
+    :param size: Picture size.
+    :param version: Format of hidden text.
+    :returns: Sequence of pixels in which symbols are hidden.
     """
-    return sha256(key.encode()).hexdigest()  # We use the Hash function Sha256
+    if version not in PIXEL_ORDERS:
+        raise ValueError(f"Unknown format: {version}")
+    return PIXEL_ORDERS[version](key, size)
 
 
-def char_to_bits(char_number: int) -> tuple[str, str, str]:
+def stage_progress(
+    progress: Progress | None, done: float, share: float
+) -> Progress | None:
     """
-    Converts the Unicode the number of symbols into the binary number system.
-    :param char_number: Unicode number.
-    :returns: Binary representation of the symbol.
-    example:
-        >>> char_to_bits(ord('F'))
-        ('010', '00', '110')
+    :param progress: Callback of progress of the whole work.
+    :param done: Part of the work done before the stage.
+    :param share: Part of the work taken by the stage.
+    :returns: Callback of progress of the stage.
     """
-    bits = "{0:b}".format(char_number).rjust(8, "0")
-    return bits[:3], bits[3:5], bits[5:]
+    if progress is None:
+        return None
 
+    def report(part: float) -> None:
+        progress(done + part * share)
 
-def rgb_to_hex(rgb: tuple[int, int, int]) -> str:
-    """
-    Converts the RGB color representation in hexadecimal.
-    :param rgb: RGB color.
-    :returns: The hexadecimal color view.
-    """
-    return "0x{:02x}{:02x}{:02x}".format(*rgb)
+    return report
 
 
-def color_number_to_bits(color_number: int) -> tuple[str, str, str]:
+def chunk_size(count: int, threads: int) -> int:
     """
-    Converts the ten color representation in the binary.
-    :param color_number: Ten -sized color view.
-    :returns: Binsry presentation of Color.
-    example:
-        >>> color_number_to_bits(int(rgb_to_hex((255, 1, 55)), 16))
-        ('11111111', '00000001', '00110111')
+    :param count: Number of items.
+    :param threads: Number of threads.
+    :returns: Number of items in a chunk.
+    """
+    if threads <= 1:
+        return CHUNK_SIZE
+    size = -(-count // (threads * CHUNKS_PER_THREAD))
+    return max(MIN_CHUNK_SIZE, min(size, CHUNK_SIZE))
+
+
+def map_chunks(
+    func: ty.Callable[[int, int], ty.Any],
+    count: int,
+    threads: int = 1,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+) -> list:
+    """
+    Calls `func(start, stop)` for chunks of items (see `chunk_size`).
+    :param func: Function processing a chunk.
+    :param count: Number of items.
+    :param threads: Number of threads. Chunks are processed in order if 1.
+    :param cancel: Cancellation token, checked before every chunk.
+    :param progress: Callback of progress.
+    :returns: Results of chunks in order.
+    :raises: Errors of `func`.
+    """
+    size = chunk_size(count, threads)
+    starts = range(0, count, size)
+
+    def run(start: int) -> ty.Any:
+        check(cancel)
+        return func(start, min(start + size, count))
+
+    if threads <= 1 or len(starts) <= 1:
+        results = []
+        for start in starts:
+            results.append(run(start))
+            if progress is not None:
+                progress(min(start + size, count) / count)
+        return results
+
+    pool = ThreadPoolExecutor(min(threads, len(starts)), thread_name_prefix="Chunk")
+    try:
+        futures = [pool.submit(run, start) for start in starts]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress is not None:
+                progress(done / len(futures))
+        return [future.result() for future in futures]
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def encode_text(
+    text: str, version: int, bits_per_channel: int = 2
+) -> tuple[np.ndarray, int, int]:
+    """
+    :param text: Text.
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :returns: What is hidden in pixels (one item per pixel),
+        the length and the flags of the header.
+    :raises: ValueError if the bits per channel are not supported.
     """
-    bits = "{0:b}".format(color_number).rjust(24, "0")
-    return bits[0:8], bits[8:16], bits[16:]
+    if version >= DENSE_FORMAT:
+        if bits_per_channel not in BITS_PER_CHANNEL:
+            raise ValueError(f"Unsupported bits per channel: {bits_per_channel}")
+        codec, payload = pack_text(text)
+        values = bytes_to_values(payload, bits_per_channel)
+        return values, len(payload), codec | bits_per_channel << 4
+    if version >= COMPRESSED_FORMAT:
+        codec, payload = pack_text(text)
+        return np.frombuffer(payload, dtype=np.uint8), len(payload), codec
+    if version >= HEADER_FORMAT:
+        codes = text_to_codes(text)
+        return codes, len(codes), 0
+    # The sign that the text is over. Need for decryption
+    return text_to_codes(text + "\0"), 0, 0
+
+
+def count_text_pixels(
+    text: str, version: int = COMPRESSED_FORMAT, bits_per_channel: int = 2
+) -> int:
+    """
+    :param text: Text.
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :returns: Number of pixels taken by the text, without the header.
+    """
+    return len(encode_text(text, version, bits_per_channel)[0])
 
 
-def color_number_to_rgb(color_number: int) -> tuple[int, int, int]:
+def check_capacity(count: int, size: tuple[int, int], version: int) -> None:
     """
-    Converts the ten color representation in RGB.
-    :param color_number: Ten-sized color view.
-    :returns: rgb color show.
+    :param count: Number of pixels taken by the text (see `encode_text`).
+    :param size: Picture size.
+    :param version: Format of hidden text.
+    :raises: RuntimeError if the text does not fit.
     """
-    bits = color_number_to_bits(color_number)
-    return int(bits[0], 2), int(bits[1], 2), int(bits[2], 2)
+    if count + (HEADER_PIXELS if version >= HEADER_FORMAT else 0) > size[0] * size[1]:
+        raise RuntimeError("The picture is too small")
 
 
-def encrypt(text: str, key: str, image: BytesIO) -> Image:
+def get_embed(version: int, bits_per_channel: int = 2) -> ty.Callable[..., None]:
+    """
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :returns: Function putting what `encode_text` returns in pixels.
+    """
+    if version >= DENSE_FORMAT:
+        return partial(embed_bits, bits=bits_per_channel)
+    return embed
+
+
+def encrypt(
+    text: str,
+    key: str,
+    image: BytesIO,
+    version: int = COMPRESSED_FORMAT,
+    bits_per_channel: int = 2,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+    threads: int = 1,
+) -> Image:
     """
     The text is encrypted in the picture.
 
@@ -82,6 +247,11 @@ def encrypt(text: str, key: str, image: BytesIO) -> Image:
     :param text: Text for encryption.
     :param key: Secret key.
     :param image: Initial picture.
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress.
+    :param threads: Number of threads. The result does not depend on it.
     :returns: Picture with encrypted text.
     :raises: RuntimeError.
 
@@ -99,109 +269,157 @@ def encrypt(text: str, key: str, image: BytesIO) -> Image:
         >>> img = encrypt(text, key, io.BytesIO(data))
         >>> img.save(target_file_path)
     """
-    try:
-        img = Image.open(image).convert("RGB")  # loads the image
-    except UnidentifiedImageError:
-        raise RuntimeError("It's not a picture")
-    img_size = img.size[0] * img.size[1]  # pixes count
-
     if not len(text):
         raise RuntimeError("There is no text")
-    elif len(text) >= img_size:
-        raise RuntimeError("The picture is too small")
-
-    text += "\0"  # The sign that the text is over. Need for decryption
-    # Pixels in which the symbol is already encrypted.
-    used_pixels: list[tuple[int, int]] = []
-    random.seed(get_seed(key))  # Install the seed
-
-    for i, char in enumerate(text):  # iterate over text symbols
-        # Search for free pixel
-        while True:
-            # Obtaining a pseudo-random pixel
-            pix = (random.randrange(0, img.size[0]), random.randrange(0, img.size[1]))
-            if pix not in used_pixels:  # If he is not used
-                used_pixels.append(pix)
-                break
 
-        char = ord(char)  # Unicode of symbol
-        # crutch for Russian letters (because their unicode value is too much)
-        if char > 1000:
-            char -= 890
+    codes, length, flags = encode_text(text, version, bits_per_channel)
 
-        color = int(rgb_to_hex(img.getpixel(pix)), 16)  # The initial color of the pixel
+    # The size is checked before the picture is decoded
+    img = open_image(image)
+    check_capacity(len(codes), img.size, version)
 
-        # put part of the symbol in the last 3 bits of the red canal
-        new_color = color & 0xF80000  # 11111000 00000000 00000000
-        new_color |= (char & 0xE0) << 11  # 00000111 00000000 00000000
+    img, pixels = load_image(img)
+    check(cancel)
+    if version >= HEADER_FORMAT:
+        write_header(pixels, Header(version, length, flags), key)
 
-        # put part of the symbol in the last 2 bits of the blue channel
-        new_color |= color & (0x3F << 10)  # 00000000 11111100 00000000
-        new_color |= (char & 0x18) << 5  # 00000000 00000011 00000000
+    embed_codes = get_embed(version, bits_per_channel)
+    pixel_order = get_pixel_order(key, img.size, version)
 
-        # put part of the symbol in the last 3 bits of the green channel
-        new_color |= color & (0x1F << 3)  # 00000000 00000000 11111000
-        new_color |= char & 0x7  # 00000000 00000000 00000111
+    def embed_chunk(start: int, stop: int) -> None:
+        xs, ys = pixel_order.take_range(start, stop)
+        embed_codes(pixels, xs, ys, codes[start:stop])  # Chunks do not intersect
 
-        img.putpixel(
-            pix, color_number_to_rgb(new_color)
-        )  # change the pixel in the picture
+    map_chunks(
+        embed_chunk,
+        len(codes),
+        threads if pixel_order.random_access else 1,
+        cancel,
+        progress,
+    )
 
-    random.seed()  # discard the seed
+    return to_image(pixels, img)
 
-    return img
 
-
-def decrypt(key: str, image: BytesIO) -> str:
+def decrypt(
+    key: str,
+    image: BytesIO,
+    version: int = LEGACY_FORMAT,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+    threads: int = 1,
+) -> str:
     """
     Decodes a message from the picture.
     The algorithm is opposite to encryption.
+    The format is taken from the header of the picture.
 
     :param key: Secret key.
     :param image: Picture.
+    :param version: Format of hidden text if the picture has no header.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress. Not called for pictures without
+        a header, as the length of their text is not known.
+    :param threads: Number of threads for pictures with a header.
     :returns: Text.
+    :raises: RuntimeError.
     """
-    try:
-        img = Image.open(image).convert("RGB")
-    except UnidentifiedImageError:
-        raise RuntimeError("It's not a picture")
-
-    random.seed(get_seed(key))  # Install the seed
-    result = ""  # Decoded text
-    checked_pixels: list[tuple[int, int]] = []
+    return decrypt_pixels(
+        key, load_image(image)[1], version, cancel, progress, threads
+    )
+
+
+def decrypt_pixels(
+    key: str,
+    pixels: np.ndarray,
+    version: int = LEGACY_FORMAT,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+    threads: int = 1,
+) -> str:
+    """
+    The same as `decrypt` for pixels of a loaded picture.
+    The pixels are not modified, so they may be reused.
 
+    :param key: Secret key.
+    :param pixels: Pixels (height, width, 3).
+    :param version: Format of hidden text if the picture has no header.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress. Not called for pictures without
+        a header, as the length of their text is not known.
+    :param threads: Number of threads for pictures with a header.
+    :returns: Text.
+    :raises: RuntimeError.
+    """
+    img_size = (pixels.shape[1], pixels.shape[0])
+
+    if (header := read_header(pixels, key)) is None:
+        return read_terminated_text(
+            pixels,
+            get_pixel_order(key, img_size, version),
+            cancel,
+        )
+
+    if header.version not in PIXEL_ORDERS or header.version < HEADER_FORMAT:
+        raise RuntimeError("Unsupported format of the picture")
+    codec, bits = header.flags & 0xF, header.flags >> 4
+    count = header.length  # Pixels of the text
+    if header.version >= DENSE_FORMAT:
+        if bits not in BITS_PER_CHANNEL:
+            raise RuntimeError("Unsupported format of the picture")
+        count = -(-header.length * 8 // (3 * bits))
+    pixel_order = get_pixel_order(key, img_size, header.version)
+
+    def extract_chunk(start: int, stop: int) -> np.ndarray | bytes | str:
+        xs, ys = pixel_order.take_range(start, stop)
+        if len(xs) < stop - start:
+            raise RuntimeError("The picture is damaged")
+        if header.version >= DENSE_FORMAT:
+            return extract_bits(pixels, xs, ys, bits)
+        if header.version >= COMPRESSED_FORMAT:
+            return extract(pixels, xs, ys).astype(np.uint8).tobytes()
+        return codes_to_text(extract(pixels, xs, ys))
+
+    # Decoded parts of text or payload
+    result = map_chunks(
+        extract_chunk,
+        count,
+        threads if pixel_order.random_access else 1,
+        cancel,
+        progress,
+    )
+
+    if header.version >= DENSE_FORMAT:
+        payload = values_to_bytes(np.concatenate(result), bits)[: header.length]
+        return unpack_text(codec, payload)
+    if header.version >= COMPRESSED_FORMAT:
+        return unpack_text(codec, b"".join(result))
+    return "".join(result)
+
+
+def read_terminated_text(
+    pixels: np.ndarray, pixel_order: PixelOrder, cancel: CancelToken | None = None
+) -> str:
+    """
+    Reads symbols until the `\0`.
+    :param pixels: Pixels (height, width, 3).
+    :param pixel_order: Sequence of pixels in which symbols are hidden.
+    :param cancel: Cancellation token.
+    :returns: Text.
+    :raises: RuntimeError.
+    """
+    result = []  # Decoded parts of text
+    batch = 256  # Pixels read at a time. Grows while the text does not end.
     while True:
-        # Pixel search
-        while True:
-            # Obtaining a pseudo-random pixel
-            pix = (random.randrange(0, img.size[0]), random.randrange(0, img.size[1]))
-            if pix not in checked_pixels:
-                checked_pixels.append(pix)
-                break
-
-        color = int(rgb_to_hex(img.getpixel(pix)), 16)
-
-        char = 0  # unicode of symbol
-        # get part of the symbol from the red canal
-        # 00000111
-        char |= (color & 0x70000) >> 11
-
-        # get part of the symbol from the blue channel
-        # 00000000 00000011 00000000
-        char |= (color & 0x300) >> 5
-
-        # get part of the symbol from the green channel
-        # 00000000 00000000 00000111
-        char |= color & 0x7
-
-        if char > 130:  # Return Russian letters
-            char += 890
-
-        if char == 0:  # If the text is over
+        check(cancel)
+        xs, ys = pixel_order.take(batch)
+        if not len(xs):
+            raise RuntimeError("There is no text")
+        codes = extract(pixels, xs, ys)
+        if len(end := np.flatnonzero(codes == 0)):  # If the text is over
+            result.append(codes_to_text(codes[: end[0]]))
             break
+        result.append(codes_to_text(codes))
+        batch = min(batch * 2, CHUNK_SIZE)
 
-        result += chr(char)
-
-    random.seed()  # discard the seed
-
-    return result
+    return "".join(result)
@@ -0,0 +1,589 @@
+"""
+
+Executor of CPU-heavy jobs.
+Jobs run in a pool of processes, so they do not block handlers
+and use all cores. Results are delivered to callbacks in separate threads.
+Waiting jobs are ordered fairly between users by their cost (see `scheduling`).
+Identical jobs submitted while one of them is not finished share its result.
+Jobs are cancelled cooperatively (see `cancellation`) by their owners
+and on timeouts, so abandoned work stops and frees its process.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+import time
+import typing as ty
+from collections import OrderedDict
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+)
+from functools import partial
+from io import BytesIO
+
+from loguru import logger
+from PIL import Image
+
+from .cache import LRUCache
+from .cancellation import CancelToken, Cancelled
+from .crypto_engine import open_image
+from .crypto_header import read_header
+from .crypto_img import (
+    COMPRESSED_FORMAT,
+    ENCODE_COST,
+    SYMBOL_COST,
+    Progress,
+    decrypt_pixels,
+    encrypt,
+    stage_progress,
+)
+from .output import EncodedImage, OutputPolicy, encode_image
+from .scheduling import CostBudgets, FairQueue
+from .strips import encrypt_in_strips, fits_memory, load_pixels
+
+if ty.TYPE_CHECKING:
+    from multiprocessing.context import BaseContext
+
+
+class QueueFull(RuntimeError):
+    def __init__(self):
+        super().__init__("The queue is full, try again later")
+
+
+class JobTimeout(RuntimeError):
+    def __init__(self):
+        super().__init__("The operation took too long")
+
+
+# Remembered processes of jobs with an affinity (see `JobExecutor.submit`)
+MAX_AFFINITIES = 4096
+# Progress of a job which has not reported it, e.g. decryption of a picture
+# without a header, as the length of its text is not known
+UNKNOWN_PROGRESS = -1.0
+
+
+def estimate_cost(image: bytes, text_length: int = 0) -> float:
+    """
+    Estimates the work of a job before it starts.
+    Only the header of the picture is read.
+    :param image: Picture.
+    :param text_length: Length of the text.
+    :returns: Cost in megapixels.
+    :raises: RuntimeError.
+    """
+    try:
+        with Image.open(BytesIO(image)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise RuntimeError("The picture is too big")
+    except OSError:
+        raise RuntimeError("The file is not a picture")
+    return (width * height + text_length * SYMBOL_COST) / 1_000_000
+
+
+def encrypt_job(
+    text: str,
+    key: str,
+    image: bytes,
+    output: OutputPolicy = OutputPolicy(),
+    version: int = COMPRESSED_FORMAT,
+    bits_per_channel: int = 2,
+    memory_budget: int = 0,
+    threads: int = 1,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+) -> EncodedImage:
+    """
+    :param text: Text for encryption.
+    :param key: Secret key.
+    :param image: Initial picture.
+    :param output: Policy of encoding the result.
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :param memory_budget: Bytes the job may use, bigger pictures are processed
+        in strips (see `strips`). 0 - unlimited.
+    :param threads: Number of threads of the job.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress. Decoding, hiding the text
+        and encoding of the picture are weighted by their work.
+    :returns: Picture with encrypted text.
+    :raises: RuntimeError.
+    """
+    size = open_image(BytesIO(image)).size
+    if not fits_memory(size, memory_budget):
+        return encrypt_in_strips(
+            text,
+            key,
+            BytesIO(image),
+            output,
+            version,
+            bits_per_channel,
+            cancel=cancel,
+            progress=progress,
+            threads=threads,
+        )
+    # Hiding reports its progress after the picture is decoded,
+    # the rest of the work is encoding
+    pixels = size[0] * size[1]
+    symbols = len(text) * SYMBOL_COST
+    total = pixels + symbols + pixels * ENCODE_COST
+    crypto_image = encrypt(
+        text,
+        key,
+        BytesIO(image),
+        version,
+        bits_per_channel,
+        cancel=cancel,
+        progress=stage_progress(progress, pixels / total, symbols / total),
+        threads=threads,
+    )
+    if cancel is not None:
+        cancel.check()
+    return encode_image(crypto_image, output)
+
+
+# Decoded pictures of the worker process (see `init_worker`)
+_pixels_cache: LRUCache | None = None
+# Cancellation flags and progress of running jobs shared with the executor
+_cancel_flags: ty.MutableSequence[int] | None = None
+_progress: ty.MutableSequence[float] | None = None
+
+
+def init_worker(
+    pixels_cache_size: int,
+    cancel_flags: ty.MutableSequence[int] | None = None,
+    progress: ty.MutableSequence[float] | None = None,
+) -> None:
+    """
+    Prepares a worker process.
+    :param pixels_cache_size: Max size of decoded pictures kept by the process.
+    :param cancel_flags: Cancellation flags of running jobs.
+    :param progress: Progress of running jobs.
+    """
+    global _pixels_cache, _cancel_flags, _progress
+    _pixels_cache = LRUCache(pixels_cache_size) if pixels_cache_size else None
+    _cancel_flags = cancel_flags
+    _progress = progress
+
+
+def _set_progress(flag: int, done: float) -> None:
+    _progress[flag] = done
+
+
+def run_job(func: ty.Callable, flag: int, *args) -> ty.Any:
+    """
+    Runs a job in a worker process.
+    :param func: Job. Takes a cancellation token as the `cancel` argument
+        and a callback of progress as the `progress` argument.
+    :param flag: Index of the cancellation flag and the progress of the job.
+    :param args: Arguments of the job.
+    :returns: Result of the job.
+    """
+    return func(
+        *args,
+        cancel=CancelToken(_cancel_flags, flag),
+        progress=partial(_set_progress, flag) if _progress is not None else None,
+    )
+
+
+def decrypt_job(
+    key: str,
+    image: bytes,
+    image_id: str | None = None,
+    memory_budget: int = 0,
+    threads: int = 1,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+) -> str:
+    """
+    :param key: Secret key.
+    :param image: Picture.
+    :param image_id: Unique id of the picture. Decoded pictures are cached by it,
+        so another attempt with a different key does not decode it again.
+    :param memory_budget: Bytes the job may use, bigger pictures are converted
+        in strips (see `strips`). 0 - unlimited.
+    :param threads: Number of threads of the job.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress. Decoding and finding the text
+        are weighted by their work, it is not called for pictures without
+        a header, as the length of their text is not known.
+    :returns: Text.
+    :raises: RuntimeError.
+    """
+    decoded = True
+    if _pixels_cache is None or image_id is None:
+        pixels = load_pixels(BytesIO(image), memory_budget)
+    elif (pixels := _pixels_cache.get(image_id)) is None:
+        pixels = load_pixels(BytesIO(image), memory_budget)
+        pixels.flags.writeable = False
+        _pixels_cache.put(image_id, pixels)
+    else:
+        decoded = False
+    if progress is not None and (header := read_header(pixels, key)) is not None:
+        decoding = pixels.shape[0] * pixels.shape[1] if decoded else 0
+        symbols = max(header.length, 1) * SYMBOL_COST
+        decoded_part = decoding / (decoding + symbols)
+        progress(decoded_part)
+        progress = stage_progress(progress, decoded_part, 1 - decoded_part)
+    return decrypt_pixels(
+        key, pixels, cancel=cancel, progress=progress, threads=threads
+    )
+
+
+def get_job_key(operation: str, image: bytes, key: str, text: str = "") -> bytes:
+    """
+    :param operation: Name of the operation.
+    :param image: Picture.
+    :param key: Secret key.
+    :param text: Text for encryption.
+    :returns: Key of identical jobs. Secrets are only stored as hashes.
+    """
+    return hashlib.sha256(
+        b"".join(
+            hashlib.sha256(part).digest()
+            for part in (operation.encode(), image, key.encode(), text.encode())
+        )
+    ).digest()
+
+
+class JobExecutor:
+    """
+    Bounded executor of jobs.
+    Not more than `max_jobs` jobs are accepted at a time (running and waiting).
+    Not more than `workers` jobs are given to the processes, the rest wait
+    in a fair queue, so the order is decided when a process becomes free.
+    Every process has its own pool, so jobs reusing data cached
+    by a process (e.g. a decoded picture) are given to the same process.
+    A job is cancelled when all its owners cancel it or it takes too long.
+    An owner may have several jobs, e.g. a batch of pictures.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_jobs: int,
+        timeout: float,
+        user_budget: float = 0,
+        pixels_cache_size: int = 0,
+        mp_context: BaseContext | None = None,
+    ):
+        """
+        :param workers: Number of processes.
+        :param max_jobs: Max number of accepted jobs.
+        :param timeout: Seconds to wait for a result of a running job.
+            Then the job is reported as timed out at once, and its process
+            is taken again when the job stops.
+        :param user_budget: Megapixel-seconds a user may spend per minute,
+            see `scheduling`. 0 - unlimited.
+        :param pixels_cache_size: Max size of decoded pictures kept by each process.
+        :param mp_context: Multiprocessing context of the pool.
+        """
+        self.workers = workers
+        self.timeout = timeout
+        # A flag for every process, set to cancel its job, and its progress
+        self._cancel_flags = (mp_context or multiprocessing).RawArray("b", workers)
+        self._progress = (mp_context or multiprocessing).RawArray("d", workers)
+        self._free_flags = list(range(workers))
+        self._pools = [
+            ProcessPoolExecutor(
+                1,
+                mp_context=mp_context,
+                initializer=init_worker,
+                initargs=(pixels_cache_size, self._cancel_flags, self._progress),
+            )
+            for _ in range(workers)
+        ]
+        # {<affinity>: <flag of the process of the last job>}
+        self._affinities: OrderedDict[ty.Hashable, int] = OrderedDict()
+        self._waiters = ThreadPoolExecutor(max_jobs, thread_name_prefix="JobWaiter")
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._lock = threading.Lock()
+        self._queue = FairQueue()
+        self._budgets = CostBudgets(user_budget) if user_budget else None
+        self._running: dict[ty.Hashable, int] = {}  # {<job key>: <flag>}
+        # {<flag>: (<user>, <cost>, <start time>)} of jobs taking processes
+        self._charges: dict[int, tuple[ty.Hashable, float, float]] = {}
+        # {<job key>: {<submission>: (<owner>, <on_done>, <on_error>)}}
+        self._callbacks: dict[ty.Hashable, dict[object, tuple]] = {}
+        # {<owner>: {<submission>: <job key>}}
+        self._owners: dict[ty.Hashable, dict[object, ty.Hashable]] = {}
+
+    def start(self) -> None:
+        """
+        Starts the processes, otherwise they are started by the first jobs.
+        Forked processes get copies of locks held by other threads
+        at that moment, so with the fork start method the processes
+        must be started before other threads.
+        """
+        for future in [pool.submit(int) for pool in self._pools]:
+            future.result()
+
+    def submit(
+        self,
+        func: ty.Callable,
+        *args,
+        on_done: ty.Callable[[ty.Any], ty.Any],
+        on_error: ty.Callable[[RuntimeError], ty.Any],
+        user: ty.Hashable = None,
+        cost: float = 0,
+        job_key: ty.Hashable = None,
+        owner: ty.Hashable = None,
+        affinity: ty.Hashable = None,
+    ) -> None:
+        """
+        Adds a job to the queue.
+        :param func: Job. Must be picklable, takes a cancellation token
+            as the `cancel` argument.
+        :param args: Arguments of the job. Must be picklable.
+        :param on_done: Called with the result of the job.
+        :param on_error: Called with the error of the job.
+        :param user: Owner of the job.
+        :param cost: Cost of the job (see `estimate_cost`).
+        :param job_key: Key of identical jobs (see `get_job_key`).
+            If an identical job is accepted and not finished,
+            its result is given to the callbacks instead of running the job.
+        :param owner: Key to cancel the job with (see `cancel`).
+        :param affinity: Key of data the job reuses, e.g. the id of a picture.
+            The job is given to the process of the last job with the same key
+            if that process is free.
+        :raises: QueueFull, BudgetExceeded.
+        """
+        if job_key is None:
+            job_key = object()
+        submission = object()
+        with self._lock:
+            if job_key not in self._callbacks:
+                if not self._slots.acquire(blocking=False):
+                    raise QueueFull()
+                try:
+                    if self._budgets is not None and user is not None:
+                        self._budgets.check(user)
+                except BaseException:
+                    self._slots.release()
+                    raise
+                self._callbacks[job_key] = {}
+                job = (func, args, job_key, affinity, user, cost)
+                self._queue.push(user, cost, job)
+            self._callbacks[job_key][submission] = (owner, on_done, on_error)
+            if owner is not None:
+                self._owners.setdefault(owner, {})[submission] = job_key
+        self._schedule()
+
+    async def run(
+        self,
+        func: ty.Callable,
+        *args,
+        user: ty.Hashable = None,
+        cost: float = 0,
+        job_key: ty.Hashable = None,
+        owner: ty.Hashable = None,
+        affinity: ty.Hashable = None,
+    ) -> ty.Any:
+        """
+        Adds a job to the queue and waits for its result without blocking the loop.
+        :param func: Job. Must be picklable.
+        :param args: Arguments of the job. Must be picklable.
+        :param user: Owner of the job.
+        :param cost: Cost of the job (see `estimate_cost`).
+        :param job_key: Key of identical jobs (see `submit`).
+        :param owner: Key to cancel the job with (see `cancel`).
+        :param affinity: Key of data the job reuses (see `submit`).
+        :returns: Result of the job.
+        :raises: RuntimeError.
+        """
+        return await self.submit_async(
+            func,
+            *args,
+            user=user,
+            cost=cost,
+            job_key=job_key,
+            owner=owner,
+            affinity=affinity,
+        )
+
+    def submit_async(
+        self,
+        func: ty.Callable,
+        *args,
+        user: ty.Hashable = None,
+        cost: float = 0,
+        job_key: ty.Hashable = None,
+        owner: ty.Hashable = None,
+        affinity: ty.Hashable = None,
+    ) -> asyncio.Future:
+        """
+        The same as `run`, but the job is added to the queue at once.
+        Must be called in the event loop.
+        :returns: Future of the result of the job.
+        :raises: QueueFull, BudgetExceeded.
+        """
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+
+        def on_done(value: ty.Any) -> None:
+            if not result.done():
+                result.set_result(value)
+
+        def on_error(err: RuntimeError) -> None:
+            if not result.done():
+                result.set_exception(err)
+
+        self.submit(
+            func,
+            *args,
+            on_done=partial(loop.call_soon_threadsafe, on_done),
+            on_error=partial(loop.call_soon_threadsafe, on_error),
+            user=user,
+            cost=cost,
+            job_key=job_key,
+            owner=owner,
+            affinity=affinity,
+        )
+        return result
+
+    def cancel(self, owner: ty.Hashable) -> bool:
+        """
+        Cancels the jobs of the owner. Their error callbacks are called
+        with `Cancelled`. A job stops if it has no other owners.
+        :param owner: Owner of the jobs.
+        :returns: Whether the owner had jobs.
+        """
+        callbacks = []
+        with self._lock:
+            if (entries := self._owners.pop(owner, None)) is None:
+                return False
+            for submission, job_key in entries.items():
+                callbacks.append(self._callbacks[job_key].pop(submission)[2])
+                if not self._callbacks[job_key] and job_key in self._running:
+                    self._cancel_flags[self._running[job_key]] = 1
+        for on_error in callbacks:
+            try:
+                on_error(Cancelled())
+            except Exception as err:
+                logger.exception(err)
+        return True
+
+    def get_progress(self, owner: ty.Hashable) -> tuple[int, float | None] | None:
+        """
+        :param owner: Owner of the jobs.
+        :returns: Number of jobs waiting before the first job of the owner
+            and the done part of its unfinished jobs (None if no running job
+            has reported it), or None if the owner has no jobs.
+        """
+        with self._lock:
+            if not (entries := self._owners.get(owner)):
+                return None
+            job_keys = set(entries.values())
+            done = [
+                self._progress[self._running[job_key]]
+                for job_key in job_keys
+                if job_key in self._running
+            ]
+            waiting = 0
+            if not done:
+                waiting = self._queue.index(lambda item: item[2] in job_keys)
+            if not (known := [part for part in done if part != UNKNOWN_PROGRESS]):
+                return waiting, None
+            return waiting, sum(known) / len(job_keys)
+
+    def _schedule(self) -> None:
+        """
+        Gives waiting jobs to free processes.
+        """
+        with self._lock:
+            while self._free_flags and self._queue:
+                func, args, job_key, affinity, user, cost = self._queue.pop()
+                if not self._callbacks[job_key]:  # Cancelled while waiting
+                    del self._callbacks[job_key]
+                    self._slots.release()
+                    continue
+                flag = self._take_process(affinity)
+                self._cancel_flags[flag] = 0
+                self._progress[flag] = UNKNOWN_PROGRESS
+                self._running[job_key] = flag
+                self._charges[flag] = (user, cost, time.monotonic())
+                self._waiters.submit(self._wait, func, args, job_key, flag)
+
+    def _take_process(self, affinity: ty.Hashable) -> int:
+        """
+        :param affinity: Key of data the job reuses.
+        :returns: Flag of a free process, preferably the one which ran
+            the last job with the same key. Must be called under the lock.
+        """
+        flag = self._affinities.get(affinity)
+        if flag in self._free_flags:
+            self._free_flags.remove(flag)
+        else:
+            flag = self._free_flags.pop()
+        if affinity is not None:
+            self._affinities[affinity] = flag
+            self._affinities.move_to_end(affinity)
+            if len(self._affinities) > MAX_AFFINITIES:
+                self._affinities.popitem(last=False)
+        return flag
+
+    def _wait(self, func, args, job_key, flag) -> None:
+        future = Future()
+        try:
+            future = self._pools[flag].submit(run_job, func, flag, *args)
+        except Exception as err:
+            future.set_exception(err)
+        try:
+            index, arg = 1, self._result(future, flag)  # on_done
+        except RuntimeError as err:
+            index, arg = 2, err  # on_error
+        finally:
+            with self._lock:
+                del self._running[job_key]
+                callbacks = self._callbacks.pop(job_key)
+                for submission, (owner, *_) in callbacks.items():
+                    if (entries := self._owners.get(owner)) is None:
+                        continue
+                    entries.pop(submission, None)
+                    if not entries:
+                        del self._owners[owner]
+            # A timed out job still takes the process until it stops
+            future.add_done_callback(partial(self._release, flag))
+        for callback in callbacks.values():
+            try:
+                callback[index](arg)
+            except Exception as err:
+                logger.exception(err)
+
+    def _release(self, flag: int, future: Future) -> None:
+        """
+        Charges the user of a finished job by its work
+        and gives its process to waiting jobs.
+        """
+        with self._lock:
+            user, cost, started_at = self._charges.pop(flag)
+            if self._budgets is not None and user is not None:
+                self._budgets.charge(user, cost, time.monotonic() - started_at)
+            self._free_flags.append(flag)
+        self._slots.release()
+        self._schedule()
+
+    def _result(self, future: Future, flag: int) -> ty.Any:
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The job stops at the next check, the process is released then
+            self._cancel_flags[flag] = 1
+            raise JobTimeout()
+        except RuntimeError:
+            raise
+        except Exception as err:
+            logger.opt(exception=err).error("job failed")
+            raise RuntimeError("Internal error")
+
+    def shutdown(self) -> None:
+        for pool in self._pools:
+            pool.shutdown(cancel_futures=True)
+        self._waiters.shutdown()
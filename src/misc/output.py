@@ -0,0 +1,188 @@
+"""
+
+Encoding of pictures with hidden text.
+Only lossless formats keep the last bits of pixels, so the choice is between
+PNG with a compression level and lossless WebP. PNG is the default,
+WebP and the automatic policy are chosen explicitly. The automatic policy
+trades size for speed by the number of pixels: small pictures are
+compressed as much as possible, big ones are encoded fast.
+
+"""
+
+from __future__ import annotations
+
+import struct
+import time
+import typing as ty
+import zlib
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+PNG = "png"
+WEBP = "webp"
+AUTO = "auto"
+FORMATS = (PNG, WEBP, AUTO)
+# Max width and height of a WebP picture
+WEBP_MAX_SIZE = 16383
+
+
+@dataclass(frozen=True)
+class OutputPolicy:
+    format: str = PNG
+    png_compress_level: int = 6  # 0 - none, 1 - fastest, 9 - smallest
+    webp_method: int = 4  # 0 - fastest, 6 - smallest
+    # Pictures with more pixels are encoded fast by the automatic policy
+    large_pixels: int = 4_000_000
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown output format: {self.format}")
+
+    def choose(self, size: tuple[int, int]) -> tuple[str, dict]:
+        """
+        :param size: Size of the picture.
+        :returns: Format and parameters of `Image.save`.
+        """
+        fmt = self.format
+        if fmt == AUTO:
+            fmt = WEBP if size[0] * size[1] <= self.large_pixels else PNG
+        if fmt == WEBP and max(size) > WEBP_MAX_SIZE:
+            fmt = PNG
+        if fmt == WEBP:
+            return WEBP, {"lossless": True, "exact": True, "method": self.webp_method}
+        level = self.png_compress_level
+        if self.format == AUTO and size[0] * size[1] > self.large_pixels:
+            level = 1
+        return PNG, {"compress_level": level}
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    data: bytes
+    format: str
+    params: dict
+    seconds: float
+
+    @property
+    def file_name(self) -> str:
+        return f"crypto_image.{self.format}"
+
+
+def encode_image(
+    img: Image.Image, policy: OutputPolicy, fmt: str | None = None, **params
+) -> EncodedImage:
+    """
+    :param img: Picture.
+    :param policy: Policy of encoding.
+    :param fmt: Format instead of the chosen one, e.g. to compare formats.
+    :param params: Parameters of `Image.save` instead of the chosen ones.
+    :returns: Encoded picture with metrics.
+    """
+    if fmt is None:
+        fmt, params = policy.choose(img.size)
+    started_at = time.perf_counter()
+    bio = BytesIO()
+    img.save(bio, fmt.upper(), **params)
+    seconds = time.perf_counter() - started_at
+    encoded = EncodedImage(bio.getvalue(), fmt, params, seconds)
+    logger.debug(
+        f"encoded {img.size[0]}x{img.size[1]} as {fmt} {params}: "
+        f"{len(encoded.data)} bytes in {encoded.seconds:.3f}s"
+    )
+    return encoded
+
+
+def compare_outputs(img: Image.Image) -> list[EncodedImage]:
+    """
+    Encodes the picture with each choice of the policy.
+    :param img: Picture.
+    :returns: Encoded pictures with metrics.
+    """
+    policy = OutputPolicy()
+    choices = [(PNG, {"compress_level": level}) for level in (0, 1, 6, 9)]
+    if max(img.size) <= WEBP_MAX_SIZE:
+        choices += [
+            (WEBP, {"lossless": True, "exact": True, "method": method})
+            for method in (0, 4, 6)
+        ]
+    return [encode_image(img, policy, fmt, **params) for fmt, params in choices]
+
+
+class PngWriter:
+    """
+    PNG encoder fed with strips of rows, so the whole picture is never
+    in memory. Rows are filtered with Paeth and compressed as they come.
+    """
+
+    signature = b"\x89PNG\r\n\x1a\n"
+    idat_size = 1 << 16  # Compressed bytes collected before a chunk is written
+
+    def __init__(
+        self,
+        file: ty.BinaryIO,
+        size: tuple[int, int],
+        compress_level: int = 6,
+        icc_profile: bytes | None = None,
+    ):
+        """
+        :param file: Output.
+        :param size: Size of the picture.
+        :param compress_level: Level of zlib.
+        :param icc_profile: Color profile of the picture.
+        """
+        self.file = file
+        self.size = size
+        self._compressor = zlib.compressobj(compress_level)
+        self._idat = bytearray()
+        self._previous = np.zeros((1, size[0] * 3), dtype=np.int16)
+        file.write(self.signature)
+        # 8 bits per channel, RGB, default compression, filtering and interlace
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", *size, 8, 2, 0, 0, 0))
+        if icc_profile:
+            self._write_chunk(
+                b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile)
+            )
+
+    def _write_chunk(self, kind: bytes, data: bytes) -> None:
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write(self, rows: np.ndarray) -> None:
+        """
+        :param rows: Next rows (rows, width, 3).
+        """
+        current = rows.reshape(len(rows), -1).astype(np.int16)
+        up = np.concatenate((self._previous, current[:-1]))
+        left = np.zeros_like(current)
+        left[:, 3:] = current[:, :-3]
+        up_left = np.zeros_like(current)
+        up_left[:, 3:] = up[:, :-3]
+        # The predictor closest to `left + up - up_left`, ties in this order
+        base = left + up - up_left
+        to_left, to_up = np.abs(base - left), np.abs(base - up)
+        to_up_left = np.abs(base - up_left)
+        predictor = np.where(
+            (to_left <= to_up) & (to_left <= to_up_left),
+            left,
+            np.where(to_up <= to_up_left, up, up_left),
+        )
+        filtered = np.empty((len(rows), current.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 4  # Paeth
+        filtered[:, 1:] = (current - predictor) & 0xFF
+        self._previous = current[-1:]
+        self._idat += self._compressor.compress(filtered.tobytes())
+        if len(self._idat) >= self.idat_size:
+            self._write_chunk(b"IDAT", bytes(self._idat))
+            self._idat.clear()
+
+    def close(self) -> None:
+        """
+        Finishes the picture, all rows must be written.
+        """
+        self._idat += self._compressor.flush()
+        self._write_chunk(b"IDAT", bytes(self._idat))
+        self._write_chunk(b"IEND", b"")
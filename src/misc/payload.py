@@ -0,0 +1,82 @@
+"""
+
+Payload of the compressed format.
+The text is encoded in UTF-8 and compressed by the codec which gives
+the smallest result. The codec is stored in the flags of the header.
+Natural-language texts shrink, so fewer pixels are written and read.
+
+"""
+
+from __future__ import annotations
+
+import lzma
+import zlib
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+# Raw LZMA2 without the container of xz, its headers outweigh short texts.
+# The dictionary of preset 9 (64 MiB) takes longer to allocate than to compress
+# a text, and does not change the result for texts shorter than 1 MiB
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1 << 20}]
+# Max size of an unpacked text, protects from decompression bombs
+MAX_TEXT_SIZE = 16 * 1024 * 1024
+
+
+def pack_text(text: str) -> tuple[int, bytes]:
+    """
+    :param text: Text.
+    :returns: Codec and the smallest payload.
+    """
+    data = text.encode("utf-8")
+    candidates = [
+        (CODEC_NONE, data),
+        (CODEC_ZLIB, zlib.compress(data, 9)),
+        (CODEC_LZMA, lzma.compress(data, lzma.FORMAT_RAW, filters=LZMA_FILTERS)),
+    ]
+    # The first of the smallest, so a payload is not compressed for nothing
+    return min(candidates, key=lambda candidate: len(candidate[1]))
+
+
+def unpack_text(codec: int, payload: bytes) -> str:
+    """
+    The operation opposite to `pack_text`.
+    :param codec: Codec.
+    :param payload: Payload.
+    :returns: Text.
+    :raises: RuntimeError.
+    """
+    if codec == CODEC_NONE:
+        data = payload
+    elif codec == CODEC_ZLIB:
+        data = decompress(zlib.decompressobj(), payload)
+    elif codec == CODEC_LZMA:
+        data = decompress(
+            lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS), payload
+        )
+    else:
+        raise RuntimeError("Unsupported format of the picture")
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise RuntimeError("The picture is damaged")
+
+
+def decompress(
+    decompressor: zlib._Decompress | lzma.LZMADecompressor, payload: bytes
+) -> bytes:
+    """
+    :param decompressor: Decompressor of the codec.
+    :param payload: Compressed data.
+    :returns: Data not bigger than `MAX_TEXT_SIZE`.
+    :raises: RuntimeError.
+    """
+    try:
+        data = decompressor.decompress(payload, MAX_TEXT_SIZE)
+    except (zlib.error, lzma.LZMAError):
+        raise RuntimeError("The picture is damaged")
+    if not decompressor.eof:
+        if len(data) >= MAX_TEXT_SIZE:
+            raise RuntimeError("The text is too big")
+        raise RuntimeError("The picture is damaged")
+    return data
@@ -0,0 +1,229 @@
+"""
+
+Orders in which pixels of a picture are used for hiding symbols.
+
+"""
+
+from __future__ import annotations
+
+import random
+from abc import ABC, abstractmethod
+from hashlib import sha256, sha512
+
+import numpy as np
+
+
+def get_seed(key: str) -> str:
+    """
+    Gets hash of key.
+    Used as seed in further generation of random numbers to get random pixels.
+    :param key: Secret key.
+    :returns: seed for random numbers.
+    """
+    return sha256(key.encode()).hexdigest()  # We use the Hash function Sha256
+
+
+class PixelOrder(ABC):
+    """
+    Sequence of unique pixels of the picture.
+    Pixels are taken one after another, starting from the first one.
+    """
+
+    random_access = False  # Whether any range of the sequence may be taken
+
+    def __init__(self, key: str, size: tuple[int, int]):
+        """
+        :param key: Secret key.
+        :param size: Picture size.
+        """
+        self.size = size
+
+    @abstractmethod
+    def take(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Takes the next pixels of the sequence.
+        :param count: Max number of pixels.
+        :returns: X and Y coordinates of pixels.
+            Fewer than `count` when the sequence is over.
+        """
+
+    def take_range(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Takes the pixels at positions from `start` to `stop` of the sequence.
+        Ranges must follow each other, unless the order has `random_access`,
+        then they are taken in any order, also from parallel threads.
+        :param start: First position.
+        :param stop: Position after the last one.
+        :returns: X and Y coordinates of pixels.
+            Fewer than requested when the sequence is over.
+        """
+        return self.take(stop - start)
+
+
+class LegacyOrder(PixelOrder):
+    """
+    The original order: pairs `(randrange(width), randrange(height))`
+    from a generator seeded with the key, already used pixels are skipped.
+    The generator is private, so sequences do not affect each other.
+
+    Computed in bulk: `randrange(n)` takes the high `n.bit_length()` bits of the next 32-bit
+    output of the generator and retries while the number is out of range,
+    so the outputs are drawn in batches and the retries are replayed
+    with numpy. Used pixels are marked in a bitmap.
+    """
+
+    max_batch = 1 << 20  # Max pairs of coordinates drawn at a time
+
+    def __init__(self, key: str, size: tuple[int, int]):
+        super().__init__(key, size)
+        self.length = size[0] * size[1]
+        self._random = random.Random(get_seed(key))
+        self._used = np.zeros(self.length, dtype=bool)
+        self._used_count = 0
+        self._words = np.empty(0, dtype=np.uint32)  # Drawn, but not used outputs
+        self._pending = np.empty(0, dtype=np.intp)  # Found, but not taken pixels
+
+    def _draw_words(self, count: int) -> np.ndarray:
+        data = self._random.getrandbits(32 * count).to_bytes(4 * count, "little")
+        return np.frombuffer(data, dtype="<u4")
+
+    @staticmethod
+    def _next_valid(words: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :returns: Number obtained from each output for `randrange(limit)`
+            and index of the first output accepted for it at or after each position
+            (`len(words)` if there is none). Two extra positions at the end.
+        """
+        numbers = words >> np.uint32(32 - limit.bit_length())
+        indices = np.flatnonzero(numbers < limit)
+        next_valid = np.full(len(words) + 2, len(words), dtype=np.intp)
+        next_valid[indices] = indices
+        next_valid = np.minimum.accumulate(next_valid[::-1])[::-1]
+        return numbers, next_valid
+
+    def _draw_pairs(self, count: int) -> np.ndarray:
+        """
+        Draws pairs `(randrange(width), randrange(height))`.
+        :param count: Approximate number of pairs.
+        :returns: Pixel indices (row by row).
+        """
+        width, height = self.size
+        # Expected outputs per pair
+        per_pair = (1 << width.bit_length()) / width + (
+            1 << height.bit_length()
+        ) / height
+        words = np.concatenate(
+            (self._words, self._draw_words(int(count * per_pair * 1.05) + 16))
+        )
+        end = len(words)
+        xs, next_x = self._next_valid(words, width)
+        ys, next_y = self._next_valid(words, height)
+
+        # Position of the next pair for a pair starting at each position,
+        # `end + 1` when the pair is not complete.
+        next_pair = next_y[np.minimum(next_x + 1, end + 1)] + 1
+        # Starts of the pairs: the orbit of 0, collected by pointer doubling.
+        starts = np.zeros(1, dtype=np.intp)
+        jump = next_pair
+        while True:
+            reached = jump[starts]
+            reached = reached[reached <= end]
+            if not len(reached):
+                break
+            starts = np.concatenate((starts, reached))
+            jump = jump[jump]
+        starts.sort()
+        starts = starts[next_pair[starts] <= end]  # only complete pairs
+
+        if len(starts):
+            self._words = words[next_pair[starts[-1]] :]
+        else:
+            self._words = words
+        x_indices = next_x[starts]
+        return ys[next_y[x_indices + 1]].astype(np.intp) * width + xs[x_indices]
+
+    def _fill(self, count: int) -> None:
+        while len(self._pending) < count and self._used_count < self.length:
+            free_share = max(1 - self._used_count / self.length, 0.01)
+            pairs = self._draw_pairs(
+                min(int((count - len(self._pending)) / free_share), self.max_batch)
+            )
+            # Skip repeated pixels
+            _, first = np.unique(pairs, return_index=True)
+            pairs = pairs[np.sort(first)]
+            pairs = pairs[~self._used[pairs]]
+            self._used[pairs] = True
+            self._used_count += len(pairs)
+            self._pending = np.concatenate((self._pending, pairs))
+
+    def take(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        self._fill(count)
+        indices, self._pending = self._pending[:count], self._pending[count:]
+        ys, xs = np.divmod(indices, self.size[0])
+        return xs, ys
+
+
+class KeyedPermutation(PixelOrder):
+    """
+    Keyed pseudo-random permutation of pixel indices.
+    A Feistel network over the smallest even number of bits covering
+    all pixels, indices that fall outside the picture are encrypted again
+    (cycle walking). Any position of the sequence is computed
+    independently in O(1) without remembering used pixels.
+    """
+
+    rounds = 6
+    random_access = True
+
+    def __init__(self, key: str, size: tuple[int, int], offset: int = 0):
+        """
+        :param key: Secret key.
+        :param size: Picture size.
+        :param offset: Number of first pixels (row by row) excluded from the order.
+        """
+        super().__init__(key, size)
+        self.offset = offset
+        self.length = max(size[0] * size[1] - offset, 0)
+        self._half_bits = max(1, ((self.length - 1).bit_length() + 1) // 2)
+        self._mask = np.uint64((1 << self._half_bits) - 1)
+        self._keys = np.frombuffer(
+            sha512(f"pixel-order:{get_seed(key)}".encode()).digest(), dtype="<u8"
+        )[: self.rounds]
+        self._position = 0
+
+    def _round(self, half: np.ndarray, key: np.uint64) -> np.ndarray:
+        x = (half ^ key) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> np.uint64(29)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(32)
+        return x & self._mask
+
+    def _encrypt(self, indices: np.ndarray) -> np.ndarray:
+        shift = np.uint64(self._half_bits)
+        left, right = indices >> shift, indices & self._mask
+        for key in self._keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << shift) | right
+
+    def permute(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: Positions in the sequence.
+        :returns: Indices of pixels (row by row) at these positions.
+        """
+        indices = self._encrypt(positions.astype(np.uint64))
+        outside = np.flatnonzero(indices >= self.length)
+        while len(outside):  # cycle walking
+            indices[outside] = self._encrypt(indices[outside])
+            outside = outside[indices[outside] >= self.length]
+        return indices.astype(np.intp) + self.offset
+
+    def take(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        xs, ys = self.take_range(self._position, self._position + count)
+        self._position += len(xs)
+        return xs, ys
+
+    def take_range(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        stop = min(stop, self.length)
+        indices = self.permute(np.arange(start, stop, dtype=np.uint64))
+        ys, xs = np.divmod(indices, self.size[0])
+        return xs, ys
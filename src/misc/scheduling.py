@@ -0,0 +1,140 @@
+"""
+
+Admission and ordering of jobs by their cost.
+The cost of a job is the work it does, in megapixels, estimated before
+it starts. Users take turns in proportion to the cost of their jobs,
+so one user sending huge pictures does not hold up everyone else.
+Every user has a budget of megapixel-seconds per minute: a finished job
+is charged its cost multiplied by the seconds it ran.
+
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import time
+import typing as ty
+from collections import Counter, OrderedDict
+
+
+class BudgetExceeded(RuntimeError):
+    def __init__(self, wait: float):
+        super().__init__(
+            f"Too many big pictures, try again in {max(1, math.ceil(wait))} seconds"
+        )
+
+
+class CostBudgets:
+    """
+    Budgets of users (token buckets).
+    A bucket holds `per_minute` at most and refills evenly over a minute.
+    A job is accepted while the bucket is not empty, and it is charged
+    when it finishes, as its work is known then. Jobs may overdraw
+    the bucket, so a job costing more than the whole budget still runs
+    when the bucket is full.
+    Not thread-safe.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        :param per_minute: Megapixel-seconds a user may spend per minute.
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        # {<user>: (<tokens>, <time of the update>)}, least recently updated first
+        self._buckets: OrderedDict[ty.Hashable, tuple[float, float]] = OrderedDict()
+
+    def _tokens(self, user: ty.Hashable, now: float) -> float:
+        tokens, updated = self._buckets.get(user, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def check(self, user: ty.Hashable) -> None:
+        """
+        Checks that the user may start a job.
+        :param user: User.
+        :raises: BudgetExceeded if the budget of the user is spent.
+        """
+        if (tokens := self._tokens(user, time.monotonic())) <= 0:
+            raise BudgetExceeded(-tokens / self.rate)
+
+    def charge(self, user: ty.Hashable, cost: float, seconds: float) -> None:
+        """
+        Takes the work of a finished job from the budget of the user.
+        :param user: User.
+        :param cost: Cost of the job in megapixels.
+        :param seconds: Duration of the job.
+        """
+        now = time.monotonic()
+        # Full buckets are the same as absent ones
+        while self._buckets:
+            first = next(iter(self._buckets))
+            if self._tokens(first, now) < self.capacity:
+                break
+            del self._buckets[first]
+
+        self._buckets[user] = (self._tokens(user, now) - cost * seconds, now)
+        self._buckets.move_to_end(user)
+
+
+class FairQueue:
+    """
+    Start-time fair queue.
+    Every job gets a tag: the tag of the previous job of the user plus its cost,
+    but not less than the tag of the last started job. Jobs start in the order
+    of tags, so users with cheap jobs are not stuck behind users with heavy ones.
+    Not thread-safe.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, ty.Any]] = []
+        self._seq = itertools.count()  # Keeps the order of arrival for equal tags
+        self._virtual_time = 0.0  # Tag of the last started job
+        self._finish: dict[ty.Hashable, float] = {}  # Tags after last jobs of users
+        self._queued: Counter = Counter()
+        # Users without queued jobs, by tags after their last jobs.
+        # Forgotten when the tag is passed, as it does not matter anymore.
+        self._idle: list[tuple[float, int, ty.Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, user: ty.Hashable, cost: float, item: ty.Any) -> None:
+        """
+        :param user: Owner of the job.
+        :param cost: Cost of the job.
+        :param item: Job.
+        """
+        start = max(self._virtual_time, self._finish.get(user, 0.0))
+        self._finish[user] = start + cost
+        self._queued[user] += 1
+        heapq.heappush(self._heap, (start, next(self._seq), (user, item)))
+
+    def index(self, match: ty.Callable[[ty.Any], bool]) -> int:
+        """
+        :param match: Check of a job.
+        :returns: Number of jobs before the first matching job.
+        :raises: ValueError if no job matches.
+        """
+        for i, (_, _, (_, item)) in enumerate(sorted(self._heap)):
+            if match(item):
+                return i
+        raise ValueError("No matching job")
+
+    def pop(self) -> ty.Any:
+        """
+        :returns: Next job.
+        :raises: IndexError if the queue is empty.
+        """
+        self._virtual_time, _, (user, item) = heapq.heappop(self._heap)
+        self._queued[user] -= 1
+        if not self._queued[user]:
+            del self._queued[user]
+            heapq.heappush(self._idle, (self._finish[user], next(self._seq), user))
+        while self._idle and self._idle[0][0] <= self._virtual_time:
+            finish, _, idle_user = heapq.heappop(self._idle)
+            if idle_user in self._queued or self._finish.get(idle_user) != finish:
+                continue  # Queued again
+            del self._finish[idle_user]
+        return item
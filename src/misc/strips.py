@@ -0,0 +1,202 @@
+"""
+
+Memory-bounded processing of huge pictures.
+A picture is decoded once, then converted to RGB, modified and encoded
+in horizontal strips, so no full copies of its pixels are made and the
+output PNG is compressed while the strips are produced. Pixels of the text
+are found first and sorted by row, so every strip gets its own pixels.
+The mode is used for pictures whose usual processing would exceed
+the memory budget.
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+from io import BytesIO
+from time import perf_counter
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from .cancellation import CancelToken, check
+from .crypto_engine import embed, load_image, open_image
+from .crypto_header import Header, header_pixels
+from .crypto_img import (
+    ENCODE_COST,
+    HEADER_FORMAT,
+    SYMBOL_COST,
+    Progress,
+    check_capacity,
+    encode_text,
+    get_embed,
+    get_pixel_order,
+    map_chunks,
+    stage_progress,
+)
+from .output import PNG, EncodedImage, OutputPolicy, PngWriter
+
+# Bytes per pixel of the usual processing: the decoded picture,
+# its RGB copy, the array of pixels, the picture built from it and the output
+BYTES_PER_PIXEL = 18
+STRIP_PIXELS = 1 << 18  # Pixels converted and modified at a time
+
+
+def fits_memory(size: tuple[int, int], memory_budget: int) -> bool:
+    """
+    :param size: Size of the picture.
+    :param memory_budget: Bytes a job may use, 0 - unlimited.
+    :returns: Whether the picture may be processed at once.
+    """
+    return not memory_budget or size[0] * size[1] * BYTES_PER_PIXEL <= memory_budget
+
+
+def iter_strips(img: Image.Image) -> ty.Iterator[tuple[int, np.ndarray]]:
+    """
+    :param img: Decoded picture of any mode.
+    :returns: First rows and RGB pixels (rows, width, 3) of strips.
+    """
+    width, height = img.size
+    rows = max(1, STRIP_PIXELS // width)
+    for top in range(0, height, rows):
+        strip = img.crop((0, top, width, min(top + rows, height))).convert("RGB")
+        yield top, np.array(strip)
+
+
+def load_pixels(image: BytesIO, memory_budget: int = 0) -> np.ndarray:
+    """
+    The same as `load_image`, but pictures exceeding the budget are converted
+    strip by strip into the array, without an RGB copy of the picture.
+    :param image: Picture.
+    :param memory_budget: Bytes a job may use, 0 - unlimited.
+    :returns: Writable pixels (height, width, 3).
+    :raises: RuntimeError.
+    """
+    img = open_image(image)
+    if fits_memory(img.size, memory_budget):
+        return load_image(img)[1]
+    pixels = np.empty((img.size[1], img.size[0], 3), dtype=np.uint8)
+    for top, strip in iter_strips(img):
+        pixels[top : top + len(strip)] = strip
+    return pixels
+
+
+class RowSortedWrites:
+    """
+    Codes to put in pixels, sorted by row.
+    """
+
+    def __init__(
+        self,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        codes: np.ndarray,
+        embed_codes: ty.Callable[..., None],
+    ):
+        """
+        :param xs: X coordinates of pixels.
+        :param ys: Y coordinates of pixels.
+        :param codes: Codes, one item per pixel.
+        :param embed_codes: Function putting codes in pixels.
+        """
+        order = np.argsort(ys, kind="stable")
+        self.xs, self.ys, self.codes = xs[order], ys[order], codes[order]
+        self.embed_codes = embed_codes
+
+    def apply(self, strip: np.ndarray, top: int) -> None:
+        """
+        Puts the codes of the strip in it (in place).
+        :param strip: Pixels (rows, width, 3).
+        :param top: First row of the strip.
+        """
+        start, stop = np.searchsorted(self.ys, (top, top + len(strip)))
+        if start < stop:
+            self.embed_codes(
+                strip,
+                self.xs[start:stop],
+                self.ys[start:stop] - top,
+                self.codes[start:stop],
+            )
+
+
+def encrypt_in_strips(
+    text: str,
+    key: str,
+    image: BytesIO,
+    output: OutputPolicy,
+    version: int,
+    bits_per_channel: int = 2,
+    cancel: CancelToken | None = None,
+    progress: Progress | None = None,
+    threads: int = 1,
+) -> EncodedImage:
+    """
+    The same as `encrypt` followed by `encode_image`.
+    The result is always PNG, other formats are not encoded in strips.
+    :param text: Text for encryption.
+    :param key: Secret key.
+    :param image: Initial picture.
+    :param output: Policy of encoding the result, only the PNG level is used.
+    :param version: Format of hidden text.
+    :param bits_per_channel: Bits per channel of the dense format.
+    :param cancel: Cancellation token.
+    :param progress: Callback of progress. Finding pixels of the text
+        and processing of strips are weighted by their work.
+    :param threads: Number of threads finding pixels of the text.
+    :returns: Picture with encrypted text.
+    :raises: RuntimeError.
+    """
+    if not len(text):
+        raise RuntimeError("There is no text")
+
+    codes, length, flags = encode_text(text, version, bits_per_channel)
+    img = open_image(image)
+    check_capacity(len(codes), img.size, version)
+
+    writes = []
+    if version >= HEADER_FORMAT:
+        xs, ys = header_pixels(img.size[0])
+        header = np.frombuffer(Header(version, length, flags).pack(key), np.uint8)
+        writes.append(RowSortedWrites(xs, ys, header, embed))
+    symbols = len(codes) * SYMBOL_COST
+    finding = symbols / (symbols + img.size[0] * img.size[1] * (1 + ENCODE_COST))
+    pixel_order = get_pixel_order(key, img.size, version)
+    parts = map_chunks(
+        pixel_order.take_range,
+        len(codes),
+        threads if pixel_order.random_access else 1,
+        cancel,
+        stage_progress(progress, 0, finding),
+    )
+    xs, ys = (np.concatenate(coordinates) for coordinates in zip(*parts))
+    writes.append(
+        RowSortedWrites(xs, ys, codes, get_embed(version, bits_per_channel))
+    )
+
+    progress = stage_progress(progress, finding, 1 - finding)
+    params = output.choose(img.size)[1]
+    params = {
+        "compress_level": params.get("compress_level", output.png_compress_level),
+        "strips": True,
+    }
+    started_at = perf_counter()
+    bio = BytesIO()
+    writer = PngWriter(
+        bio, img.size, params["compress_level"], img.info.get("icc_profile")
+    )
+    img.load()
+    for top, strip in iter_strips(img):
+        check(cancel)
+        for sorted_writes in writes:
+            sorted_writes.apply(strip, top)
+        writer.write(strip)
+        if progress is not None:
+            progress((top + len(strip)) / img.size[1])
+    writer.close()
+    encoded = EncodedImage(bio.getvalue(), PNG, params, perf_counter() - started_at)
+    logger.debug(
+        f"encoded {img.size[0]}x{img.size[1]} as {PNG} {params}: "
+        f"{len(encoded.data)} bytes in {encoded.seconds:.3f}s"
+    )
+    return encoded
@@ -1,4 +0,0 @@
-from . import tg_webhook
-from . import filters
-from . import handlers
-from .bot import bot, run_pooling, setup_webhook
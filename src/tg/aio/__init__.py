@@ -0,0 +1,19 @@
+import asyncio
+
+from aiohttp import web
+
+from app import config
+from . import handlers
+from .bot import bot, run_pooling
+from .tg_webhook import create_app
+
+
+def run() -> None:
+    if config.base.run_in_host:
+        web.run_app(
+            create_app(),
+            host=config.tg_bot.webhook.listen,
+            port=config.tg_bot.webhook.port,
+        )
+    else:
+        asyncio.run(run_pooling())
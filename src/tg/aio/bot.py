@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import typing as ty
+
+from loguru import logger
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_filters import StateFilter
+from telebot.states.asyncio.middleware import StateMiddleware
+
+from app import config
+from .dispatcher import AsyncUpdateDispatcher
+from .states import states_storage
+from ..exceptions import MyExcHandler
+
+if ty.TYPE_CHECKING:
+    from ..flows import Call
+
+
+bot = AsyncTeleBot(
+    config.tg_bot.token,
+    state_storage=states_storage,
+    parse_mode="HTML",
+    exception_handler=MyExcHandler(),
+)
+bot.setup_middleware(StateMiddleware(bot))
+bot.add_custom_filter(StateFilter(bot))
+dispatcher = AsyncUpdateDispatcher(bot, config.tg_bot.updates_queue_size)
+
+
+async def send(calls: list[Call]) -> list:
+    """
+    Makes the calls of the bot in order (see `tg.flows`).
+    :returns: Results of the calls.
+    """
+    return [
+        await getattr(bot, call.method)(*call.args, **call.kwargs) for call in calls
+    ]
+
+
+async def setup_webhook() -> None:
+    await bot.remove_webhook()
+    await asyncio.sleep(0.1)
+    await bot.set_webhook(
+        f"{config.tg_bot.webhook.host}/{config.tg_bot.webhook.secret_key}",
+        max_connections=config.tg_bot.webhook.max_connections,
+    )
+
+
+async def run_pooling() -> None:
+    """
+    Fetches updates and passes them to the dispatcher.
+    While the dispatcher queue is full, new updates are not fetched.
+    """
+    await bot.remove_webhook()
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset, limit=min(config.tg_bot.updates_queue_size, 100)
+                )
+            except Exception as err:
+                logger.error(f"failed to get updates: {err}")
+                await asyncio.sleep(3)
+                continue
+            for update in updates:
+                await dispatcher.put(update, block=True)
+                offset = update.update_id + 1
+    finally:
+        await bot.close_session()
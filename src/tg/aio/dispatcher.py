@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import typing as ty
+
+from loguru import logger
+
+from ..dispatcher import get_chat_id
+
+if ty.TYPE_CHECKING:
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.types import Update
+
+
+class AsyncUpdateDispatcher:
+    """
+    Bounded set of updates processed concurrently.
+    Updates of one chat are processed one at a time in the order of arrival,
+    network waits of different chats overlap.
+    Delayed calls of a chat (see `call_later`) take their turns with its updates.
+    """
+
+    def __init__(self, bot: AsyncTeleBot, max_updates: int):
+        """
+        :param bot: Bot processing updates.
+        :param max_updates: Max number of updates being processed.
+        """
+        self.bot = bot
+        self.max_updates = max_updates
+        self._slots: asyncio.Semaphore | None = None
+        # {<chat_id>: (<lock of the chat>, <number of updates of the chat>)}
+        self._chats: dict[ty.Hashable, tuple[asyncio.Lock, int]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def put(self, update: Update, block: bool = False) -> bool:
+        """
+        Starts processing of the update.
+        :param update: Update.
+        :param block: Wait for a free place if too many updates are processed.
+        :returns: Whether the update was accepted.
+        """
+        chat_id = get_chat_id(update)
+        if chat_id is None:
+            chat_id = ("update", update.update_id)
+        return await self._put(chat_id, update, block)
+
+    def call_later(
+        self,
+        chat_id: ty.Hashable,
+        delay: float,
+        func: ty.Callable[[], ty.Awaitable],
+    ) -> None:
+        """
+        Calls the function in turn with the updates of the chat
+        after `delay` seconds. Must be called in the event loop.
+        :param chat_id: Id of the chat.
+        :param delay: Seconds.
+        :param func: Async function.
+        """
+        asyncio.get_running_loop().call_later(delay, self._start, chat_id, func)
+
+    def _start(self, chat_id: ty.Hashable, func: ty.Callable[[], ty.Awaitable]):
+        task = asyncio.create_task(self._put(chat_id, func, True))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _put(
+        self,
+        chat_id: ty.Hashable,
+        item: Update | ty.Callable[[], ty.Awaitable],
+        block: bool,
+    ) -> bool:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_updates)
+        if not block and self._slots.locked():
+            return False
+        await self._slots.acquire()
+
+        # The lock is taken in the order the updates arrive,
+        # because tasks start in the order they are created.
+        lock, count = self._chats.get(chat_id, (None, 0))
+        self._chats[chat_id] = (lock or asyncio.Lock(), count + 1)
+
+        task = asyncio.create_task(self._process(chat_id, item))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(
+        self, chat_id: ty.Hashable, item: Update | ty.Callable[[], ty.Awaitable]
+    ) -> None:
+        try:
+            async with self._chats[chat_id][0]:
+                if callable(item):
+                    await item()
+                else:
+                    await self.bot.process_new_updates([item])
+        except Exception as err:
+            logger.exception(err)
+        finally:
+            lock, count = self._chats[chat_id]
+            if count == 1:
+                del self._chats[chat_id]
+            else:
+                self._chats[chat_id] = (lock, count - 1)
+            self._slots.release()
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import asyncio
+import typing as ty
+
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiHTTPException
+
+from ..downloads import (
+    CHUNK_SIZE,
+    admission,
+    files_cache,
+    get_cached_image,
+    get_file_url,
+)
+
+
+if ty.TYPE_CHECKING:
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.types import Document, PhotoSize
+
+
+async def download_image(
+    bot: AsyncTeleBot, file: Document | PhotoSize, text_length: int = 0
+) -> bytes:
+    """
+    The same as `tg.downloads.download_image` for the async runtime.
+    """
+    admission.check_file(file.file_size, getattr(file, "mime_type", None))
+    # The cache may read files from the disk
+    data = await asyncio.to_thread(get_cached_image, file, text_length)
+    if data is not None:
+        return data
+    file_info = await bot.get_file(file.file_id)
+    admission.check_file(file_info.file_size, None)
+    reader = admission.reader(text_length)
+    session = await asyncio_helper.session_manager.get_session()
+    async with session.get(
+        get_file_url(asyncio_helper.FILE_URL, bot.token, file_info.file_path),
+        proxy=asyncio_helper.proxy,
+    ) as response:
+        if response.status != 200:
+            raise ApiHTTPException("Download file", response)
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            reader.feed(chunk)
+    data = reader.getvalue()
+    if files_cache is not None:
+        await asyncio.to_thread(files_cache.put, file.file_unique_id, data)
+    return data
@@ -0,0 +1 @@
+from . import base_commands, encrypt, decrypt, expired
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import typing as ty
+
+from ... import flows
+from ..bot import bot, send
+from ..rate_limit import rate_limit
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+    from telebot.states.asyncio import StateContext
+
+
+@bot.message_handler(commands=["test"])
+@rate_limit(5)
+async def test_handler(message: Message) -> None:
+    await bot.reply_to(message, "I`m fine...")
+
+
+@bot.message_handler(commands=["start"])
+@rate_limit(2)
+async def start_handler(message: Message) -> None:
+    await send(flows.greet(message))
+
+
+@bot.message_handler(commands=["help"])
+@rate_limit(2)
+async def help_handler(message: Message) -> None:
+    await send(flows.show_help(message))
+
+
+@bot.message_handler(commands=["cancel"], state="*")
+@rate_limit(2)
+async def cancel_handler(message: Message, state: StateContext) -> None:
+    calls = flows.cancel(message)
+    await state.delete()
+    await send(calls)
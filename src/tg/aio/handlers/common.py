@@ -0,0 +1,286 @@
+"""
+
+The same as `tg.handlers.common` for the async runtime.
+Pictures of a batch are downloaded concurrently.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import typing as ty
+from functools import partial
+
+from loguru import logger
+
+from misc.cancellation import Cancelled
+from ... import flows
+from ...batches import BatchItem, set_results
+from ...jobs import batches, jobs, progress_messages
+from ...storages import set_state_data, update_data
+from ...utils import CancelHandler, user_error
+from ..bot import bot, dispatcher, send
+from ..downloads import download_image
+from ..states import states_storage
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+    from telebot.states import State
+    from telebot.states.asyncio import StateContext
+
+    MakeJob = ty.Callable[[Message, bytes], flows.Job]
+    Answer = ty.Callable[[Message, ty.Any], flows.Answers]
+
+
+# Jobs waited for after their handlers returned
+_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: ty.Coroutine) -> asyncio.Task:
+    """
+    Runs the coroutine in a task, so the handler returns and the dispatcher
+    processes other updates of the chat meanwhile, e.g. /cancel.
+    """
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_finish_task)
+    return task
+
+
+def _finish_task(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and (err := task.exception()) is not None:
+        logger.opt(exception=err).error("background task failed")
+
+
+async def get_image(
+    message: Message, text_length: int = 0, compressed: bool = True
+) -> bytes:
+    if (file := flows.get_picture(message, compressed)) is None:
+        await send(flows.no_picture(message, compressed))
+        raise CancelHandler()
+    try:
+        return await download_image(bot, file, text_length)
+    except RuntimeError as err:
+        await send(flows.picture_refused(message, err))
+        raise CancelHandler()
+
+
+async def advance(message: Message, state: State, **data) -> None:
+    """
+    Moves the conversation to the state and adds the data in one write.
+    """
+    await set_state_data(states_storage, message, bot.bot_id, state, **data)
+
+
+async def start_processing(message: Message, state: StateContext) -> dict | None:
+    """
+    Marks that a picture of the conversation is processed.
+    :param message: Message with the picture, the user is told if it is refused.
+    :returns: Data of the state or None if a picture is processed already.
+    """
+    async with state.data() as data:
+        processing = data.get("processing")
+        data["processing"] = True
+        data = dict(data)
+    if processing:
+        await send(flows.still_processing(message))
+        return None
+    return data
+
+
+async def collect(
+    message: Message,
+    state: StateContext,
+    process: ty.Callable[[StateContext, list[Message]], ty.Awaitable],
+) -> bool:
+    """
+    Adds the message to a batch if it is a part of an album
+    or pictures of the user are being collected (see `tg.batches`).
+    The batch is processed in turn with the updates of the chat.
+    :param process: Processes the batch.
+    :returns: Whether the message is added.
+    """
+    add = partial(batches.add, message)
+    if not await update_data(states_storage, message, bot.bot_id, add):
+        return False
+    dispatcher.call_later(
+        message.chat.id, batches.delay, partial(complete, message, state, process)
+    )
+    return True
+
+
+async def complete(
+    message: Message,
+    state: StateContext,
+    process: ty.Callable[[StateContext, list[Message]], ty.Awaitable],
+) -> None:
+    """
+    Processes the batch if no pictures were added since the message.
+    """
+    take = batches.take
+    if messages := await update_data(states_storage, message, bot.bot_id, take):
+        await process(state, messages)
+
+
+async def is_processing(message: Message) -> bool:
+    """
+    :returns: Whether the pictures of the conversation are still processed,
+        it is checked again before long steps, as /cancel may come meanwhile.
+    """
+    return await update_data(
+        states_storage, message, bot.bot_id, flows.is_processing
+    )
+
+
+async def fail(message: Message, state: StateContext, err: Exception) -> None:
+    """
+    Reports an unexpected error of processing and lets the user send
+    another picture.
+    """
+    logger.opt(exception=err).error("processing failed")
+    try:
+        await send(flows.failed(message, RuntimeError("Internal error")))
+    finally:
+        async with state.data() as data:
+            data["processing"] = False
+
+
+async def queue(message: Message) -> Message:
+    """
+    :returns: The "Added to queue" message showing progress.
+    """
+    msg_queue = (await send(flows.queued(message)))[0]
+    flows.track_progress(message, msg_queue)
+    progress_messages.start_task(bot.edit_message_text)
+    return msg_queue
+
+
+async def deliver(
+    message: Message,
+    state: StateContext,
+    msg_queue: Message,
+    answer: Answer,
+    result: ty.Any = None,
+    error: RuntimeError | None = None,
+) -> None:
+    """
+    Sends the result of a job (see `flows.finish`).
+    """
+    calls, done = flows.finish(message, msg_queue, answer, result, error)
+    try:
+        await send(calls)
+    except Exception as err:
+        if done is None:
+            return logger.opt(exception=err).error("processing failed")
+        return await fail(message, state, err)
+    if done:
+        await state.delete()
+    elif done is False:
+        async with state.data() as data:
+            data["processing"] = False
+
+
+async def run(make_job: MakeJob, message: Message, image: bytes) -> ty.Any:
+    job = make_job(message, image)
+    return await jobs.run(job.func, *job.args, **job.kwargs)
+
+
+async def run_job(
+    message: Message,
+    state: StateContext,
+    image: bytes,
+    make_job: MakeJob,
+    answer: Answer,
+) -> None:
+    """
+    Starts the job, it is waited for and its result is sent in the background.
+    """
+    try:
+        msg_queue = await queue(message)
+    except Exception as err:
+        return await fail(message, state, err)
+    run_in_background(wait_job(message, state, msg_queue, image, make_job, answer))
+
+
+async def wait_job(
+    message: Message,
+    state: StateContext,
+    msg_queue: Message,
+    image: bytes,
+    make_job: MakeJob,
+    answer: Answer,
+) -> None:
+    try:
+        result = await run(make_job, message, image)
+    except Exception as err:
+        return await deliver(message, state, msg_queue, answer, error=user_error(err))
+    await deliver(message, state, msg_queue, answer, result)
+
+
+async def download_picture(
+    message: Message, text_length: int = 0, compressed: bool = True
+) -> bytes:
+    if (file := flows.get_picture(message, compressed)) is None:
+        raise flows.NoPicture(compressed)
+    try:
+        return await download_image(bot, file, text_length)
+    except Exception as err:
+        raise user_error(err, "The picture was not downloaded")
+
+
+async def run_batch(
+    state: StateContext,
+    messages: list[Message],
+    make_job: MakeJob,
+    answer: Answer,
+    text_length: int = 0,
+    compressed: bool = True,
+) -> None:
+    """
+    Processes pictures of a batch in parallel and sends the results at once.
+    The jobs are waited for and the results are sent in the background.
+    """
+    message = messages[0]
+    items, messages, skipped = flows.batch_items(messages)
+    indexes = list(range(len(items)))
+    downloads = await asyncio.gather(
+        *(download_picture(msg, text_length, compressed) for msg in messages),
+        return_exceptions=True,
+    )
+    set_results(items, indexes, downloads)
+    if not await is_processing(message):
+        return  # Cancelled
+    try:
+        msg_queue = await queue(message)
+    except Exception as err:
+        return await fail(message, state, err)
+
+    futures = {}
+    for index in indexes:
+        if items[index].error is not None:
+            continue
+        if not await is_processing(message):
+            items[index].error = Cancelled()
+            continue
+        try:
+            job = make_job(messages[index], items[index].result)
+            futures[index] = jobs.submit_async(job.func, *job.args, **job.kwargs)
+        except Exception as err:
+            items[index].error = user_error(err)
+    answer = partial(answer, skipped=skipped)
+    run_in_background(wait_batch(message, state, msg_queue, answer, items, futures))
+
+
+async def wait_batch(
+    message: Message,
+    state: StateContext,
+    msg_queue: Message,
+    answer: Answer,
+    items: list[BatchItem],
+    futures: dict[int, asyncio.Future],
+) -> None:
+    results = await asyncio.gather(*futures.values(), return_exceptions=True)
+    set_results(items, list(futures), results)
+    await deliver(message, state, msg_queue, answer, items)
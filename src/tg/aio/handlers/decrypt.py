@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import typing as ty
+from functools import partial
+
+from loguru import logger
+
+from ... import flows
+from ...states import Decrypt
+from ..bot import bot, send
+from ..rate_limit import rate_limit
+from .common import (
+    advance,
+    collect,
+    get_image,
+    run_batch,
+    run_job,
+    start_processing,
+)
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+    from telebot.states.asyncio import StateContext
+
+
+@bot.message_handler(commands=["decrypt"])
+@rate_limit(5)
+async def encrypt_start_handler(message: Message, state: StateContext):
+    if await state.get() is not None:
+        return await send(flows.busy(message))
+
+    await send(flows.ask_decryption_key(message))
+    await state.set(Decrypt.waiting_for_key)
+
+
+@bot.message_handler(state=Decrypt.waiting_for_key)
+async def get_key(message: Message, state: StateContext):
+    await advance(message, Decrypt.waiting_for_img, key=message.text)
+    await send(flows.ask_uncompressed_picture(message))
+
+
+async def decrypt_batch(state: StateContext, messages: list[Message]) -> None:
+    if (data := await start_processing(messages[0], state)) is None:
+        return
+    logger.trace(f"start decrypt batch {messages[0].message_id}")
+    await run_batch(
+        state,
+        messages,
+        partial(flows.make_decrypt_job, key=data["key"]),
+        flows.batch_text_answers,
+        compressed=False,
+    )
+
+
+@bot.message_handler(
+    state=Decrypt.waiting_for_img, content_types=["text", "photo", "document"]
+)
+async def encrypt_finish(message: Message, state: StateContext):
+    if await collect(message, state, decrypt_batch):
+        return
+    image = await get_image(message, compressed=False)
+    if (data := await start_processing(message, state)) is None:
+        return
+    logger.trace(f"start decrypt {message.message_id}")
+    await run_job(
+        message,
+        state,
+        image,
+        partial(flows.make_decrypt_job, key=data["key"]),
+        flows.text_answers,
+    )
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import typing as ty
+from functools import partial
+
+from ... import flows
+from ...states import Encrypt
+from ..bot import bot, send
+from ..rate_limit import rate_limit
+from .common import (
+    advance,
+    collect,
+    get_image,
+    run_batch,
+    run_job,
+    start_processing,
+)
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+    from telebot.states.asyncio import StateContext
+
+
+@bot.message_handler(commands=["encrypt"])
+@rate_limit(5)
+async def encrypt_start_handler(message: Message, state: StateContext):
+    if await state.get() is not None:
+        return await send(flows.busy(message))
+
+    await send(flows.ask_text(message))
+    await state.set(Encrypt.waiting_for_text)
+
+
+@bot.message_handler(state=Encrypt.waiting_for_text)
+async def get_text(message: Message, state: StateContext):
+    await advance(message, Encrypt.waiting_for_key, text=message.text)
+    await send(flows.ask_encryption_key(message))
+
+
+@bot.message_handler(state=Encrypt.waiting_for_key)
+async def get_key(message: Message, state: StateContext):
+    await advance(message, Encrypt.waiting_for_img, key=message.text)
+    await send(flows.ask_picture(message))
+
+
+async def encrypt_batch(state: StateContext, messages: list[Message]) -> None:
+    if (data := await start_processing(messages[0], state)) is None:
+        return
+    await run_batch(
+        state,
+        messages,
+        partial(flows.make_encrypt_job, text=data["text"], key=data["key"]),
+        flows.batch_image_answers,
+        flows.text_pixels(data["text"]),
+    )
+
+
+@bot.message_handler(
+    state=Encrypt.waiting_for_img, content_types=["photo", "text", "document"]
+)
+async def encrypt_finish(message: Message, state: StateContext):
+    if await collect(message, state, encrypt_batch):
+        return
+    async with state.data() as data:
+        text_length = flows.text_pixels(data["text"])
+    image = await get_image(message, text_length)
+    if (data := await start_processing(message, state)) is None:
+        return
+    await run_job(
+        message,
+        state,
+        image,
+        partial(flows.make_encrypt_job, text=data["text"], key=data["key"]),
+        flows.image_answers,
+    )
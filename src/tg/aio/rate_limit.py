@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+import typing as ty
+from functools import wraps
+
+from app import config
+from .bot import bot
+from ..limiters import MemoryRateLimiter, create_rate_limiter
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+
+
+# One storage for all handlers
+limiter = create_rate_limiter(
+    config.tg_bot.rate_limit_storage,
+    config.tg_bot.rate_limit_url,
+    config.tg_bot.rate_limit_max_entries,
+)
+
+
+def rate_limit(limit: int):
+    """
+    Decorator for async command handlers.
+    Implements command rate-limit.
+    :param limit: Seconds.
+    """
+
+    def _decorator(func):
+        # The same in both runtimes, so workers of any kind share limits
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @wraps(func)
+        async def _wrapper(message: Message, *args, **kwargs):
+            key = f"{name}:{message.chat.id}"
+            if isinstance(limiter, MemoryRateLimiter):
+                delay, warned = limiter.hit(key, limit)
+            else:
+                delay, warned = await asyncio.to_thread(limiter.hit, key, limit)
+            if delay:
+                if not warned:
+                    return await bot.reply_to(
+                        message,
+                        "The team is temporarily locked, "
+                        f"try after {round(delay, 2)} seconds",
+                    )
+                return
+            await func(message, *args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
@@ -0,0 +1,11 @@
+from app import config
+from ..storages import create_async_storage
+
+
+states_storage = create_async_storage(
+    config.tg_bot.states_storage,
+    config.tg_bot.states_url,
+    config.tg_bot.states_ttl,
+    config.tg_bot.states_max_entries,
+    config.tg_bot.states_max_bytes,
+)
@@ -0,0 +1,36 @@
+from aiohttp import web
+from telebot.types import Update
+
+from app import config
+from .bot import bot, dispatcher, setup_webhook
+
+routes = web.RouteTableDef()
+
+
+@routes.post(f"/{config.tg_bot.webhook.secret_key}")
+async def telegram_webhook(request: web.Request) -> web.Response:
+    if request.content_type != "application/json":
+        raise web.HTTPForbidden()
+    update = Update.de_json(await request.text())
+    if not config.tg_bot.webhook.fast_ack:
+        await bot.process_new_updates([update])
+    elif not await dispatcher.put(update):
+        # Telegram will deliver the update again later
+        raise web.HTTPServiceUnavailable()
+    return web.Response()
+
+
+async def on_startup(_: web.Application) -> None:
+    await setup_webhook()
+
+
+async def on_cleanup(_: web.Application) -> None:
+    await bot.close_session()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
@@ -0,0 +1,245 @@
+"""
+
+Batches of pictures.
+Telegram sends every picture of an album as a separate message, so pictures
+of a user are collected until none arrive for `delay` seconds and are
+processed as one batch: their jobs run in parallel and the results are
+returned as one album, or as a zip archive when they do not fit in an album.
+
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import typing as ty
+import zipfile
+from dataclasses import dataclass
+from io import BytesIO
+
+from telebot.types import InputFile, InputMediaDocument, Message
+
+from .texts import MAX_MESSAGE_LENGTH, TITLE, message_length
+from .utils import user_error
+
+if ty.TYPE_CHECKING:
+    from misc.output import EncodedImage
+
+
+MAX_ALBUM_SIZE = 10
+
+
+class PictureBatches:
+    """
+    Pictures of a batch are kept in the data of the conversation state
+    (see `storages.update_data`), so with a shared storage the pictures
+    of an album may come to different processes.
+    """
+
+    def __init__(self, delay: float):
+        """
+        :param delay: Seconds without new pictures after which a batch is complete.
+        """
+        self.delay = delay
+
+    @staticmethod
+    def is_batch(message: Message) -> bool:
+        """
+        :returns: Whether the message is a part of an album.
+        """
+        return message.media_group_id is not None
+
+    def add(self, message: Message, data: dict | None) -> bool:
+        """
+        Adds the message to the batch being collected, a batch is started
+        by a part of an album.
+        :param message: Message with a picture.
+        :param data: Data of the state, changed in place.
+        :returns: Whether the message is added.
+        """
+        if data is None or not (self.is_batch(message) or "batch" in data):
+            return False
+        data.setdefault("batch", []).append(message.json)
+        data["batch_until"] = time.time() + self.delay
+        return True
+
+    @staticmethod
+    def take(data: dict | None) -> list[Message] | None:
+        """
+        Removes the batch from the data if it is complete.
+        :param data: Data of the state, changed in place.
+        :returns: Messages of the batch or None if it is not complete.
+        """
+        if data is None or time.time() < data.get("batch_until", float("inf")):
+            return None
+        del data["batch_until"]
+        messages = [Message.de_json(message) for message in data.pop("batch")]
+        return sorted(messages, key=lambda message: message.message_id)
+
+
+@dataclass
+class BatchItem:
+    name: str  # File name of the picture
+    result: ty.Any = None
+    error: RuntimeError | None = None
+
+
+def get_file_name(message: Message, index: int) -> str:
+    """
+    :param message: Message with a picture.
+    :param index: Number of the picture in the batch.
+    :returns: Name of the picture.
+    """
+    if message.document and message.document.file_name:
+        return message.document.file_name
+    return f"picture_{index + 1}.jpg"
+
+
+def unique_names(names: list[str]) -> list[str]:
+    """
+    :param names: Names of files.
+    :returns: The names with numbers added to repeated ones.
+    """
+    seen: dict[str, int] = {}
+    result = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        result.append(f"{stem}_{count}{ext}" if count else name)
+    return result
+
+
+def pack_files(files: list[tuple[str, bytes]], zip_name: str) -> list | InputFile:
+    """
+    :param files: Names and data of files.
+    :param zip_name: Name of the archive.
+    :returns: One file, media of an album, or an archive if the files
+        do not fit in one album.
+    """
+    names = unique_names([name for name, _ in files])
+    if len(files) == 1:
+        return InputFile(BytesIO(files[0][1]), names[0])
+    if len(files) <= MAX_ALBUM_SIZE:
+        return [
+            InputMediaDocument(
+                InputFile(BytesIO(data), name), disable_content_type_detection=True
+            )
+            for name, (_, data) in zip(names, files)
+        ]
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as file:
+        for name, (_, data) in zip(names, files):
+            file.writestr(name, data)
+    archive.seek(0)
+    return InputFile(archive, zip_name)
+
+
+def image_files(items: list[BatchItem]) -> list[tuple[str, bytes]]:
+    """
+    :param items: Items of a batch of encryption.
+    :returns: Pictures with encrypted text as files.
+    """
+    files = []
+    for item in items:
+        if item.error is None:
+            crypto_image: EncodedImage = item.result
+            name = f"{os.path.splitext(item.name)[0]}_crypto.{crypto_image.format}"
+            files.append((name, crypto_image.data))
+    return files
+
+
+def format_errors(items: list[BatchItem], skipped: int = 0) -> str | None:
+    """
+    :param items: Items of a batch.
+    :param skipped: Number of pictures over the max size of a batch.
+    :returns: Text about failed pictures or None if all are processed.
+    """
+    errors = [
+        f"{item.name}: something went wrong: {item.error}."
+        for item in items
+        if item.error is not None
+    ]
+    if skipped:
+        errors.append(
+            f"{skipped} more pictures were skipped, the limit is {len(items)}."
+        )
+    return "\n".join(errors) if errors else None
+
+
+def format_texts(items: list[BatchItem]) -> str | None:
+    """
+    :param items: Items of a batch of decryption.
+    :returns: Decrypted texts as one message or None if they are too long.
+    """
+    text = f"{TITLE}\n\n" + "\n\n".join(
+        f"{item.name}:\n{item.result}" for item in items if item.error is None
+    )
+    return text if message_length(text) <= MAX_MESSAGE_LENGTH else None
+
+
+def text_files(items: list[BatchItem]) -> list[tuple[str, bytes]]:
+    """
+    :param items: Items of a batch of decryption.
+    :returns: Decrypted texts as files.
+    """
+    return [
+        (os.path.splitext(item.name)[0] + ".txt", item.result.encode())
+        for item in items
+        if item.error is None
+    ]
+
+
+def set_results(items: list[BatchItem], indexes: list[int], results: list) -> None:
+    """
+    Sets results of `asyncio.gather` with `return_exceptions=True`.
+    :param items: Items of a batch.
+    :param indexes: Indexes of the items of the results.
+    :param results: Results or errors.
+    :raises: Errors which are not exceptions, e.g. `asyncio.CancelledError`.
+    """
+    for index, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            items[index].error = user_error(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            items[index].result = result
+
+
+class BatchResults:
+    """
+    Collects results of the jobs of a batch, which come from different threads.
+    """
+
+    def __init__(
+        self,
+        items: list[BatchItem],
+        on_complete: ty.Callable[[list[BatchItem]], ty.Any],
+    ):
+        """
+        :param items: Items of the batch.
+        :param on_complete: Called with the items when all results are set.
+        """
+        self.items = items
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._left = sum(item.error is None for item in items)
+        if not self._left:
+            on_complete(items)
+
+    def set_result(self, index: int, result: ty.Any) -> None:
+        self._set(index, result, None)
+
+    def set_error(self, index: int, error: RuntimeError) -> None:
+        self._set(index, None, error)
+
+    def _set(self, index: int, result: ty.Any, error: RuntimeError | None) -> None:
+        with self._lock:
+            self.items[index].result = result
+            self.items[index].error = error
+            self._left -= 1
+            if self._left:
+                return
+        self.on_complete(self.items)
@@ -1,13 +1,28 @@
+from __future__ import annotations
+
 import time
+import typing as ty
 
+from loguru import logger
 from telebot import TeleBot, custom_filters
 from telebot.states.sync.middleware import StateMiddleware
 
 from app import config
+from .dispatcher import UpdateDispatcher
 from .exceptions import MyExcHandler
-from .states import states_storage
+from .storages import create_storage
+
+if ty.TYPE_CHECKING:
+    from .flows import Call
 
 
+states_storage = create_storage(
+    config.tg_bot.states_storage,
+    config.tg_bot.states_url,
+    config.tg_bot.states_ttl,
+    config.tg_bot.states_max_entries,
+    config.tg_bot.states_max_bytes,
+)
 bot = TeleBot(
     config.tg_bot.token,
     threaded=False,
@@ -18,6 +33,17 @@ bot = TeleBot(
 )
 bot.setup_middleware(StateMiddleware(bot))
 bot.add_custom_filter(custom_filters.StateFilter(bot))
+dispatcher = UpdateDispatcher(
+    bot, config.tg_bot.workers, config.tg_bot.updates_queue_size
+)
+
+
+def send(calls: list[Call]) -> list:
+    """
+    Makes the calls of the bot in order (see `tg.flows`).
+    :returns: Results of the calls.
+    """
+    return [getattr(bot, call.method)(*call.args, **call.kwargs) for call in calls]
 
 
 def setup_webhook() -> None:
@@ -25,10 +51,26 @@ def setup_webhook() -> None:
     time.sleep(0.1)
     bot.set_webhook(
         f"{config.tg_bot.webhook.host}/{config.tg_bot.webhook.secret_key}",
-        max_connections=1,
+        max_connections=config.tg_bot.webhook.max_connections,
     )
 
 
 def run_pooling():
+    """
+    Fetches updates and passes them to the dispatcher.
+    While the dispatcher queue is full, new updates are not fetched.
+    """
     bot.remove_webhook()
-    bot.infinity_polling()
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(
+                offset, limit=min(config.tg_bot.updates_queue_size, 100)
+            )
+        except Exception as err:
+            logger.error(f"failed to get updates: {err}")
+            time.sleep(3)
+            continue
+        for update in updates:
+            dispatcher.put(update, block=True)
+            offset = update.update_id + 1
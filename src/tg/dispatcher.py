@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import threading
+import typing as ty
+from collections import deque
+
+from loguru import logger
+
+if ty.TYPE_CHECKING:
+    from telebot import TeleBot
+    from telebot.types import Update
+
+
+def get_chat_id(update: Update) -> int | None:
+    """
+    :returns: Id of the chat the update belongs to.
+    """
+    for obj in (
+        update.message,
+        update.edited_message,
+        update.callback_query and update.callback_query.message,
+        update.my_chat_member,
+        update.chat_member,
+        update.chat_join_request,
+    ):
+        if obj is not None and getattr(obj, "chat", None) is not None:
+            return obj.chat.id
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Bounded queue of updates processed by a pool of threads.
+    Updates of one chat are processed one at a time in the order of arrival,
+    different chats are processed in parallel and take turns.
+    Delayed calls of a chat (see `call_later`) take their turns with its updates.
+    """
+
+    def __init__(self, bot: TeleBot, workers: int, max_updates: int):
+        """
+        :param bot: Bot processing updates.
+        :param workers: Number of threads.
+        :param max_updates: Max number of updates waiting for processing.
+        """
+        self.bot = bot
+        self.workers = workers
+        self.max_updates = max_updates
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._ready = threading.Condition(self._lock)
+        # {<chat_id>: <updates and calls of the chat>}
+        self._chats: dict[ty.Hashable, deque[Update | ty.Callable[[], ty.Any]]] = {}
+        self._ready_chats: deque[ty.Hashable] = deque()  # Chats waiting for a thread
+        self._size = 0  # Number of waiting updates
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"UpdateWorker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, update: Update, block: bool = False) -> bool:
+        """
+        Adds the update to the queue.
+        :param update: Update.
+        :param block: Wait for a free place if the queue is full.
+        :returns: Whether the update was added.
+        """
+        chat_id = get_chat_id(update)
+        if chat_id is None:
+            chat_id = ("update", update.update_id)
+        return self._put(chat_id, update, block)
+
+    def call_later(
+        self, chat_id: ty.Hashable, delay: float, func: ty.Callable[[], ty.Any]
+    ) -> None:
+        """
+        Calls the function in turn with the updates of the chat
+        after `delay` seconds.
+        :param chat_id: Id of the chat.
+        :param delay: Seconds.
+        :param func: Function.
+        """
+        timer = threading.Timer(delay, self._put, (chat_id, func, True))
+        timer.daemon = True
+        timer.start()
+
+    def _put(
+        self,
+        chat_id: ty.Hashable,
+        item: Update | ty.Callable[[], ty.Any],
+        block: bool,
+    ) -> bool:
+        self.start()
+        with self._not_full:
+            while self._size >= self.max_updates:
+                if not block:
+                    return False
+                self._not_full.wait()
+            self._size += 1
+            if chat_id in self._chats:
+                # The chat is already waiting or being processed
+                self._chats[chat_id].append(item)
+            else:
+                self._chats[chat_id] = deque([item])
+                self._ready_chats.append(chat_id)
+                self._ready.notify()
+        return True
+
+    def _work(self) -> None:
+        while True:
+            with self._ready:
+                while not self._ready_chats:
+                    self._ready.wait()
+                chat_id = self._ready_chats.popleft()
+                item = self._chats[chat_id][0]
+
+            try:
+                if callable(item):
+                    item()
+                else:
+                    self.bot.process_new_updates([item])
+            except Exception as err:
+                logger.exception(err)
+
+            with self._lock:
+                updates = self._chats[chat_id]
+                updates.popleft()
+                if updates:
+                    self._ready_chats.append(chat_id)
+                    self._ready.notify()
+                else:
+                    del self._chats[chat_id]
+                self._size -= 1
+                self._not_full.notify()
@@ -0,0 +1,96 @@
+"""
+
+Downloading of pictures with admission (see `misc.admission`).
+The file is streamed, so the download stops as soon as the picture is refused.
+Downloaded files are cached by their unique ids.
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+
+import requests
+from telebot import apihelper
+from telebot.apihelper import ApiHTTPException
+
+from app import config
+from misc.admission import ImageAdmission
+from misc.cache import DiskCache, LRUCache
+
+
+if ty.TYPE_CHECKING:
+    from telebot import TeleBot
+    from telebot.types import Document, PhotoSize
+
+
+admission = ImageAdmission(config.images.max_file_size, config.images.max_pixels)
+CHUNK_SIZE = 64 * 1024
+files_cache = (
+    LRUCache(
+        config.images.cache_size,
+        DiskCache(config.images.cache_dir, config.images.cache_dir_size)
+        if config.images.cache_dir
+        else None,
+    )
+    if config.images.cache_size
+    else None
+)
+
+
+def get_cached_image(file: Document | PhotoSize, text_length: int) -> bytes | None:
+    """
+    :param file: File of the picture.
+    :param text_length: Length of the text to hide, 0 for decryption.
+    :returns: Downloaded picture or None if it is not in the cache.
+    :raises: RuntimeError if the picture is refused.
+    """
+    if files_cache is None or (data := files_cache.get(file.file_unique_id)) is None:
+        return None
+    reader = admission.reader(text_length)
+    reader.feed(data)
+    return reader.getvalue()
+
+
+def get_file_url(file_url: str | None, token: str, file_path: str) -> str:
+    """
+    :param file_url: Custom url template of files (`apihelper.FILE_URL`).
+    :param token: Token of the bot.
+    :param file_path: Path of the file on the server of Telegram.
+    :returns: Url of the file.
+    """
+    if file_url is None:
+        return f"https://api.telegram.org/file/bot{token}/{file_path}"
+    return file_url.format(token, file_path)
+
+
+def download_image(
+    bot: TeleBot, file: Document | PhotoSize, text_length: int = 0
+) -> bytes:
+    """
+    :param bot: Bot.
+    :param file: File of the picture.
+    :param text_length: Length of the text to hide, 0 for decryption.
+    :returns: Picture.
+    :raises: RuntimeError if the picture is refused.
+    """
+    admission.check_file(file.file_size, getattr(file, "mime_type", None))
+    if (data := get_cached_image(file, text_length)) is not None:
+        return data
+    file_info = bot.get_file(file.file_id)
+    admission.check_file(file_info.file_size, None)
+    reader = admission.reader(text_length)
+    with requests.get(
+        get_file_url(apihelper.FILE_URL, bot.token, file_info.file_path),
+        proxies=apihelper.proxy,
+        timeout=(apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT),
+        stream=True,
+    ) as response:
+        if response.status_code != 200:
+            raise ApiHTTPException("Download file", response)
+        for chunk in response.iter_content(CHUNK_SIZE):
+            reader.feed(chunk)
+    data = reader.getvalue()
+    if files_cache is not None:
+        files_cache.put(file.file_unique_id, data)
+    return data
@@ -0,0 +1,464 @@
+"""
+
+Steps of the conversations shared by both runtimes.
+Functions here decide what to answer, which jobs to run and what to send
+when they finish. Answers are calls of methods of the bot (see `Call`),
+which the handlers of the sync and the async runtime make in their own way,
+so every step is written once.
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+from dataclasses import dataclass, field
+from io import BytesIO
+
+from app import config
+from misc.cancellation import Cancelled
+from misc.crypto_img import HEADER_FORMAT, count_text_pixels
+from misc.jobs import decrypt_job, encrypt_job, estimate_cost, get_job_key
+from misc.stickers import get_sticker
+from . import keyboards
+from .batches import BatchItem, format_errors, format_texts, get_file_name
+from .batches import image_files, pack_files, text_files
+from .jobs import jobs, output_policy, progress_messages
+from .texts import TITLE, message_length, pack_messages, text_document
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Document, Message, PhotoSize
+    from misc.output import EncodedImage
+
+
+@dataclass(frozen=True)
+class Call:
+    method: str  # Name of the method of the bot
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+
+def call(method: str, *args, **kwargs) -> Call:
+    return Call(method, args, kwargs)
+
+
+def document(chat_id: int, file: ty.Any, **kwargs) -> Call:
+    """
+    Sends the file as it is, e.g. a .webp picture does not become a sticker.
+    """
+    return call(
+        "send_document", chat_id, file, disable_content_type_detection=True, **kwargs
+    )
+
+
+# Calls and whether the conversation is finished
+Answers = tuple[list[Call], bool]
+
+
+@dataclass(frozen=True)
+class Job:
+    func: ty.Callable
+    args: tuple
+    kwargs: dict  # Options of `JobExecutor.submit` and `JobExecutor.run`
+
+
+def get_owner(message: Message) -> tuple[int, int]:
+    """
+    :returns: Owner of the jobs of the user in the chat.
+    """
+    return message.chat.id, message.from_user.id
+
+
+# Commands
+
+
+def greet(message: Message) -> list[Call]:
+    return [
+        call("send_sticker", message.chat.id, sticker=get_sticker("hello")),
+        call(
+            "send_message",
+            message.chat.id,
+            text="Hi! I'm Ёк макарек)\n"
+            "Here's what I can offer you now:\n/help",
+            reply_markup=keyboards.start_keyboard(),
+        ),
+    ]
+
+
+def show_help(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            text=(
+                "I can hide and find the text in the picture."
+                "Even knowing the encryption algorithm, an outsider cannot"
+                "find out the hidden message, as only you know the key!\n\n"
+                "Available commands:\n"
+                "/help - The withdrawal of this message\n"
+                "/encrypt - encrypt the text in the picture\n"
+                "/decrypt - decrypt the text\n"
+                "/cancel - cancel the current operation\n"
+            ),
+        )
+    ]
+
+
+def cancel(message: Message) -> list[Call]:
+    """
+    Cancels the jobs of the user. The state with the batch being collected
+    is deleted by the handler.
+    """
+    jobs.cancel(get_owner(message))
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            "Operation cancelled",
+            reply_markup=keyboards.commands_keyboard(),
+        )
+    ]
+
+
+def expired(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            "The session expired, start again: /encrypt or /decrypt",
+            reply_markup=keyboards.commands_keyboard(),
+        )
+    ]
+
+
+def busy(message: Message) -> list[Call]:
+    return [call("reply_to", message, "Use /cancel and repeat the attempt")]
+
+
+def still_processing(message: Message) -> list[Call]:
+    return [
+        call(
+            "reply_to",
+            message,
+            "The previous pictures are still being processed, "
+            "repeat the attempt when they are done",
+        )
+    ]
+
+
+# Prompts
+
+
+def ask_text(message: Message) -> list[Call]:
+    if config.images.text_format == HEADER_FORMAT:  # One symbol per pixel
+        note = "use only punctuation marks, numbers, english and russian symbols"
+    else:
+        note = "any language and emoji are supported"
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            f"Enter the text you want to hide.\n_Note:_ {note}",
+            reply_markup=keyboards.cancel_keyboard(),
+            parse_mode="markdown",
+        )
+    ]
+
+
+def ask_encryption_key(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            "Enter the encryption key (word, set of numbers, anything...)",
+        )
+    ]
+
+
+def ask_picture(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            "Send image\n"
+            "_Note:_ If the picture does not have a background, "
+            "it will lose transparency.",
+            parse_mode="markdown",
+        )
+    ]
+
+
+def ask_decryption_key(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_message",
+            message.chat.id,
+            "Enter the encryption key\n",
+            reply_markup=keyboards.cancel_keyboard(),
+        )
+    ]
+
+
+def ask_uncompressed_picture(message: Message) -> list[Call]:
+    return [call("send_message", message.chat.id, "Send image without compression")]
+
+
+# Pictures
+
+
+def get_picture(
+    message: Message, compressed: bool = True
+) -> Document | PhotoSize | None:
+    """
+    :param message: Message.
+    :param compressed: Whether photos compressed by Telegram are accepted.
+    :returns: File of the picture or None if the message has no suitable one.
+    """
+    if message.document:
+        return message.document
+    if compressed and message.photo:
+        return message.photo[-1]
+    return None
+
+
+class NoPicture(RuntimeError):
+    def __init__(self, compressed: bool = True):
+        super().__init__(
+            "It is not a picture" if compressed else "It is not an uncompressed picture"
+        )
+
+
+def no_picture(message: Message, compressed: bool = True) -> list[Call]:
+    return [
+        call(
+            "reply_to",
+            message,
+            f"Send the {'' if compressed else 'uncompressed '}picture.\n"
+            "For canceling the operation use /cancel",
+        )
+    ]
+
+
+def picture_refused(message: Message, err: RuntimeError) -> list[Call]:
+    return [
+        call(
+            "reply_to",
+            message,
+            f"Something went wrong: {str(err)}.\n"
+            "Send another picture or end with a command /cancel",
+        )
+    ]
+
+
+def text_pixels(text: str) -> int:
+    """
+    :returns: Pixels the text takes in the format of new pictures.
+    """
+    return count_text_pixels(
+        text, config.images.text_format, config.images.bits_per_channel
+    )
+
+
+# Jobs
+
+
+def make_encrypt_job(message: Message, image: bytes, text: str, key: str) -> Job:
+    return Job(
+        encrypt_job,
+        (
+            text,
+            key,
+            image,
+            output_policy,
+            config.images.text_format,
+            config.images.bits_per_channel,
+            config.jobs.memory_budget,
+            config.jobs.threads_per_job,
+        ),
+        dict(
+            user=message.from_user.id,
+            cost=estimate_cost(image, len(text)),
+            job_key=get_job_key("encrypt", image, key, text),
+            owner=get_owner(message),
+        ),
+    )
+
+
+def make_decrypt_job(message: Message, image: bytes, key: str) -> Job:
+    return Job(
+        decrypt_job,
+        (
+            key,
+            image,
+            message.document.file_unique_id,
+            config.jobs.memory_budget,
+            config.jobs.threads_per_job,
+        ),
+        dict(
+            user=message.from_user.id,
+            cost=estimate_cost(image),
+            job_key=get_job_key("decrypt", image, key),
+            owner=get_owner(message),
+            affinity=message.document.file_unique_id,
+        ),
+    )
+
+
+def queued(message: Message) -> list[Call]:
+    return [call("reply_to", message, "Added to queue")]
+
+
+def track_progress(message: Message, msg_queue: Message) -> None:
+    """
+    Shows progress of the jobs of the user in the "Added to queue" message.
+    """
+    progress_messages.add(get_owner(message), message.chat.id, msg_queue.message_id)
+
+
+def stop_progress(message: Message, msg_queue: Message) -> list[Call]:
+    progress_messages.remove(get_owner(message))
+    return [call("delete_message", message.chat.id, msg_queue.message_id)]
+
+
+# Results
+
+
+def failed(message: Message, err: RuntimeError) -> list[Call]:
+    return [
+        call("send_sticker", message.chat.id, get_sticker("error")),
+        call(
+            "send_message",
+            message.chat.id,
+            f"Something went wrong: {str(err)}.\n"
+            "Send another picture or end with a command /cancel",
+        ),
+    ]
+
+
+def completed(message: Message) -> list[Call]:
+    return [
+        call(
+            "send_sticker",
+            message.chat.id,
+            get_sticker("complete"),
+            reply_markup=keyboards.commands_keyboard(),
+        )
+    ]
+
+
+def finish(
+    message: Message,
+    msg_queue: Message,
+    answer: ty.Callable[[Message, ty.Any], Answers],
+    result: ty.Any = None,
+    error: RuntimeError | None = None,
+) -> tuple[list[Call], bool | None]:
+    """
+    :param message: Message with the picture.
+    :param msg_queue: The "Added to queue" message.
+    :param answer: Makes answers from the result, may raise RuntimeError.
+    :param result: Result of the job.
+    :param error: Error of the job.
+    :returns: Calls, and whether the conversation is finished: True - the state
+        is to be deleted, False - the user may send another picture,
+        None - the job is cancelled and the state is already deleted by /cancel.
+    """
+    calls = stop_progress(message, msg_queue)
+    try:
+        if error is not None:
+            raise error
+        answers, done = answer(message, result)
+    except Cancelled:
+        return calls, None
+    except RuntimeError as err:
+        return calls + failed(message, err), False
+    if done:
+        answers += completed(message)
+    return calls + answers, done
+
+
+def image_answers(message: Message, crypto_image: EncodedImage) -> Answers:
+    # Save the picture in BytesIO
+    crypto_image_bio = BytesIO(crypto_image.data)
+    crypto_image_bio.name = crypto_image.file_name
+    return [document(message.chat.id, crypto_image_bio)], True
+
+
+def text_answers(message: Message, text: str) -> Answers:
+    if message_length(text) > config.tg_bot.text_document_length:
+        return [document(message.chat.id, text_document(text), caption=TITLE)], True
+    # Decrypted texts are sent as they are, not as HTML of the default parse mode
+    return [
+        call("reply_to", message, part, parse_mode="")
+        for part in pack_messages(text)
+    ], True
+
+
+# Batches
+
+
+def is_processing(data: dict | None) -> bool:
+    """
+    :param data: Data of the state.
+    :returns: Whether pictures are processed: the conversation is not cancelled.
+    """
+    return bool(data and data.get("processing"))
+
+
+def batch_items(messages: list[Message]) -> tuple[list[BatchItem], list[Message], int]:
+    """
+    :param messages: Messages of a batch.
+    :returns: Items of the batch, their messages and the number of skipped ones.
+    """
+    skipped = max(0, len(messages) - config.images.batch_size)
+    messages = messages[: config.images.batch_size]
+    items = [BatchItem(get_file_name(message, i)) for i, message in enumerate(messages)]
+    return items, messages, skipped
+
+
+def _batch_answers(
+    message: Message,
+    items: list[BatchItem],
+    skipped: int,
+    files: list[tuple[str, bytes]],
+    zip_name: str,
+    text: str | None = None,
+) -> Answers:
+    if any(isinstance(item.error, Cancelled) for item in items):
+        raise Cancelled()
+    calls = []
+    if text is not None:
+        calls.append(call("reply_to", message, text, parse_mode=""))
+    elif files:
+        media = pack_files(files, zip_name)
+        if isinstance(media, list):
+            calls.append(call("send_media_group", message.chat.id, media))
+        else:
+            calls.append(document(message.chat.id, media))
+    if errors := format_errors(items, skipped):
+        calls.append(call("send_message", message.chat.id, errors, parse_mode=""))
+    if not files:
+        calls += [
+            call("send_sticker", message.chat.id, get_sticker("error")),
+            call(
+                "send_message",
+                message.chat.id,
+                "Send other pictures or end with a command /cancel",
+            ),
+        ]
+    return calls, bool(files)
+
+
+def batch_image_answers(
+    message: Message, items: list[BatchItem], skipped: int = 0
+) -> Answers:
+    return _batch_answers(
+        message, items, skipped, image_files(items), "crypto_images.zip"
+    )
+
+
+def batch_text_answers(
+    message: Message, items: list[BatchItem], skipped: int = 0
+) -> Answers:
+    files = text_files(items)
+    text = format_texts(items) if files else None
+    return _batch_answers(message, items, skipped, files, "decrypted_texts.zip", text)
@@ -1 +1 @@
-from . import base_commands, encrypt, decrypt
+from . import base_commands, encrypt, decrypt, expired
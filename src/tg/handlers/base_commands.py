@@ -2,9 +2,8 @@ from __future__ import annotations
 
 import typing as ty
 
-from misc.stickers import get_sticker
-from .. import keyboards
-from ..bot import bot
+from .. import flows
+from ..bot import bot, send
 from ..rate_limit import rate_limit
 
 
@@ -23,38 +22,18 @@ def test_handler(message: Message) -> None:
 @bot.message_handler(commands=["start"])
 @rate_limit(2)
 def start_handler(message: Message) -> None:
-    bot.send_sticker(message.chat.id, sticker=get_sticker("hello"))
-    bot.send_message(
-        message.chat.id,
-        text="Hi! I'm Ёк макарек)\nHere's what I can offer you now:\n/help",
-        reply_markup=keyboards.start_keyboard(),
-    )
+    send(flows.greet(message))
 
 
 @bot.message_handler(commands=["help"])
 @rate_limit(2)
 def help_handler(message: Message) -> None:
-    bot.send_message(
-        message.chat.id,
-        text=(
-            "I can hide and find the text in the picture."
-            "Even knowing the encryption algorithm, an outsider cannot"
-            "find out the hidden message, as only you know the key!\n\n"
-            "Available commands:\n"
-            "/help - The withdrawal of this message\n"
-            "/encrypt - encrypt the text in the picture\n"
-            "/decrypt - decrypt the text\n"
-            "/cancel - cancel the current operation\n"
-        ),
-    )
+    send(flows.show_help(message))
 
 
 @bot.message_handler(commands=["cancel"], state="*")
 @rate_limit(2)
 def cancel_handler(message: Message, state: StateContext) -> None:
+    calls = flows.cancel(message)
     state.delete()
-    bot.send_message(
-        message.chat.id,
-        "Operation cancelled",
-        reply_markup=keyboards.commands_keyboard(),
-    )
+    send(calls)
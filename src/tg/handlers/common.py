@@ -0,0 +1,231 @@
+"""
+
+Parts of the handlers of pictures: downloading them, running jobs
+and sending the results (see `tg.flows`).
+
+"""
+
+from __future__ import annotations
+
+import typing as ty
+from functools import partial
+
+from loguru import logger
+
+from misc.cancellation import Cancelled
+from .. import flows
+from ..batches import BatchResults
+from ..bot import bot, dispatcher, send, states_storage
+from ..downloads import download_image
+from ..jobs import batches, jobs, progress_messages
+from ..storages import set_state_data, update_data
+from ..utils import CancelHandler, user_error
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+    from telebot.states import State
+    from telebot.states.sync.context import StateContext
+
+    MakeJob = ty.Callable[[Message, bytes], flows.Job]
+    Answer = ty.Callable[[Message, ty.Any], flows.Answers]
+
+
+def get_image(message: Message, text_length: int = 0, compressed: bool = True) -> bytes:
+    if (file := flows.get_picture(message, compressed)) is None:
+        send(flows.no_picture(message, compressed))
+        raise CancelHandler()
+    try:
+        return download_image(bot, file, text_length)
+    except RuntimeError as err:
+        send(flows.picture_refused(message, err))
+        raise CancelHandler()
+
+
+def advance(message: Message, state: State, **data) -> None:
+    """
+    Moves the conversation to the state and adds the data in one write.
+    """
+    set_state_data(states_storage, message, bot.bot_id, state, **data)
+
+
+def start_processing(message: Message, state: StateContext) -> dict | None:
+    """
+    Marks that a picture of the conversation is processed.
+    :param message: Message with the picture, the user is told if it is refused.
+    :returns: Data of the state or None if a picture is processed already.
+    """
+    with state.data() as data:
+        processing = data.get("processing")
+        data["processing"] = True
+        data = dict(data)
+    if processing:
+        send(flows.still_processing(message))
+        return None
+    return data
+
+
+def collect(
+    message: Message,
+    state: StateContext,
+    process: ty.Callable[[StateContext, list[Message]], ty.Any],
+) -> bool:
+    """
+    Adds the message to a batch if it is a part of an album
+    or pictures of the user are being collected (see `tg.batches`).
+    The batch is processed in turn with the updates of the chat.
+    :param process: Processes the batch.
+    :returns: Whether the message is added.
+    """
+    add = partial(batches.add, message)
+    if not update_data(states_storage, message, bot.bot_id, add):
+        return False
+    dispatcher.call_later(
+        message.chat.id, batches.delay, partial(complete, message, state, process)
+    )
+    return True
+
+
+def complete(
+    message: Message,
+    state: StateContext,
+    process: ty.Callable[[StateContext, list[Message]], ty.Any],
+) -> None:
+    """
+    Processes the batch if no pictures were added since the message.
+    """
+    if messages := update_data(states_storage, message, bot.bot_id, batches.take):
+        process(state, messages)
+
+
+def is_processing(message: Message) -> bool:
+    """
+    :returns: Whether the pictures of the conversation are still processed,
+        it is checked again before long steps, as /cancel may come meanwhile.
+    """
+    return update_data(states_storage, message, bot.bot_id, flows.is_processing)
+
+
+def fail(message: Message, state: StateContext, err: Exception) -> None:
+    """
+    Reports an unexpected error of processing and lets the user send
+    another picture.
+    """
+    logger.opt(exception=err).error("processing failed")
+    try:
+        send(flows.failed(message, RuntimeError("Internal error")))
+    finally:
+        with state.data() as data:
+            data["processing"] = False
+
+
+def queue(message: Message) -> Message:
+    """
+    :returns: The "Added to queue" message showing progress.
+    """
+    msg_queue = send(flows.queued(message))[0]
+    flows.track_progress(message, msg_queue)
+    progress_messages.start(bot.edit_message_text)
+    return msg_queue
+
+
+def deliver(
+    message: Message,
+    state: StateContext,
+    msg_queue: Message,
+    answer: Answer,
+    result: ty.Any = None,
+    error: RuntimeError | None = None,
+) -> None:
+    """
+    Sends the result of a job (see `flows.finish`).
+    """
+    calls, done = flows.finish(message, msg_queue, answer, result, error)
+    try:
+        send(calls)
+    except Exception as err:
+        if done is None:
+            return logger.opt(exception=err).error("processing failed")
+        return fail(message, state, err)
+    if done:
+        state.delete()
+    elif done is False:
+        with state.data() as data:
+            data["processing"] = False
+
+
+def run_job(
+    message: Message,
+    state: StateContext,
+    image: bytes,
+    make_job: MakeJob,
+    answer: Answer,
+) -> None:
+    try:
+        msg_queue = queue(message)
+    except Exception as err:
+        return fail(message, state, err)
+    try:
+        job = make_job(message, image)
+        jobs.submit(
+            job.func,
+            *job.args,
+            **job.kwargs,
+            on_done=partial(deliver, message, state, msg_queue, answer),
+            on_error=lambda err: deliver(message, state, msg_queue, answer, error=err),
+        )
+    except Exception as err:
+        deliver(message, state, msg_queue, answer, error=user_error(err))
+
+
+def run_batch(
+    state: StateContext,
+    messages: list[Message],
+    make_job: MakeJob,
+    answer: Answer,
+    text_length: int = 0,
+    compressed: bool = True,
+) -> None:
+    """
+    Processes pictures of a batch in parallel and sends the results at once.
+    Pictures are downloaded one after another.
+    """
+    message = messages[0]
+    items, messages, skipped = flows.batch_items(messages)
+    images = []
+    for item, item_message in zip(items, messages):
+        try:
+            if (file := flows.get_picture(item_message, compressed)) is None:
+                raise flows.NoPicture(compressed)
+            images.append(download_image(bot, file, text_length))
+        except Exception as err:
+            item.error = user_error(err, "The picture was not downloaded")
+            images.append(None)
+    if not is_processing(message):
+        return  # Cancelled
+    try:
+        msg_queue = queue(message)
+    except Exception as err:
+        return fail(message, state, err)
+
+    results = BatchResults(
+        items,
+        partial(deliver, message, state, msg_queue, partial(answer, skipped=skipped)),
+    )
+    for index, (item_message, image) in enumerate(zip(messages, images)):
+        if image is None:
+            continue
+        if not is_processing(message):
+            results.set_error(index, Cancelled())
+            continue
+        try:
+            job = make_job(item_message, image)
+            jobs.submit(
+                job.func,
+                *job.args,
+                **job.kwargs,
+                on_done=partial(results.set_result, index),
+                on_error=partial(results.set_error, index),
+            )
+        except Exception as err:
+            results.set_error(index, user_error(err))
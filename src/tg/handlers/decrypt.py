@@ -1,17 +1,22 @@
 from __future__ import annotations
 
 import typing as ty
-from io import BytesIO
+from functools import partial
 
 from loguru import logger
 
-from misc.crypto_img import decrypt
-from misc.stickers import get_sticker
-from .. import keyboards
-from ..bot import bot
+from .. import flows
+from ..bot import bot, send
 from ..rate_limit import rate_limit
 from ..states import Decrypt
-from ..utils import CancelHandler
+from .common import (
+    advance,
+    collect,
+    get_image,
+    run_batch,
+    run_job,
+    start_processing,
+)
 
 
 if ty.TYPE_CHECKING:
@@ -23,93 +28,45 @@ if ty.TYPE_CHECKING:
 @rate_limit(5)
 def encrypt_start_handler(message: Message, state: StateContext):
     if state.get() is not None:
-        return bot.reply_to(message, "Use /cancel and repeat the attempt")
+        return send(flows.busy(message))
 
-    bot.send_message(
-        message.chat.id,
-        "Enter the encryption key\n",
-        reply_markup=keyboards.cancel_keyboard(),
-    )
+    send(flows.ask_decryption_key(message))
     state.set(Decrypt.waiting_for_key)
 
 
 @bot.message_handler(state=Decrypt.waiting_for_key)
 def get_key(message: Message, state: StateContext):
-    state.add_data(key=message.text)
-    state.set(Decrypt.waiting_for_img)
-    bot.send_message(message.chat.id, "Send image without compression")
-
-
-def get_image(message: Message) -> BytesIO:
-    try:
-        if message.document:
-            file = bot.get_file(message.document.file_id)
-            return BytesIO(bot.download_file(file.file_path))
-        raise RuntimeError
-    except (AttributeError, RuntimeError):
-        bot.reply_to(
-            message,
-            "Send the uncompressed picture.\n"
-            "For canceling the operation use /cancel",
-        )
-        raise CancelHandler()
+    advance(message, Decrypt.waiting_for_img, key=message.text)
+    send(flows.ask_uncompressed_picture(message))
 
 
-def decrypt_image(message: Message, state: StateContext, image: BytesIO) -> str:
-    with state.data() as data:
-        key = data["key"]
-
-    logger.trace(f"start decrypt {message.message_id}")
-    text = decrypt(key, image)
-    logger.trace(f"finish decrypt {message.message_id}")
-
-    return text
+def decrypt_batch(state: StateContext, messages: list[Message]) -> None:
+    if (data := start_processing(messages[0], state)) is None:
+        return
+    logger.trace(f"start decrypt batch {messages[0].message_id}")
+    run_batch(
+        state,
+        messages,
+        partial(flows.make_decrypt_job, key=data["key"]),
+        flows.batch_text_answers,
+        compressed=False,
+    )
 
 
 @bot.message_handler(
     state=Decrypt.waiting_for_img, content_types=["text", "photo", "document"]
 )
 def encrypt_finish(message: Message, state: StateContext):
-    image = get_image(message)
-    with state.data() as data:
-        if data.get("processing"):
-            return
-        data["processing"] = True
-    msg_queue = bot.reply_to(message, "Added to queue")
-
-    try:
-        text = decrypt_image(message, state, image)
-    except RuntimeError as err:
-        bot.delete_message(message.chat.id, msg_queue.message_id)
-        bot.send_sticker(message.chat.id, get_sticker("error"))
-        bot.send_message(
-            message.chat.id,
-            f"Something went wrong: {str(err)}.\n"
-            "Send another picture or end with a command /cancel",
-        )
-        with state.data() as data:
-            data["processing"] = False
+    if collect(message, state, decrypt_batch):
         return
-
-    if len(text) + 29 > 4096:
-        if len(text) > 4096:
-            messages = []
-            while len(text) > 4096:
-                messages.append(text[:4096])
-                text = text[4096:]
-            bot.reply_to(message, "This is what I decrypted:")
-            for part in messages:
-                bot.reply_to(message, part)
-        else:
-            bot.reply_to(message, "This is what I decrypted:")
-            bot.reply_to(message, text)
-    else:
-        bot.reply_to(message, f"This is what I decrypted:\n{text}")
-    bot.delete_message(message.chat.id, msg_queue.message_id)
-
-    state.delete()
-    bot.send_sticker(
-        message.chat.id,
-        get_sticker("complete"),
-        reply_markup=keyboards.commands_keyboard(),
+    image = get_image(message, compressed=False)
+    if (data := start_processing(message, state)) is None:
+        return
+    logger.trace(f"start decrypt {message.message_id}")
+    run_job(
+        message,
+        state,
+        image,
+        partial(flows.make_decrypt_job, key=data["key"]),
+        flows.text_answers,
     )
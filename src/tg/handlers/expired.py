@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import typing as ty
+
+from telebot import util
+
+from .. import flows
+from ..bot import bot, send, states_storage
+from ..storages import pop_expired
+
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+
+
+def is_expired(message: Message) -> bool:
+    return pop_expired(states_storage, message, bot.bot_id)
+
+
+@bot.message_handler(func=is_expired, content_types=util.content_type_media)
+def expired_handler(message: Message) -> None:
+    send(flows.expired(message))
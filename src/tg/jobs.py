@@ -0,0 +1,35 @@
+import multiprocessing
+
+from app import config
+from misc.jobs import JobExecutor
+from misc.output import OutputPolicy
+from .batches import PictureBatches
+from .progress import ProgressMessages
+
+
+# Workers only need the crypto functions, so they are forked
+# instead of importing the whole application again, before threads
+# of the bot exist.
+jobs = JobExecutor(
+    config.jobs.workers,
+    config.jobs.max_jobs,
+    config.jobs.timeout,
+    config.jobs.user_budget,
+    config.jobs.pixels_cache_size,
+    mp_context=(
+        multiprocessing.get_context("fork")
+        if "fork" in multiprocessing.get_all_start_methods()
+        else None
+    ),
+)
+jobs.start()
+output_policy = OutputPolicy(
+    config.images.output_format,
+    config.images.png_compress_level,
+    config.images.webp_method,
+    config.images.large_pixels,
+)
+progress_messages = ProgressMessages(
+    jobs, config.tg_bot.progress_interval, config.tg_bot.progress_max_edits
+)
+batches = PictureBatches(config.tg_bot.batch_delay)
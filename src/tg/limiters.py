@@ -0,0 +1,127 @@
+"""
+
+Storages of rate limits shared by all handlers.
+A limit allows one call per `limit` seconds for a key,
+every check is O(1) and entries are removed as soon as they expire.
+
+"""
+
+from __future__ import annotations
+
+import abc
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter(abc.ABC):
+    @abc.abstractmethod
+    def hit(self, key: str, limit: float) -> tuple[float, bool]:
+        """
+        Registers a call if it is allowed.
+        :param key: Key of the limit (handler and chat).
+        :param limit: Seconds between calls.
+        :returns: Seconds to wait (0 if the call is allowed) and
+            whether the caller was already told to wait.
+        """
+
+    def sweep(self) -> None:
+        """
+        Removes expired entries.
+        """
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Limits of one process.
+    Entries are kept in the order of the last call, so expired ones are
+    removed from the beginning while checking. Oldest entries are dropped
+    if there are more than `max_entries` (it only loosens their limits).
+    """
+
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: Max number of entries.
+        """
+        self.max_entries = max_entries
+        # {<key>: (<time when a call is allowed>, <told to wait>)}
+        self._entries: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: float) -> tuple[float, bool]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now, 2)
+            allowed_at, warned = self._entries.get(key, (0, False))
+            if now < allowed_at:
+                self._entries[key] = (allowed_at, True)
+                return allowed_at - now, warned
+            self._entries[key] = (now + limit, False)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return 0, False
+
+    def sweep(self) -> None:
+        with self._lock:
+            self._sweep(time.monotonic())
+
+    def _sweep(self, now: float, count: int | float = math.inf) -> None:
+        # Entries with different limits are not sorted by expiration,
+        # so an expired entry may wait until the entries before it expire.
+        while count and self._entries:
+            key, (allowed_at, _) = next(iter(self._entries.items()))
+            if allowed_at > now:
+                break
+            del self._entries[key]
+            count -= 1
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Limits in Redis, shared by all processes.
+    Every entry is a key with a TTL, so Redis removes it on expiration.
+    Requires the `redis` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "rate_limit"):
+        """
+        :param url: Server url.
+        :param prefix: Prefix of keys.
+        """
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def hit(self, key: str, limit: float) -> tuple[float, bool]:
+        key = f"{self.prefix}:{key}"
+        ttl = max(1, int(limit * 1000))
+        while True:
+            if self.redis.set(key, 0, px=ttl, nx=True):
+                return 0, False
+            with self.redis.pipeline() as pipe:
+                pipe.pttl(key)
+                pipe.set(key, 1, xx=True, keepttl=True, get=True)
+                left, warned = pipe.execute()
+            if left == -1:  # The key has no TTL, it is given the full window
+                self.redis.pexpire(key, ttl)
+                return ttl / 1000, warned == b"1"
+            if left > 0:
+                return left / 1000, warned == b"1"
+            # The key expired after it was checked, it is set again
+
+
+def create_rate_limiter(kind: str, url: str, max_entries: int) -> RateLimiter:
+    """
+    :param kind: memory | redis.
+    :param url: Server url for redis.
+    :param max_entries: Max number of entries (memory only).
+    :returns: Storage of rate limits.
+    """
+    if kind == "memory":
+        return MemoryRateLimiter(max_entries)
+    if kind == "redis":
+        return RedisRateLimiter(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown rate limiter: {kind}")
@@ -0,0 +1,142 @@
+"""
+
+Progress of jobs in the "Added to queue" messages.
+Messages are edited by one background worker, each not more often than
+every `interval` seconds and not more than `max_edits` in total per second,
+so the bot stays within the limits of Telegram.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+import typing as ty
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from loguru import logger
+
+if ty.TYPE_CHECKING:
+    from misc.jobs import JobExecutor
+
+
+def format_progress(waiting: int, done: float | None) -> str:
+    """
+    :param waiting: Number of jobs waiting before the job.
+    :param done: Done part of the job, None if it is not known.
+    :returns: Text of the message.
+    """
+    if waiting:
+        return f"Added to queue\nJobs ahead: {waiting}"
+    if done is None:
+        return "Processing..."
+    return f"Processing... {int(done * 100)}%"
+
+
+@dataclass
+class ProgressMessage:
+    chat_id: int
+    message_id: int
+    text: str = ""
+    edited_at: float = 0
+
+
+class ProgressMessages:
+    def __init__(self, jobs: JobExecutor, interval: float, max_edits: int):
+        """
+        :param jobs: Executor of jobs.
+        :param interval: Min seconds between edits of a message.
+        :param max_edits: Max edits of all messages per second.
+        """
+        self.jobs = jobs
+        self.interval = interval
+        self.max_edits = max_edits
+        self._lock = threading.Lock()
+        # {<owner of the job>: <message>}, least recently edited first
+        self._messages: OrderedDict[ty.Hashable, ProgressMessage] = OrderedDict()
+        self._worker: threading.Thread | asyncio.Task | None = None
+
+    def add(self, owner: ty.Hashable, chat_id: int, message_id: int) -> None:
+        """
+        :param owner: Owner of the job (see `JobExecutor.submit`).
+        :param chat_id: Chat of the message.
+        :param message_id: Message.
+        """
+        with self._lock:
+            self._messages[owner] = ProgressMessage(
+                chat_id, message_id, edited_at=time.monotonic()
+            )
+
+    def remove(self, owner: ty.Hashable) -> None:
+        """
+        Stops editing the message, must be called before it is deleted.
+        :param owner: Owner of the job.
+        """
+        with self._lock:
+            self._messages.pop(owner, None)
+
+    def due(self) -> list[tuple[int, int, str]]:
+        """
+        :returns: Chats, ids and new texts of messages to edit now.
+        """
+        now = time.monotonic()
+        edits = []
+        with self._lock:
+            for owner, message in list(self._messages.items()):
+                if len(edits) >= self.max_edits:
+                    break
+                if now - message.edited_at < self.interval:
+                    continue
+                if (progress := self.jobs.get_progress(owner)) is None:
+                    continue
+                if (text := format_progress(*progress)) == message.text:
+                    continue
+                message.text, message.edited_at = text, now
+                self._messages.move_to_end(owner)
+                edits.append((message.chat_id, message.message_id, text))
+        return edits
+
+    def start(self, edit: ty.Callable[..., ty.Any]) -> None:
+        """
+        Starts a thread editing messages, if it is not started.
+        :param edit: `TeleBot.edit_message_text`.
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._edit_forever,
+                    args=(edit,),
+                    name="ProgressEditor",
+                    daemon=True,
+                )
+                self._worker.start()
+
+    def start_task(self, edit: ty.Callable[..., ty.Awaitable]) -> None:
+        """
+        Starts a task editing messages, if it is not started.
+        Must be called in the event loop.
+        :param edit: `AsyncTeleBot.edit_message_text`.
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = asyncio.create_task(self._edit_forever_async(edit))
+
+    def _edit_forever(self, edit: ty.Callable[..., ty.Any]) -> None:
+        while True:
+            time.sleep(1)
+            for chat_id, message_id, text in self.due():
+                try:
+                    edit(text, chat_id, message_id)
+                except Exception as err:  # The message may be deleted already
+                    logger.debug(f"progress was not shown: {err}")
+
+    async def _edit_forever_async(self, edit: ty.Callable[..., ty.Awaitable]) -> None:
+        while True:
+            await asyncio.sleep(1)
+            for chat_id, message_id, text in self.due():
+                try:
+                    await edit(text, chat_id, message_id)
+                except Exception as err:  # The message may be deleted already
+                    logger.debug(f"progress was not shown: {err}")
@@ -1,16 +1,25 @@
 from __future__ import annotations
 
-import time
 import typing as ty
 from functools import wraps
 
+from app import config
 from .bot import bot
+from .limiters import create_rate_limiter
 
 
 if ty.TYPE_CHECKING:
     from telebot.types import Message
 
 
+# One storage for all handlers
+limiter = create_rate_limiter(
+    config.tg_bot.rate_limit_storage,
+    config.tg_bot.rate_limit_url,
+    config.tg_bot.rate_limit_max_entries,
+)
+
+
 def rate_limit(limit: int):
     """
     Decorator for command handlers.
@@ -19,23 +28,22 @@ def rate_limit(limit: int):
     """
 
     def _decorator(func):
-        # {<sender_id>: (<last_call_time>, <exceeded_count>)}
-        last_calls: dict[int, tuple[int, int]] = {}
+        # The same in both runtimes, so workers of any kind share limits
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
 
         @wraps(func)
         def _wrapper(message: Message, *args, **kwargs):
-            last_call, exceeded_count = last_calls.get(message.chat.id, (0, 0))
-            if (delta := (time.time() - last_call)) < limit:
-                last_calls[message.chat.id] = (last_call, exceeded_count + 1)
-                if exceeded_count == 0:
+            key = f"{name}:{message.chat.id}"
+            delay, warned = limiter.hit(key, limit)
+            if delay:
+                if not warned:
                     return bot.reply_to(
                         message,
                         "The team is temporarily locked, "
-                        f"try after {round(limit - delta, 2)} seconds",
+                        f"try after {round(delay, 2)} seconds",
                     )
                 return
             func(message, *args, **kwargs)
-            last_calls[message.chat.id] = (int(time.time()), 0)
 
         return _wrapper
 
@@ -1,8 +1,4 @@
 from telebot.states import State, StatesGroup
-from telebot.storage import StateMemoryStorage
-
-
-states_storage = StateMemoryStorage()
 
 
 class Encrypt(StatesGroup):
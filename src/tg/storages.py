@@ -0,0 +1,702 @@
+"""
+
+Storages of conversation states shared between processes.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import sqlite3
+import threading
+import time
+import typing as ty
+from collections import OrderedDict
+
+from telebot import asyncio_storage
+from telebot.states import resolve_context
+from telebot.storage import (
+    StateDataContext,
+    StateMemoryStorage,
+    StateRedisStorage,
+    StateStorageBase,
+)
+
+if ty.TYPE_CHECKING:
+    from telebot.types import Message
+
+
+class StateSQLiteStorage(StateStorageBase):
+    """
+    States in a SQLite database in WAL mode.
+    Several processes may use one file: readers do not block the writer.
+    Each thread reuses its own connection, every operation is a single
+    statement or one transaction, e.g. a state is set with its data at once
+    (see `set_state_data`).
+    States not changed for `ttl` seconds are expired: they are not read,
+    and the user can be told that the session expired (see `pop_expired`).
+    Rows expired more than `ttl` seconds ago are deleted by writers
+    once in `sweep_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 0,
+        prefix: str = "telebot",
+        separator: str = ":",
+        sweep_interval: float = 60,
+    ):
+        """
+        :param path: Path to the database file.
+        :param ttl: Seconds a state lives without changes. 0 - forever.
+        :param prefix: Prefix of keys.
+        :param separator: Separator of parts of keys.
+        :param sweep_interval: Seconds between deletions of expired rows.
+        """
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.prefix = prefix
+        self.separator = separator
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+        self._local = threading.local()
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS states (key TEXT PRIMARY KEY, state TEXT, "
+            "data TEXT NOT NULL DEFAULT '{}', touched REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._execute("PRAGMA table_info(states)")]
+        if "touched" not in columns:  # Created by an earlier version
+            try:
+                self._execute(
+                    "ALTER TABLE states ADD COLUMN touched REAL NOT NULL DEFAULT 0"
+                )
+                self._execute("UPDATE states SET touched = ?", time.time())
+            except sqlite3.OperationalError:
+                pass  # Added by another process
+        self._execute("CREATE INDEX IF NOT EXISTS states_touched ON states (touched)")
+
+    def _connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _execute(self, sql: str, *params) -> sqlite3.Cursor:
+        return self._connection().execute(sql, params)
+
+    def _alive_since(self) -> float:
+        """
+        :returns: Time of the oldest change of a state which is not expired.
+        """
+        return time.time() - self.ttl if self.ttl else 0
+
+    def _write(self, sql: str, *params) -> sqlite3.Cursor:
+        """
+        Executes a statement changing states, expired rows are deleted
+        from time to time.
+        """
+        if self.ttl and time.monotonic() - self._swept_at > self.sweep_interval:
+            self._swept_at = time.monotonic()
+            self.sweep()
+        return self._execute(sql, *params)
+
+    def sweep(self) -> None:
+        """
+        Deletes rows expired more than `ttl` seconds ago, their users
+        are not told that the session expired.
+        """
+        self._execute(
+            "DELETE FROM states WHERE touched < ?", self._alive_since() - self.ttl
+        )
+
+    def _key(
+        self,
+        chat_id: int,
+        user_id: int,
+        business_connection_id: str | None = None,
+        message_thread_id: int | None = None,
+        bot_id: int | None = None,
+    ) -> str:
+        return self._get_key(
+            chat_id,
+            user_id,
+            self.prefix,
+            self.separator,
+            business_connection_id,
+            message_thread_id,
+            bot_id,
+        )
+
+    def set_state(self, chat_id, user_id, state, *args, **kwargs) -> bool:
+        return self.set_state_data(chat_id, user_id, state, {}, *args, **kwargs)
+
+    def set_state_data(
+        self, chat_id, user_id, state, data: dict, *args, **kwargs
+    ) -> bool:
+        """
+        Sets the state and adds the data in one statement.
+        An expired state is replaced with a new one.
+        """
+        if hasattr(state, "name"):
+            state = state.name
+        # json_set(<data>, <path>, json(<value>), ...)
+        paths = []
+        for key, value in data.items():
+            paths += [f'$."{key}"', json.dumps(value)]
+        set_paths = ", ?, json(?)" * len(data)
+        now = time.time()
+        self._write(
+            "INSERT INTO states (key, state, data, touched) "
+            f"VALUES (?, ?, json_set('{{}}'{set_paths}), ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, "
+            "data = json_set(CASE WHEN touched < ? THEN '{}' ELSE data END"
+            f"{set_paths}), touched = excluded.touched",
+            self._key(chat_id, user_id, *args, **kwargs),
+            state,
+            *paths,
+            now,
+            self._alive_since(),
+            *paths,
+        )
+        return True
+
+    def get_state(self, chat_id, user_id, *args, **kwargs) -> str | None:
+        row = self._execute(
+            "SELECT state FROM states WHERE key = ? AND touched >= ?",
+            self._key(chat_id, user_id, *args, **kwargs),
+            self._alive_since(),
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete_state(self, chat_id, user_id, *args, **kwargs) -> bool:
+        return (
+            self._write(
+                "DELETE FROM states WHERE key = ?",
+                self._key(chat_id, user_id, *args, **kwargs),
+            ).rowcount
+            > 0
+        )
+
+    def pop_expired(self, chat_id, user_id, *args, **kwargs) -> bool:
+        """
+        :returns: Whether the state was expired. Deletes it.
+        """
+        if not self.ttl:
+            return False
+        return (
+            self._execute(
+                "DELETE FROM states WHERE key = ? AND touched < ?",
+                self._key(chat_id, user_id, *args, **kwargs),
+                self._alive_since(),
+            ).rowcount
+            > 0
+        )
+
+    def set_data(self, chat_id, user_id, key, value, *args, **kwargs) -> bool:
+        _key = self._key(chat_id, user_id, *args, **kwargs)
+        if not self._write(
+            "UPDATE states SET data = json_set(data, ?, json(?)), touched = ? "
+            "WHERE key = ? AND touched >= ?",
+            f'$."{key}"',
+            json.dumps(value),
+            time.time(),
+            _key,
+            self._alive_since(),
+        ).rowcount:
+            raise RuntimeError(f"StateSQLiteStorage: key {_key} does not exist.")
+        return True
+
+    def get_data(self, chat_id, user_id, *args, **kwargs) -> dict:
+        row = self._execute(
+            "SELECT data FROM states WHERE key = ? AND touched >= ?",
+            self._key(chat_id, user_id, *args, **kwargs),
+            self._alive_since(),
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def reset_data(self, chat_id, user_id, *args, **kwargs) -> bool:
+        return self.save(chat_id, user_id, {}, *args, **kwargs)
+
+    def get_interactive_data(self, chat_id, user_id, *args, **kwargs):
+        return StateDataContext(self, chat_id, user_id, *args, **kwargs)
+
+    def save(self, chat_id, user_id, data, *args, **kwargs) -> bool:
+        return (
+            self._write(
+                "UPDATE states SET data = ?, touched = ? "
+                "WHERE key = ? AND touched >= ?",
+                json.dumps(data),
+                time.time(),
+                self._key(chat_id, user_id, *args, **kwargs),
+                self._alive_since(),
+            ).rowcount
+            > 0
+        )
+
+    def update_data(self, chat_id, user_id, func, *args, **kwargs) -> ty.Any:
+        """
+        Changes the data in a write transaction (see `update_data`).
+        """
+        key = self._key(chat_id, user_id, *args, **kwargs)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM states WHERE key = ? AND touched >= ?",
+                (key, self._alive_since()),
+            ).fetchone()
+            result, data = _apply_update(func, row and row[0])
+            if data is not None:
+                connection.execute(
+                    "UPDATE states SET data = ?, touched = ? WHERE key = ?",
+                    (data, time.time(), key),
+                )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+
+class ExpiringStateMemoryStorage(StateMemoryStorage):
+    """
+    States in memory with limits.
+    States not touched for `ttl` seconds are removed (lazily and by a background
+    sweeper), the least recently used states are removed while there are
+    more than `max_entries` states or they take more than `max_bytes`.
+    Keys of removed states are remembered, so the user can be told
+    that the session expired.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        sweep_interval: float = 60,
+    ):
+        """
+        :param ttl: Seconds a state lives without being touched.
+        :param max_entries: Max number of states.
+        :param max_bytes: Max approximate size of states (in JSON).
+        :param sweep_interval: Seconds between sweeps of expired states.
+        """
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.data: OrderedDict[str, dict] = OrderedDict()  # Least recently used first
+        # {<key>: (<last touch time>, <size>)}
+        self._meta: dict[str, tuple[float, int]] = {}
+        self._bytes = 0
+        self._expired: OrderedDict[str, None] = OrderedDict()  # Keys of removed states
+        self._lock = threading.RLock()
+        self._sweeper: threading.Thread | None = None
+
+    def _key(self, chat_id, user_id, business_connection_id=None,
+             message_thread_id=None, bot_id=None) -> str:  # fmt: skip
+        return self._get_key(
+            chat_id,
+            user_id,
+            self.prefix,
+            self.separator,
+            business_connection_id,
+            message_thread_id,
+            bot_id,
+        )
+
+    def _touch(self, key: str, resize: bool = False) -> None:
+        if key not in self.data:
+            return
+        self.data.move_to_end(key)
+        touched, size = self._meta.get(key, (0, 0))
+        if resize:
+            self._bytes -= size
+            size = len(json.dumps(self.data[key], default=str))
+            self._bytes += size
+        self._meta[key] = (time.monotonic(), size)
+        if resize:
+            while self.data and (
+                len(self.data) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self.data)))
+
+    def _remove(self, key: str, expired: bool = True) -> None:
+        del self.data[key]
+        self._bytes -= self._meta.pop(key, (0, 0))[1]
+        if expired:
+            self._expired[key] = None
+            while len(self._expired) > self.max_entries:
+                self._expired.popitem(last=False)
+
+    def _is_expired(self, key: str) -> bool:
+        return (
+            key in self._meta and time.monotonic() - self._meta[key][0] > self.ttl
+        )
+
+    def _check(self, key: str) -> None:
+        if self._is_expired(key):
+            self._remove(key)
+        else:
+            self._touch(key)
+
+    def sweep(self) -> None:
+        """
+        Removes expired states.
+        """
+        with self._lock:
+            while self.data and self._is_expired(key := next(iter(self.data))):
+                self._remove(key)
+
+    def _sweep_forever(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def pop_expired(self, chat_id, user_id, *args, **kwargs) -> bool:
+        """
+        :returns: Whether the state was removed because of limits.
+            Forgets about it.
+        """
+        with self._lock:
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(key)
+            return self._expired.pop(key, 0) is None
+
+    def set_state(self, chat_id, user_id, state, *args, **kwargs) -> bool:
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweep_forever, name="StatesSweeper", daemon=True
+                )
+                self._sweeper.start()
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(key)
+            self._expired.pop(key, None)
+            result = super().set_state(chat_id, user_id, state, *args, **kwargs)
+            self._touch(key, resize=True)
+            return result
+
+    def set_state_data(
+        self, chat_id, user_id, state, data: dict, *args, **kwargs
+    ) -> bool:
+        """
+        Sets the state and adds the data at once.
+        """
+        with self._lock:
+            self.set_state(chat_id, user_id, state, *args, **kwargs)
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self.data[key]["data"].update(data)
+            self._touch(key, resize=True)
+            return True
+
+    def get_state(self, chat_id, user_id, *args, **kwargs) -> str | None:
+        with self._lock:
+            self._check(self._key(chat_id, user_id, *args, **kwargs))
+            return super().get_state(chat_id, user_id, *args, **kwargs)
+
+    def delete_state(self, chat_id, user_id, *args, **kwargs) -> bool:
+        with self._lock:
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            if key not in self.data:
+                return False
+            self._remove(key, expired=False)
+            return True
+
+    def set_data(self, chat_id, user_id, key, value, *args, **kwargs) -> bool:
+        with self._lock:
+            _key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(_key)
+            result = super().set_data(chat_id, user_id, key, value, *args, **kwargs)
+            self._touch(_key, resize=True)
+            return result
+
+    def get_data(self, chat_id, user_id, *args, **kwargs) -> dict:
+        with self._lock:
+            self._check(self._key(chat_id, user_id, *args, **kwargs))
+            return super().get_data(chat_id, user_id, *args, **kwargs)
+
+    def reset_data(self, chat_id, user_id, *args, **kwargs) -> bool:
+        with self._lock:
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(key)
+            result = super().reset_data(chat_id, user_id, *args, **kwargs)
+            self._touch(key, resize=True)
+            return result
+
+    def save(self, chat_id, user_id, data, *args, **kwargs) -> bool:
+        with self._lock:
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(key)
+            result = super().save(chat_id, user_id, data, *args, **kwargs)
+            self._touch(key, resize=True)
+            return result
+
+    def update_data(self, chat_id, user_id, func, *args, **kwargs) -> ty.Any:
+        """
+        Changes the data under the lock (see `update_data`).
+        """
+        with self._lock:
+            key = self._key(chat_id, user_id, *args, **kwargs)
+            self._check(key)
+            if key not in self.data:
+                return func(None)
+            data = copy.deepcopy(self.data[key]["data"])
+            result = func(data)
+            if data != self.data[key]["data"]:
+                self.data[key]["data"] = data
+                self._touch(key, resize=True)
+            return result
+
+
+class AtomicStateRedisStorage(StateRedisStorage):
+    """
+    The Redis storage of pyTelegramBotAPI with atomic changes of data.
+    """
+
+    def set_state_data(
+        self, chat_id, user_id, state, data: dict, *args, **kwargs
+    ) -> bool:
+        """
+        Sets the state and adds the data in one transaction.
+        """
+        if hasattr(state, "name"):
+            state = state.name
+        key = self._get_key(chat_id, user_id, self.prefix, self.separator, *args)
+
+        def update(pipe) -> None:
+            mapping = _merge_data(pipe.hget(key, "data"), data, state)
+            pipe.multi()
+            pipe.hset(key, mapping=mapping)
+
+        self.redis.transaction(update, key)
+        return True
+
+    def update_data(self, chat_id, user_id, func, *args, **kwargs) -> ty.Any:
+        """
+        Changes the data in a transaction watching the state (see `update_data`).
+        """
+        key = self._get_key(chat_id, user_id, self.prefix, self.separator, *args)
+
+        def update(pipe) -> ty.Any:
+            result, data = _apply_update(func, pipe.hget(key, "data"))
+            if data is not None:
+                pipe.multi()
+                pipe.hset(key, "data", data)
+            return result
+
+        return self.redis.transaction(update, key, value_from_callable=True)
+
+
+class AsyncStateStorage(asyncio_storage.StateStorageBase):
+    """
+    Async adapter for a sync storage.
+    Operations run in threads, so the event loop is not blocked.
+    """
+
+    def __init__(self, storage: StateStorageBase, in_thread: bool = True):
+        """
+        :param storage: Sync storage.
+        :param in_thread: Run operations in threads. Not needed for memory storages.
+        """
+        super().__init__()
+        self.storage = storage
+        self.in_thread = in_thread
+
+    async def _call(self, method: ty.Callable, *args, **kwargs) -> ty.Any:
+        if self.in_thread:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def set_state(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.set_state, *args, **kwargs)
+
+    async def get_state(self, *args, **kwargs) -> str | None:
+        return await self._call(self.storage.get_state, *args, **kwargs)
+
+    async def delete_state(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.delete_state, *args, **kwargs)
+
+    async def set_data(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.set_data, *args, **kwargs)
+
+    async def get_data(self, *args, **kwargs) -> dict:
+        return await self._call(self.storage.get_data, *args, **kwargs)
+
+    async def reset_data(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.reset_data, *args, **kwargs)
+
+    def get_interactive_data(self, chat_id, user_id, *args, **kwargs):
+        return asyncio_storage.StateDataContext(self, chat_id, user_id, *args, **kwargs)
+
+    async def save(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.save, *args, **kwargs)
+
+    async def set_state_data(self, *args, **kwargs) -> bool:
+        return await self._call(self.storage.set_state_data, *args, **kwargs)
+
+    async def update_data(self, *args, **kwargs) -> ty.Any:
+        return await self._call(self.storage.update_data, *args, **kwargs)
+
+
+class AsyncAtomicStateRedisStorage(asyncio_storage.StateRedisStorage):
+    """
+    The same as `AtomicStateRedisStorage` for the async runtime.
+    """
+
+    async def set_state_data(
+        self, chat_id, user_id, state, data: dict, *args, **kwargs
+    ) -> bool:
+        if hasattr(state, "name"):
+            state = state.name
+        key = self._get_key(chat_id, user_id, self.prefix, self.separator, *args)
+
+        async def update(pipe) -> None:
+            mapping = _merge_data(await pipe.hget(key, "data"), data, state)
+            pipe.multi()
+            pipe.hset(key, mapping=mapping)
+
+        await self.redis.transaction(update, key)
+        return True
+
+    async def update_data(self, chat_id, user_id, func, *args, **kwargs) -> ty.Any:
+        key = self._get_key(chat_id, user_id, self.prefix, self.separator, *args)
+
+        async def update(pipe) -> ty.Any:
+            result, data = _apply_update(func, await pipe.hget(key, "data"))
+            if data is not None:
+                pipe.multi()
+                pipe.hset(key, "data", data)
+            return result
+
+        return await self.redis.transaction(update, key, value_from_callable=True)
+
+
+def _apply_update(
+    func: ty.Callable[[dict | None], ty.Any], data: str | bytes | None
+) -> tuple[ty.Any, str | None]:
+    """
+    :param func: Update of the data (see `update_data`).
+    :param data: Data of the state in JSON or None if there is no state.
+    :returns: Result of the update and the changed data in JSON,
+        None if it is not changed.
+    """
+    if data is None:
+        return func(None), None
+    changed = json.loads(data)
+    result = func(changed)
+    return result, json.dumps(changed) if changed != json.loads(data) else None
+
+
+def _merge_data(old: str | bytes | None, data: dict, state: str) -> dict:
+    """
+    :param old: Data of the state in JSON or None if there is no state.
+    :param data: Data to add.
+    :param state: New state.
+    :returns: Fields of the state in Redis.
+    """
+    return {"state": state, "data": json.dumps({**json.loads(old or "{}"), **data})}
+
+
+def create_storage(
+    kind: str, url: str, ttl: float, max_entries: int, max_bytes: int
+) -> StateStorageBase:
+    """
+    :param kind: memory | sqlite | redis.
+    :param url: Path to the database file for sqlite, server url for redis.
+        A redis storage works with any server speaking the Redis protocol,
+        connections are pooled. Requires the `redis` package.
+    :param ttl: Seconds a state lives without being touched (memory and sqlite).
+    :param max_entries: Max number of states (memory only).
+    :param max_bytes: Max approximate size of states (memory only).
+    :returns: Storage of states.
+    """
+    if kind == "memory":
+        return ExpiringStateMemoryStorage(ttl, max_entries, max_bytes)
+    if kind == "sqlite":
+        return StateSQLiteStorage(url or "states.db", ttl)
+    if kind == "redis":
+        return AtomicStateRedisStorage(redis_url=url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown states storage: {kind}")
+
+
+def create_async_storage(
+    kind: str, url: str, ttl: float, max_entries: int, max_bytes: int
+) -> asyncio_storage.StateStorageBase:
+    """
+    The same as `create_storage` for the async runtime.
+    """
+    if kind == "redis":
+        return AsyncAtomicStateRedisStorage(redis_url=url or "redis://localhost:6379/0")
+    return AsyncStateStorage(
+        create_storage(kind, url, ttl, max_entries, max_bytes),
+        in_thread=kind != "memory",
+    )
+
+
+def pop_expired(storage, message: Message, bot_id: int) -> bool:
+    """
+    :param storage: Sync or async storage of states.
+    :param message: Message of the user.
+    :param bot_id: Id of the bot.
+    :returns: Whether the state of the user was removed because of limits.
+    """
+    if isinstance(storage, AsyncStateStorage):
+        storage = storage.storage
+    if not isinstance(storage, (ExpiringStateMemoryStorage, StateSQLiteStorage)):
+        return False
+    chat_id, user_id, business_connection_id, bot_id, message_thread_id = (
+        resolve_context(message, bot_id)
+    )
+    return storage.pop_expired(
+        chat_id, user_id, business_connection_id, message_thread_id, bot_id
+    )
+
+
+def update_data(
+    storage, message: Message, bot_id: int, func: ty.Callable[[dict | None], ty.Any]
+) -> ty.Any:
+    """
+    Changes the data of the state of the user atomically, so changes made
+    at once by other threads or processes sharing the storage are not lost.
+    :param storage: Sync or async storage of states (see `create_storage`).
+    :param message: Message of the user.
+    :param bot_id: Id of the bot.
+    :param func: Changes the data in place and returns a result, gets None
+        if the user has no state. May be called again if the data changes.
+    :returns: Result of `func`, awaitable with an async storage.
+    """
+    chat_id, user_id, business_connection_id, bot_id, message_thread_id = (
+        resolve_context(message, bot_id)
+    )
+    return storage.update_data(
+        chat_id, user_id, func, business_connection_id, message_thread_id, bot_id
+    )
+
+
+def set_state_data(
+    storage, message: Message, bot_id: int, state: ty.Any, **data
+) -> ty.Any:
+    """
+    Sets the state of the user and adds the data in one write,
+    instead of a write for each of them.
+    :param storage: Sync or async storage of states (see `create_storage`).
+    :param message: Message of the user.
+    :param bot_id: Id of the bot.
+    :param state: State.
+    :param data: Data to add.
+    :returns: Awaitable with an async storage.
+    """
+    chat_id, user_id, business_connection_id, bot_id, message_thread_id = (
+        resolve_context(message, bot_id)
+    )
+    return storage.set_state_data(
+        chat_id, user_id, state, data, business_connection_id, message_thread_id, bot_id
+    )
@@ -0,0 +1,12 @@
+"""
+
+The sync runtime: TeleBot with a pool of threads, served by Flask or polling.
+Importing the module builds the bot and registers its handlers,
+so the async runtime (see `tg.aio`) is imported without them.
+
+"""
+
+from . import tg_webhook
+from . import filters
+from . import handlers
+from .bot import bot, run_pooling, setup_webhook
@@ -0,0 +1,63 @@
+"""
+
+Sending of decrypted texts.
+Long texts are sent as one .txt document made in memory, shorter ones
+are split in as few messages as possible. Telegram measures messages
+in UTF-16 code units, so the text is split by them in one pass.
+
+"""
+
+from __future__ import annotations
+
+from io import BytesIO
+
+from telebot.types import InputFile
+
+MAX_MESSAGE_LENGTH = 4096  # UTF-16 code units
+TITLE = "This is what I decrypted:"
+FILE_NAME = "decrypted_text.txt"
+
+
+def message_length(text: str) -> int:
+    """
+    :param text: Text.
+    :returns: Length of the text in Telegram.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_text(text: str, size: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    :param text: Text.
+    :param size: Max length of a part in UTF-16 code units.
+    :returns: Parts of the text, surrogate pairs are not split.
+    """
+    data = text.encode("utf-16-le")
+    parts = []
+    start = 0
+    while start < len(data):
+        stop = min(start + size * 2, len(data))
+        # The last unit is the first half of a surrogate pair
+        if stop < len(data) and 0xD8 <= data[stop - 1] <= 0xDB:
+            stop -= 2
+        parts.append(data[start:stop].decode("utf-16-le"))
+        start = stop
+    return parts
+
+
+def pack_messages(text: str, title: str = TITLE) -> list[str]:
+    """
+    :param text: Decrypted text.
+    :param title: Text before it.
+    :returns: Messages with the title and the text.
+    """
+    return split_text(f"{title}\n{text}")
+
+
+def text_document(text: str, file_name: str = FILE_NAME) -> InputFile:
+    """
+    :param text: Decrypted text.
+    :param file_name: Name of the document.
+    :returns: Document with the text.
+    """
+    return InputFile(BytesIO(text.encode("utf-8")), file_name)
@@ -2,7 +2,7 @@ from flask import request, abort
 from telebot.types import Update
 
 from app import app
-from .bot import bot, config, setup_webhook
+from .bot import bot, config, dispatcher, setup_webhook
 
 
 @app.route(f"/{config.tg_bot.webhook.secret_key}", methods=["POST"])
@@ -10,7 +10,10 @@ def telegram_webhook():
     if request.headers.get("content-type") == "application/json":
         json_string = request.get_data().decode("utf-8")
         update = Update.de_json(json_string)
-        bot.process_new_updates([update])
+        if not config.tg_bot.webhook.fast_ack:
+            bot.process_new_updates([update])
+        elif not dispatcher.put(update):
+            abort(503)  # Telegram will deliver the update again later
         return ""
     else:
         abort(403)
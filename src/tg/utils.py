@@ -3,6 +3,8 @@ from __future__ import annotations
 import typing as ty
 import re
 
+from loguru import logger
+
 if ty.TYPE_CHECKING:
     from telebot.types import Message
 
@@ -32,3 +34,17 @@ def get_command_args(text: str) -> str:
 
 class CancelHandler(Exception):
     pass
+
+
+def user_error(err: Exception, text: str = "Internal error") -> RuntimeError:
+    """
+    :param err: Error.
+    :param text: Text of the error shown instead of an unexpected one.
+    :returns: The error if it is meant for the user (RuntimeError), otherwise
+        a new one. Unexpected errors are logged, they may contain secrets,
+        e.g. urls of files with the token of the bot.
+    """
+    if isinstance(err, RuntimeError):
+        return err
+    logger.opt(exception=err).error(text)
+    return RuntimeError(text)
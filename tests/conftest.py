@@ -0,0 +1,61 @@
+"""
+
+Settings of the application for tests, set before it is imported,
+and pictures for tests of the encryption.
+
+"""
+
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+for name, value in {
+    "RUN_IN_HOST": "0",
+    "VERSION": "test",
+    "TG_BOT_TOKEN": "123:test",
+    "LOGGING_FILE": "",
+    "LOGGING_CONSOLE": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+def make_picture(mode: str, fmt: str, size: tuple[int, int], seed: int) -> bytes:
+    """
+    :param mode: Mode of the picture: L, P, RGB or RGBA.
+    :param fmt: Format of the file.
+    :param size: Size of the picture.
+    :param seed: Seed of the noise.
+    :returns: File of a picture of random noise.
+    """
+    channels = {"L": 1, "P": 3, "RGB": 3, "RGBA": 4}[mode]
+    noise = np.random.default_rng(seed).integers(
+        0, 256, (size[1], size[0], channels), dtype=np.uint8
+    )
+    img = Image.fromarray(noise[:, :, 0] if channels == 1 else noise)
+    if mode == "P":
+        img = img.convert("P")
+    file = BytesIO()
+    img.save(file, fmt)
+    return file.getvalue()
+
+
+@pytest.fixture(scope="session")
+def pictures() -> list[bytes]:
+    """
+    Pictures of different modes and formats, their sizes are not powers of 2.
+    """
+    return [
+        make_picture("RGB", "PNG", (37, 23), 1),
+        make_picture("RGBA", "PNG", (64, 48), 2),
+        make_picture("RGB", "JPEG", (100, 75), 3),
+        make_picture("P", "GIF", (50, 41), 4),
+        make_picture("L", "PNG", (33, 65), 5),
+        make_picture("RGB", "BMP", (129, 17), 6),
+    ]
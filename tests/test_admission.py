@@ -0,0 +1,92 @@
+"""
+
+Admission of pictures while they are downloaded: unsuitable files are
+refused by their beginning.
+
+"""
+
+from __future__ import annotations
+
+import pytest
+from PIL import Image
+
+from conftest import make_picture
+from misc import admission
+from misc.admission import MAX_HEADER_SIZE, ImageAdmission
+
+CHUNK = 1024
+
+
+def download(reader: admission.HeaderReader, data: bytes) -> int:
+    """
+    :returns: Bytes fed before the file was refused.
+    :raises: AssertionError if it was not refused.
+    """
+    for start in range(0, len(data), CHUNK):
+        try:
+            reader.feed(data[start : start + CHUNK])
+        except RuntimeError:
+            return start + CHUNK
+    reader.getvalue()
+    raise AssertionError("The file is not refused")
+
+
+@pytest.mark.parametrize(
+    "mode, fmt", [("RGB", "PNG"), ("RGB", "JPEG"), ("P", "GIF"), ("RGB", "BMP")]
+)
+def test_refused_by_header(mode, fmt):
+    picture = make_picture(mode, fmt, (300, 200), 1)
+    assert len(picture) > 4 * CHUNK
+
+    reader = ImageAdmission(len(picture), 300 * 200 - 1).reader()
+    assert download(reader, picture) == CHUNK
+    assert reader.size == (300, 200)
+    with pytest.raises(RuntimeError, match="too big"):
+        ImageAdmission(len(picture), 300 * 200 - 1).reader().feed(picture[:CHUNK])
+
+    reader = ImageAdmission(len(picture), 300 * 200).reader(300 * 200)
+    assert download(reader, picture) == CHUNK  # The text does not fit
+
+    reader = ImageAdmission(len(picture), 300 * 200).reader(100)
+    for start in range(0, len(picture), CHUNK):
+        reader.feed(picture[start : start + CHUNK])
+    assert reader.getvalue() == picture
+
+
+def test_refused_by_file_size():
+    picture = make_picture("RGB", "PNG", (300, 200), 2)
+    reader = ImageAdmission(2 * CHUNK, 300 * 200).reader()
+    assert download(reader, picture) == 3 * CHUNK
+
+
+def test_decompression_bomb(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    picture = make_picture("RGB", "PNG", (300, 200), 3)
+    reader = ImageAdmission(len(picture), 300 * 200).reader()
+    with pytest.raises(RuntimeError, match="too big"):
+        reader.feed(picture[:CHUNK])
+
+
+def test_small_picture():
+    picture = make_picture("L", "GIF", (2, 2), 4)
+    assert len(picture) < admission.MIN_HEADER_SIZE
+    reader = ImageAdmission(CHUNK, 4).reader()
+    reader.feed(picture)
+    assert reader.getvalue() == picture
+    assert reader.size == (2, 2)
+
+
+def test_not_picture(monkeypatch):
+    calls = []
+    image_open = Image.open
+    monkeypatch.setattr(
+        Image, "open", lambda fp: calls.append(fp.tell()) or image_open(fp)
+    )
+    reader = ImageAdmission(10 * MAX_HEADER_SIZE, 10**8).reader()
+    refused_at = download(reader, b"\0" * 10 * MAX_HEADER_SIZE)
+    assert MAX_HEADER_SIZE < refused_at <= MAX_HEADER_SIZE + CHUNK
+    # The header is parsed each time the received part doubles
+    assert len(calls) <= 16
+
+    with pytest.raises(RuntimeError, match="not a picture"):
+        ImageAdmission(CHUNK, 4).reader().getvalue()
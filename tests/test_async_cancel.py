@@ -0,0 +1,113 @@
+"""
+
+/cancel of the async runtime while a job of the chat runs.
+Calls of Telegram and the job are replaced, the dispatcher and the handlers
+are real.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+from telebot.types import Update
+
+import tg.aio  # noqa: F401
+from misc.cancellation import Cancelled
+from tg.aio.bot import bot
+from tg.aio.dispatcher import AsyncUpdateDispatcher
+from tg.aio.handlers import common
+from tg.jobs import jobs
+
+CHAT = 7
+JOB_SECONDS = 2
+
+
+def make_update(update_id: int, text: str | None = None, document: bool = False):
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": CHAT, "type": "private"},
+        "from": {"id": CHAT, "is_bot": False, "first_name": "user"},
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text)}
+            ]
+    if document:
+        message["document"] = {
+            "file_id": "picture",
+            "file_unique_id": "picture",
+            "file_size": 100,
+            "mime_type": "image/png",
+        }
+    return Update.de_json({"update_id": update_id, "message": message})
+
+
+def test_cancel_while_job_runs(monkeypatch):
+    bio = BytesIO()
+    Image.new("RGB", (8, 8)).save(bio, "PNG")
+    sent: list[tuple[float, str, tuple]] = []
+    started_at = time.monotonic()
+
+    def fake(name):
+        async def method(*args, **kwargs):
+            sent.append((time.monotonic() - started_at, name, args))
+            return mock.Mock(message_id=100 + len(sent))
+
+        return method
+
+    for name in ("send_message", "reply_to", "delete_message", "edit_message_text"):
+        monkeypatch.setattr(bot, name, fake(name))
+
+    async def download_image(*args, **kwargs) -> bytes:
+        return bio.getvalue()
+
+    monkeypatch.setattr(common, "download_image", download_image)
+
+    cancelled: dict[object, asyncio.Event] = {}
+    job_results = []
+
+    async def run(func, *args, owner=None, **kwargs):
+        cancelled[owner] = asyncio.Event()
+        try:
+            await asyncio.wait_for(cancelled[owner].wait(), JOB_SECONDS)
+        except asyncio.TimeoutError:
+            job_results.append("done")
+            return "text"
+        job_results.append("cancelled")
+        raise Cancelled()
+
+    def cancel(owner) -> bool:
+        cancelled[owner].set()
+        return True
+
+    monkeypatch.setattr(jobs, "run", run)
+    monkeypatch.setattr(jobs, "cancel", cancel)
+
+    async def main():
+        dispatcher = AsyncUpdateDispatcher(bot, 10)
+        updates = [
+            make_update(1, "/decrypt"),
+            make_update(2, "key"),
+            make_update(3, document=True),
+        ]
+        for update in updates:
+            await dispatcher.put(update)
+        await asyncio.sleep(0.5)
+        await dispatcher.put(make_update(4, "/cancel"))
+        await asyncio.sleep(0.5)
+
+    asyncio.run(main())
+
+    answered = {args[1]: at for at, name, args in sent if len(args) > 1}
+    assert "Added to queue" in answered
+    assert answered["Operation cancelled"] < JOB_SECONDS / 2
+    assert job_results == ["cancelled"]
+    assert not any("decrypted" in str(args) for _, _, args in sent)
@@ -0,0 +1,184 @@
+"""
+
+Albums of the sync runtime: pictures are collected in the state of
+the conversation, the batch is processed in turn with the updates
+of the chat, and /cancel stops it.
+Calls of Telegram and the jobs are replaced, the dispatcher, the storages
+and the handlers are real.
+
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from functools import partial
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from PIL import Image
+from telebot.types import Message, Update
+
+import tg.sync  # noqa: F401
+from misc.cancellation import Cancelled
+from tg.batches import PictureBatches
+from tg.bot import bot, dispatcher, states_storage
+from tg.handlers import common
+from tg.jobs import batches, jobs
+from tg.storages import StateSQLiteStorage
+
+DOWNLOAD_SECONDS = 0.5
+
+_update_ids = iter(range(1, 1_000_000))
+# Every test has its own chat, so rate limits of commands are not shared
+_chat_ids = iter(range(8, 1_000))
+
+
+def make_update(
+    chat_id: int, text: str | None = None, album: str | None = None
+) -> Update:
+    update_id = next(_update_ids)
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text)}
+            ]
+    if album is not None:
+        message["media_group_id"] = album
+        message["document"] = {
+            "file_id": f"picture{update_id}",
+            "file_unique_id": f"picture{update_id}",
+            "file_size": 100,
+            "mime_type": "image/png",
+            "file_name": f"picture{update_id}.png",
+        }
+    return Update.de_json({"update_id": update_id, "message": message})
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """
+    Replaced calls of Telegram, downloads and jobs.
+    :returns: Id of the chat, sent answers and submitted jobs.
+    """
+    chat_id = next(_chat_ids)
+    bio = BytesIO()
+    Image.new("RGB", (8, 8)).save(bio, "PNG")
+    sent: list[tuple[str, tuple]] = []
+    submitted: list[dict] = []
+
+    def fake(name):
+        def method(*args, **kwargs):
+            sent.append((name, args))
+            return mock.Mock(message_id=1000 + len(sent))
+
+        return method
+
+    for name in ("send_message", "reply_to", "delete_message", "send_sticker"):
+        monkeypatch.setattr(bot, name, fake(name))
+
+    def download_image(*args, **kwargs) -> bytes:
+        time.sleep(DOWNLOAD_SECONDS)
+        return bio.getvalue()
+
+    def submit(func, *args, on_done, on_error, owner=None, **kwargs):
+        submitted.append(dict(owner=owner, on_done=on_done, on_error=on_error))
+
+    def cancel(owner) -> bool:
+        for job in submitted:
+            if job["owner"] == owner:
+                job["on_error"](Cancelled())
+        return True
+
+    monkeypatch.setattr(common, "download_image", download_image)
+    monkeypatch.setattr(jobs, "submit", submit)
+    monkeypatch.setattr(jobs, "cancel", cancel)
+    monkeypatch.setattr(batches, "delay", 0.2)
+    yield chat_id, sent, submitted
+    states_storage.delete_state(chat_id, chat_id, bot_id=bot.bot_id)
+
+
+def texts(sent: list[tuple[str, tuple]]) -> list[str]:
+    return [args[1] for _, args in sent if len(args) > 1 and isinstance(args[1], str)]
+
+
+def put(*updates: Update) -> None:
+    for update in updates:
+        assert dispatcher.put(update, block=True)
+
+
+def test_album_is_one_batch(chat):
+    chat_id, sent, submitted = chat
+    put(make_update(chat_id, "/decrypt"), make_update(chat_id, "key"))
+    put(*(make_update(chat_id, album="a") for _ in range(3)))
+    time.sleep(0.2 + 3 * DOWNLOAD_SECONDS + 0.5)
+    assert texts(sent).count("Added to queue") == 1
+    assert len(submitted) == 3
+
+
+def test_cancel_while_downloading(chat):
+    chat_id, sent, submitted = chat
+    put(make_update(chat_id, "/decrypt"), make_update(chat_id, "key"))
+    put(*(make_update(chat_id, album="b") for _ in range(2)))
+    time.sleep(0.2 + DOWNLOAD_SECONDS / 2)  # The first picture is downloaded
+    put(make_update(chat_id, "/cancel"))
+    time.sleep(2 * DOWNLOAD_SECONDS + 0.5)
+
+    answered = texts(sent)
+    assert answered.index("Added to queue") < answered.index("Operation cancelled")
+    assert len(submitted) == 2  # Cancelled by /cancel after the batch
+    assert not any("decrypted" in text for text in answered)
+
+
+def test_cancelled_by_another_process(chat):
+    chat_id, sent, submitted = chat
+    put(make_update(chat_id, "/decrypt"), make_update(chat_id, "key"))
+    put(make_update(chat_id, album="c"))
+    time.sleep(0.2 + DOWNLOAD_SECONDS / 2)
+    # The state is deleted by /cancel in another process sharing the storage
+    states_storage.delete_state(chat_id, chat_id, bot_id=bot.bot_id)
+    time.sleep(DOWNLOAD_SECONDS + 0.5)
+
+    assert "Added to queue" not in texts(sent)
+    assert not submitted
+
+
+def test_parts_of_album_in_processes(tmp_path):
+    chat_id = next(_chat_ids)
+    # Two storages of one file are two processes, every thread adds pictures
+    storages = [StateSQLiteStorage(str(tmp_path / "states.db")) for _ in range(2)]
+    storages[0].set_state(chat_id, chat_id, "waiting")
+    batches = PictureBatches(60)
+    message = make_update(chat_id, album="d").message
+
+    def add(storage: StateSQLiteStorage) -> None:
+        for _ in range(20):
+            storage.update_data(chat_id, chat_id, partial(batches.add, message))
+
+    threads = [
+        threading.Thread(target=add, args=(storage,))
+        for storage in storages
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    data = storages[1].get_data(chat_id, chat_id)
+    assert len(data["batch"]) == 2 * 4 * 20
+    # Not complete yet
+    assert storages[1].update_data(chat_id, chat_id, batches.take) is None
+    data["batch_until"] = time.time()
+    storages[1].save(chat_id, chat_id, data)
+    taken = storages[0].update_data(chat_id, chat_id, batches.take)
+    assert [type(msg) for msg in taken] == [Message] * 160
+    assert storages[1].get_data(chat_id, chat_id) == {}
@@ -0,0 +1,113 @@
+"""
+
+Encryption and decryption in many threads at once give the same results
+as one after another: calls do not share generators or other state.
+
+"""
+
+from __future__ import annotations
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import product
+
+import numpy as np
+import pytest
+
+from misc import crypto_img
+from misc.crypto_img import (
+    COMPRESSED_FORMAT,
+    DENSE_FORMAT,
+    HEADER_FORMAT,
+    LEGACY_FORMAT,
+    PERMUTATION_FORMAT,
+    chunk_size,
+    decrypt,
+    encrypt,
+    map_chunks,
+)
+from misc.pixel_order import LegacyOrder
+
+THREADS = 16
+ROUNDS = 4
+FORMATS = [
+    (LEGACY_FORMAT, 2),
+    (PERMUTATION_FORMAT, 2),
+    (HEADER_FORMAT, 2),
+    (COMPRESSED_FORMAT, 2),
+    (DENSE_FORMAT, 1),
+    (DENSE_FORMAT, 4),
+]
+
+
+def round_trip(
+    text: str, key: str, picture: bytes, version: int, bits: int, threads: int = 1
+):
+    img = encrypt(text, key, BytesIO(picture), version, bits, threads=threads)
+    file = BytesIO()
+    img.save(file, "PNG")
+    data = file.getvalue()
+    return data, decrypt(key, BytesIO(data), version, threads=threads)
+
+
+@pytest.fixture
+def switch_often():
+    """
+    Threads are switched as often as possible, so calls are interleaved
+    even on one core.
+    """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_parallel_calls_match_sequential(pictures, switch_often):
+    tasks = [
+        (f"text {i} Ёк макарек " * (i % 5 + 1), f"key {i % 7}", picture, *fmt)
+        for i, (picture, fmt) in enumerate(product(pictures, FORMATS))
+    ]
+    expected = [round_trip(*task) for task in tasks]
+    assert [text for _, text in expected] == [task[0] for task in tasks]
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        for _ in range(ROUNDS):
+            futures = [pool.submit(round_trip, *task) for task in tasks]
+            assert [future.result() for future in futures] == expected
+
+
+def test_interleaved_legacy_orders():
+    size = (101, 67)
+    expected = [np.column_stack(LegacyOrder(key, size).take(3000)) for key in "ab"]
+    orders = [LegacyOrder(key, size) for key in "ab"]
+    taken = [[], []]
+    for _ in range(300):
+        for order, result in zip(orders, taken):
+            result.append(np.column_stack(order.take(10)))
+    for result, sequence in zip(taken, expected):
+        assert np.array_equal(np.concatenate(result), sequence)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(crypto_img, "MIN_CHUNK_SIZE", 3)
+
+
+@pytest.mark.parametrize("threads", [2, 3, 8])
+def test_chunks_of_threads_match_one_thread(small_chunks, switch_often, threads):
+    def square(start: int, stop: int) -> np.ndarray:
+        return np.arange(start, stop) ** 2
+
+    for count in (1, 5, 100, 1001):
+        expected = np.concatenate(map_chunks(square, count))
+        result = map_chunks(square, count, threads)
+        assert len(result) == -(-count // chunk_size(count, threads))
+        assert np.array_equal(np.concatenate(result), expected)
+
+
+@pytest.mark.parametrize("threads", [2, 5])
+def test_threads_give_same_pictures(pictures, small_chunks, threads):
+    for i, (picture, fmt) in enumerate(product(pictures, FORMATS)):
+        task = (f"text {i} Ёк макарек " * (i % 5 + 4), f"key {i % 7}", picture, *fmt)
+        assert round_trip(*task, threads) == round_trip(*task)
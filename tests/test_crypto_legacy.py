@@ -0,0 +1,106 @@
+"""
+
+The legacy format against the original algorithm: pictures are byte-identical
+and the pixel sequence is the same as the one of `random.randrange`.
+`reference_encrypt` and `reference_decrypt` are the original functions
+working pixel by pixel, with a private generator instead of the global one.
+
+"""
+
+from __future__ import annotations
+
+import random
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from misc.crypto_img import LEGACY_FORMAT, decrypt, encrypt
+from misc.pixel_order import LegacyOrder, get_seed
+
+TEXTS = ["Hello", "Привет, мир! Ёк макарек", "x" * 300, "1, 2, 3: ok?"]
+KEYS = ["k", "секрет", "123"]
+
+
+def reference_pixels(key: str, size: tuple[int, int]):
+    rand = random.Random(get_seed(key))
+    used = set()
+    while True:
+        pix = (rand.randrange(0, size[0]), rand.randrange(0, size[1]))
+        if pix not in used:
+            used.add(pix)
+            yield pix
+
+
+def reference_encrypt(text: str, key: str, image: bytes) -> Image.Image:
+    img = Image.open(BytesIO(image)).convert("RGB")
+    if len(text) >= img.size[0] * img.size[1]:
+        raise RuntimeError("The picture is too small")
+    for char, pix in zip(text + "\0", reference_pixels(key, img.size)):
+        char = ord(char)
+        if char > 1000:
+            char -= 890
+        r, g, b = img.getpixel(pix)
+        # The last 3 bits of red, 2 of green and 3 of blue
+        r = r & 0xF8 | (char & 0xE0) >> 5
+        g = g & 0xFC | (char & 0x18) >> 3
+        b = b & 0xF8 | char & 0x7
+        img.putpixel(pix, (r, g, b))
+    return img
+
+
+def reference_decrypt(key: str, image: bytes) -> str:
+    img = Image.open(BytesIO(image)).convert("RGB")
+    result = ""
+    for pix in reference_pixels(key, img.size):
+        r, g, b = img.getpixel(pix)
+        char = (r & 0x7) << 5 | (g & 0x3) << 3 | b & 0x7
+        if char > 130:
+            char += 890
+        if char == 0:
+            return result
+        result += chr(char)
+
+
+def to_png(img: Image.Image) -> bytes:
+    file = BytesIO()
+    img.save(file, "PNG")
+    return file.getvalue()
+
+
+@pytest.mark.parametrize("key", KEYS)
+@pytest.mark.parametrize("text", TEXTS)
+def test_encrypt_is_byte_identical(pictures, text, key):
+    for picture in pictures:
+        expected = to_png(reference_encrypt(text, key, picture))
+        result = to_png(encrypt(text, key, BytesIO(picture), version=LEGACY_FORMAT))
+        assert result == expected
+        assert decrypt(key, BytesIO(result)) == reference_decrypt(key, result) == text
+
+
+def test_too_long_text(pictures):
+    img = Image.open(BytesIO(pictures[0]))
+    text = "x" * (img.size[0] * img.size[1])
+    with pytest.raises(RuntimeError):
+        reference_encrypt(text, "k", pictures[0])
+    with pytest.raises(RuntimeError):
+        encrypt(text, "k", BytesIO(pictures[0]), version=LEGACY_FORMAT)
+
+
+@pytest.mark.parametrize(
+    "size", [(1, 1), (2, 3), (37, 23), (255, 257), (1000, 3), (4096, 4097)]
+)
+@pytest.mark.parametrize("key", KEYS)
+def test_pixel_order_replays_randrange(size, key):
+    # Almost all pixels of small pictures, so many pairs are repeated
+    count = min(size[0] * size[1], 5000)
+    expected = reference_pixels(key, size)
+    expected = np.array([next(expected) for _ in range(count)])
+
+    order = LegacyOrder(key, size)
+    taken = []
+    for step in (1, 7, 100, count):  # Different batches
+        taken.append(np.column_stack(order.take(step)))
+    taken = np.concatenate(taken)[:count]
+    assert np.array_equal(taken, expected)
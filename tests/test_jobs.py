@@ -0,0 +1,171 @@
+"""
+
+The executor of jobs with real worker processes.
+
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import make_picture
+from misc import crypto_img, jobs
+from misc.jobs import JobExecutor, JobTimeout, decrypt_job, encrypt_job
+from misc.scheduling import BudgetExceeded
+from misc.strips import BYTES_PER_PIXEL
+
+TIMEOUT = 0.5
+STUCK_SECONDS = 2
+
+
+def stuck_job(cancel=None, progress=None) -> str:
+    # Does not check the cancellation token
+    time.sleep(STUCK_SECONDS)
+    return "late"
+
+
+def quick_job(value: str, cancel=None, progress=None) -> str:
+    return value
+
+
+def slow_job(cancel=None, progress=None) -> str:
+    time.sleep(0.3)
+    return "done"
+
+
+def cached_decrypt_job(
+    key: str, image: bytes, image_id: str, cancel=None, progress=None
+) -> tuple[str, bool]:
+    time.sleep(0.3)  # Jobs of both pictures run at once
+    hit = jobs._pixels_cache.get(image_id) is not None
+    return decrypt_job(key, image, image_id, cancel=cancel, progress=progress), hit
+
+
+class Results:
+    """
+    Results of a job and the time they were delivered.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.value = self.error = None
+        self._delivered = threading.Event()
+
+    def on_done(self, value) -> None:
+        self.value = value
+        self._deliver()
+
+    def on_error(self, err: RuntimeError) -> None:
+        self.error = err
+        self._deliver()
+
+    def _deliver(self) -> None:
+        self.elapsed = time.monotonic() - self.started
+        self._delivered.set()
+
+    def wait(self) -> Results:
+        assert self._delivered.wait(10)
+        return self
+
+
+def start_executor(workers: int, timeout: float = TIMEOUT, **kwargs) -> JobExecutor:
+    executor = JobExecutor(
+        workers, 4, timeout, mp_context=multiprocessing.get_context("fork"), **kwargs
+    )
+    executor.start()
+    return executor
+
+
+def submit(executor: JobExecutor, func, *args, **kwargs) -> Results:
+    results = Results()
+    executor.submit(
+        func, *args, on_done=results.on_done, on_error=results.on_error, **kwargs
+    )
+    return results
+
+
+def test_timeout_of_job_ignoring_cancel():
+    executor = start_executor(1)
+    stuck = submit(executor, stuck_job).wait()
+    assert isinstance(stuck.error, JobTimeout)
+    assert stuck.elapsed < TIMEOUT + 0.5
+
+    # The process is given to the next job when the stuck one stops
+    quick = submit(executor, quick_job, "ok").wait()
+    assert quick.value == "ok"
+    assert quick.elapsed > STUCK_SECONDS - stuck.elapsed - 0.5
+    assert submit(executor, quick_job, "again").wait().value == "again"
+    executor.shutdown()
+
+
+def test_budget_is_charged_by_work():
+    executor = start_executor(1, 10, user_budget=60)  # 1 megapixel-second a second
+    # Not charged before the work is known
+    slow = submit(executor, slow_job, user="a", cost=300)
+    quick = submit(executor, quick_job, "ok", user="a", cost=300)
+    assert slow.wait().value == "done"
+    assert quick.wait().value == "ok"
+    time.sleep(0.1)  # The processes are released after the results
+
+    # 300 MP for 0.3 s overdraw the budget of 60
+    with pytest.raises(BudgetExceeded):
+        submit(executor, quick_job, "refused", user="a", cost=1)
+    assert submit(executor, quick_job, "ok", user="b", cost=1).wait().value == "ok"
+    executor.shutdown()
+
+
+def test_retry_hits_pixels_cache(pictures):
+    executor = start_executor(2, 10, pixels_cache_size=1 << 20)
+    images = {
+        image_id: encrypt_job(image_id, "k", picture).data
+        for image_id, picture in zip("ab", pictures)
+    }
+    for attempt in range(3):
+        # Other pictures are decrypted at the same time in other processes
+        order = list(images) if attempt % 2 else list(images)[::-1]
+        results = {
+            image_id: submit(
+                executor,
+                cached_decrypt_job,
+                "k",
+                images[image_id],
+                image_id,
+                affinity=image_id,
+            )
+            for image_id in order
+        }
+        for image_id, result in results.items():
+            assert result.wait().value == (image_id, attempt > 0)
+    executor.shutdown()
+
+
+def rising(values: list[float]) -> bool:
+    return len(values) > 2 and np.all(np.diff(values) > 0) and 0 < values[-1] <= 1
+
+
+@pytest.mark.parametrize("huge", [False, True])
+def test_progress_rises(monkeypatch, huge):
+    monkeypatch.setattr(crypto_img, "CHUNK_SIZE", 500)
+    picture = make_picture("RGB", "PNG", (300, 200), 7)
+    # Bigger pictures are processed in strips
+    memory_budget = 300 * 200 * BYTES_PER_PIXEL - 1 if huge else 0
+    text = "".join(map(str, range(2000)))
+
+    encrypted = []
+    image = encrypt_job(
+        text, "k", picture, memory_budget=memory_budget, progress=encrypted.append
+    )
+    assert rising(encrypted)
+    if not huge:
+        assert encrypted[-1] < 0.9  # The picture is encoded after that
+
+    decrypted = []
+    assert decrypt_job("k", image.data, progress=decrypted.append) == text
+    assert rising(decrypted)
+    assert decrypted[-1] == pytest.approx(1)
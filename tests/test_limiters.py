@@ -0,0 +1,105 @@
+"""
+
+Rate limits of commands in memory and in Redis.
+Tests of Redis use fakeredis and are skipped without it.
+
+"""
+
+from __future__ import annotations
+
+import time
+import types
+
+import pytest
+
+from tg import limiters
+from tg.limiters import MemoryRateLimiter, RedisRateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch) -> types.SimpleNamespace:
+    """
+    Time of the memory limiter, moved by tests.
+    """
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        limiters, "time", types.SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    return clock
+
+
+def test_memory_limit(clock):
+    limiter = MemoryRateLimiter(100)
+    assert limiter.hit("a", 5) == (0, False)
+    clock.now += 2
+    assert limiter.hit("a", 5) == (3, False)
+    assert limiter.hit("a", 5) == (3, True)  # Told to wait already
+    assert limiter.hit("b", 5) == (0, False)
+    clock.now += 3
+    assert limiter.hit("a", 5) == (0, False)
+
+
+def test_memory_entries(clock):
+    limiter = MemoryRateLimiter(3)
+    for key in "abcd":
+        limiter.hit(key, 10)
+    # The oldest entry is dropped, which only loosens its limit
+    assert limiter.hit("a", 10) == (0, False)
+    assert limiter.hit("d", 10)[0] == 10
+
+    clock.now += 20
+    limiter.sweep()
+    assert not limiter._entries
+
+
+class ExpiringRedis:
+    """
+    Redis in which a key expires right after it is found by `SET NX`.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.expired = 0
+
+    def set(self, key, *args, nx=False, **kwargs):
+        result = self.redis.set(key, *args, nx=nx, **kwargs)
+        if nx and not result and not self.expired:
+            self.expired += 1
+            self.redis.delete(key)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.redis, name)
+
+
+@pytest.fixture
+def redis_limiter() -> RedisRateLimiter:
+    fakeredis = pytest.importorskip("fakeredis")
+    limiter = RedisRateLimiter.__new__(RedisRateLimiter)
+    limiter.redis = fakeredis.FakeRedis()
+    limiter.prefix = "rate_limit"
+    return limiter
+
+
+def test_redis_limit(redis_limiter):
+    assert redis_limiter.hit("a", 0.3) == (0, False)
+    delay, warned = redis_limiter.hit("a", 0.3)
+    assert 0.2 < delay <= 0.3 and not warned
+    assert redis_limiter.hit("a", 0.3)[1]  # Told to wait already
+    assert redis_limiter.hit("b", 0.3) == (0, False)
+    time.sleep(0.35)
+    assert redis_limiter.hit("a", 0.3) == (0, False)
+
+
+def test_redis_key_expires_between_commands(redis_limiter):
+    redis_limiter.redis = ExpiringRedis(redis_limiter.redis)
+    assert redis_limiter.hit("a", 10) == (0, False)
+    assert redis_limiter.hit("a", 10) == (0, False)  # Expired after SET NX
+    assert redis_limiter.redis.expired == 1
+    assert redis_limiter.hit("a", 10)[0] > 9
+
+
+def test_redis_key_without_ttl(redis_limiter):
+    redis_limiter.redis.set("rate_limit:a", 0)
+    assert redis_limiter.hit("a", 10) == (10, False)
+    assert redis_limiter.hit("a", 10)[0] > 9
@@ -0,0 +1,106 @@
+"""
+
+Budgets of users and the fair order of their jobs.
+
+"""
+
+from __future__ import annotations
+
+import types
+
+import pytest
+
+from misc import scheduling
+from misc.scheduling import BudgetExceeded, CostBudgets, FairQueue
+
+
+@pytest.fixture
+def clock(monkeypatch) -> types.SimpleNamespace:
+    """
+    Time of the budgets, moved by tests.
+    """
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        scheduling, "time", types.SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    return clock
+
+
+def test_budget_refusal_and_refill(clock):
+    budgets = CostBudgets(60)  # 1 megapixel-second per second
+    budgets.check("a")
+    budgets.charge("a", 10, 3)  # 30 of 60 are left
+    budgets.check("a")
+    budgets.charge("a", 50, 1)  # Overdrawn by 20
+    with pytest.raises(BudgetExceeded, match="in 20 seconds"):
+        budgets.check("a")
+    budgets.check("b")  # Other users are not affected
+
+    clock.now += 19.5
+    with pytest.raises(BudgetExceeded, match="in 1 seconds"):
+        budgets.check("a")
+    clock.now += 1
+    budgets.check("a")
+
+    # The bucket is not filled over its capacity
+    clock.now += 3600
+    budgets.charge("a", 60, 1)
+    with pytest.raises(BudgetExceeded):
+        budgets.check("a")
+
+
+def test_full_buckets_are_forgotten(clock):
+    budgets = CostBudgets(60)
+    for user in range(100):
+        budgets.charge(user, 1, 1)
+    clock.now += 2
+    budgets.charge("a", 1, 1)
+    assert list(budgets._buckets) == ["a"]
+
+
+def drain(queue: FairQueue) -> list:
+    return [queue.pop() for _ in range(len(queue))]
+
+
+def test_fair_queue_interleaves_users():
+    queue = FairQueue()
+    for i in range(3):
+        queue.push("heavy", 50, f"heavy{i}")
+    for i in range(6):
+        queue.push("light", 10, f"light{i}")
+    # Light jobs are not stuck behind heavy ones, in proportion to the costs
+    assert drain(queue) == [
+        "heavy0",
+        "light0",
+        "light1",
+        "light2",
+        "light3",
+        "light4",
+        "heavy1",
+        "light5",
+        "heavy2",
+    ]
+
+
+def test_fair_queue_keeps_order_of_user():
+    queue = FairQueue()
+    for i in range(5):
+        queue.push("a", i, i)
+    assert queue.index(lambda item: item == 3) == 3
+    assert drain(queue) == list(range(5))
+    with pytest.raises(ValueError):
+        queue.index(lambda item: True)
+
+
+def test_fair_queue_gives_no_credit_to_new_users():
+    queue = FairQueue()
+    for i in range(4):
+        queue.push("busy", 10, f"busy{i}")
+    assert len(drain(queue)) == 4
+
+    # A new user does not get the turns of the time it was not there
+    for i in range(4, 6):
+        queue.push("busy", 10, f"busy{i}")
+    for i in range(3):
+        queue.push("new", 10, f"new{i}")
+    assert drain(queue) == ["new0", "busy4", "new1", "busy5", "new2"]
@@ -0,0 +1,156 @@
+"""
+
+Storages of conversation states: expiration of states, limits
+of the memory storage and states set with their data in one write.
+
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+
+import pytest
+
+from tg.storages import ExpiringStateMemoryStorage, StateSQLiteStorage
+
+TTL = 0.3
+
+
+def memory_storage(tmp_path, ttl: float = TTL) -> ExpiringStateMemoryStorage:
+    return ExpiringStateMemoryStorage(ttl, 100, 1 << 20)
+
+
+def sqlite_storage(tmp_path, ttl: float = TTL) -> StateSQLiteStorage:
+    return StateSQLiteStorage(str(tmp_path / "states.db"), ttl)
+
+
+@pytest.fixture(params=[memory_storage, sqlite_storage])
+def storage(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def test_state_with_data(storage):
+    storage.set_state_data(1, 1, "waiting_for_key", {"text": "hi"})
+    storage.set_state_data(1, 1, "waiting_for_img", {"key": "k"})
+    assert storage.get_state(1, 1) == "waiting_for_img"
+    assert storage.get_data(1, 1) == {"text": "hi", "key": "k"}
+    assert storage.get_state(2, 1) is None
+    assert storage.get_data(2, 1) == {}
+
+
+def test_state_expires(storage):
+    storage.set_state_data(1, 1, "waiting", {"key": "k"})
+    storage.set_state(2, 2, "waiting")
+    assert not storage.pop_expired(1, 1)
+    time.sleep(TTL * 1.5)
+
+    assert storage.get_state(1, 1) is None
+    assert storage.get_data(1, 1) == {}
+    assert storage.pop_expired(1, 1)
+    assert not storage.pop_expired(1, 1)  # The user is told once
+    assert storage.pop_expired(2, 2)
+
+    # A new conversation does not get the data of the expired one
+    storage.set_state(1, 1, "waiting")
+    assert storage.get_data(1, 1) == {}
+
+
+def test_changes_prolong_state(storage):
+    storage.set_state(1, 1, "waiting")
+    for value in range(3):
+        time.sleep(TTL * 0.6)
+        storage.set_data(1, 1, "value", value)
+    assert storage.get_state(1, 1) == "waiting"
+    assert storage.get_data(1, 1) == {"value": 2}
+    assert not storage.pop_expired(1, 1)
+
+
+def test_expired_data_is_not_changed(storage):
+    storage.set_state_data(1, 1, "waiting", {"key": "k"})
+    time.sleep(TTL * 1.5)
+    with pytest.raises(RuntimeError):
+        storage.set_data(1, 1, "key", "other")
+    assert not storage.save(1, 1, {"key": "other"})
+    assert storage.update_data(1, 1, lambda data: data) is None
+
+
+def test_no_ttl(tmp_path):
+    storage = sqlite_storage(tmp_path, 0)
+    storage.set_state(1, 1, "waiting")
+    storage.sweep()
+    assert storage.get_state(1, 1) == "waiting"
+    assert not storage.pop_expired(1, 1)
+
+
+def test_sqlite_sweep(tmp_path):
+    storage = sqlite_storage(tmp_path)
+    storage.sweep_interval = 0
+    storage.set_state(1, 1, "waiting")
+    time.sleep(TTL * 1.5)
+    storage.set_state(2, 2, "waiting")  # Expired, but the user may be told
+    assert storage.pop_expired(1, 1)
+
+    storage.set_state(1, 1, "waiting")
+    time.sleep(TTL * 2.5)
+    storage.set_state(2, 2, "waiting")  # Expired long ago, deleted
+    assert not storage.pop_expired(1, 1)
+    assert storage._execute("SELECT COUNT(*) FROM states").fetchone()[0] == 1
+
+
+def test_sqlite_table_of_earlier_version(tmp_path):
+    connection = sqlite3.connect(tmp_path / "states.db")
+    connection.execute(
+        "CREATE TABLE states ("
+        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+    )
+    connection.execute(
+        "INSERT INTO states VALUES ('telebot:1:1', 'waiting', '{\"key\": \"k\"}')"
+    )
+    connection.commit()
+    connection.close()
+
+    storage = sqlite_storage(tmp_path)
+    assert storage.get_state(1, 1) == "waiting"
+    assert storage.get_data(1, 1) == {"key": "k"}
+
+
+def test_memory_sweep():
+    storage = ExpiringStateMemoryStorage(TTL, 100, 1 << 20)
+    storage.set_state(1, 1, "waiting")
+    time.sleep(TTL * 1.5)
+    storage.set_state(2, 2, "waiting")
+    storage.sweep()
+    assert list(storage.data) == [storage._key(2, 2)]
+    assert storage.pop_expired(1, 1)
+
+
+def test_memory_limits():
+    storage = ExpiringStateMemoryStorage(60, 3, 1 << 20)
+    for user in range(5):
+        storage.set_state(user, user, "waiting")
+    storage.get_state(2, 2)  # The least recently used are removed
+    storage.set_state(5, 5, "waiting")
+    assert [storage.get_state(user, user) for user in range(6)] == [
+        None,
+        None,
+        "waiting",
+        None,
+        "waiting",
+        "waiting",
+    ]
+    assert [storage.pop_expired(user, user) for user in range(6)] == [
+        True,
+        True,
+        False,
+        True,
+        False,
+        False,
+    ]
+
+    storage = ExpiringStateMemoryStorage(60, 100, 200)
+    storage.set_state_data(1, 1, "waiting", {"text": "x" * 100})
+    storage.set_state_data(2, 2, "waiting", {"text": "x" * 100})
+    assert storage.get_state(1, 1) is None
+    assert storage.get_data(2, 2) == {"text": "x" * 100}
+    assert storage.pop_expired(1, 1)